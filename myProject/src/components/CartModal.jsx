@@ -2,7 +2,6 @@ import React from "react";
 import { X, Plus, Minus, Trash2 } from "lucide-react";
 import { toast } from "react-toastify";
 import PropTypes from "prop-types";
-import axios from "axios";
 
 const CartModal = ({
   isOpen,
@@ -21,39 +20,19 @@ const CartModal = ({
     );
   };
 
-  const handleQuantityChange = async (itemId, newQuantity) => {
+  const handleQuantityChange = (itemId, newQuantity) => {
     if (newQuantity < 1) return;
 
-    try {
-      // Get the current item
-      const item = cartItems.find((item) => item.id === itemId);
-      if (!item || !item.batch_id) return;
+    const item = cartItems.find((item) => item.id === itemId);
+    if (!item) return;
 
-      // Check batch quantity
-      const response = await axios.get(
-        `http://127.0.0.1:8000/api/product/${itemId}/batches/active/`
-      );
-      const batches = response.data;
-      const currentBatch = batches.find((batch) => batch.id === item.batch_id);
-
-      if (!currentBatch) {
-        toast.error("Batch no longer available");
-        onRemoveItem(itemId);
-        return;
-      }
-
-      if (newQuantity > currentBatch.quantity) {
-        toast.error(
-          `Only ${currentBatch.quantity} items available in this batch`
-        );
-        return;
-      }
-
-      onUpdateCart(itemId, newQuantity);
-    } catch (error) {
-      console.error("Error checking batch quantity:", error);
-      toast.error("Failed to update quantity");
+    // The stock is checked again when the order is placed
+    if (item.stock !== undefined && newQuantity > item.stock) {
+      toast.error(`Only ${item.stock} items available`);
+      return;
     }
+
+    onUpdateCart(itemId, newQuantity);
   };
 
   const handleRemoveItem = (itemId) => {
@@ -161,7 +140,7 @@ CartModal.propTypes = {
       price: PropTypes.number.isRequired,
       quantity: PropTypes.number.isRequired,
       image: PropTypes.string,
-      batch_id: PropTypes.number,
+      stock: PropTypes.number,
     })
   ).isRequired,
   onUpdateCart: PropTypes.func.isRequired,
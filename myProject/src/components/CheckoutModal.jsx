@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import { X } from "lucide-react";
 import { toast } from "react-toastify";
 import axios from "axios";
@@ -13,6 +13,9 @@ const CheckoutModal = ({ isOpen, onClose, cartItems, onOrderComplete }) => {
   const [notes, setNotes] = useState("");
   const [prescriptionFile, setPrescriptionFile] = useState(null);
   const [paymentProof, setPaymentProof] = useState(null);
+  // Sent as Idempotency-Key; kept while the same order is retried so the
+  // server places it only once
+  const idempotency = useRef(null);
   const { user } = useAuth();
 
   if (!isOpen) return null;
@@ -31,7 +34,7 @@ const CheckoutModal = ({ isOpen, onClose, cartItems, onOrderComplete }) => {
 
     // Validate cart items
     const invalidItems = cartItems.filter(
-      (item) => !item.batch_id || !item.quantity || !item.price
+      (item) => !item.id || !item.quantity
     );
     if (invalidItems.length > 0) {
       toast.error("Invalid cart items detected. Please try again.");
@@ -60,10 +63,10 @@ const CheckoutModal = ({ isOpen, onClose, cartItems, onOrderComplete }) => {
 
       // Add order data
       const orderData = {
+        // Batches and prices are assigned by the server
         order_items: cartItems.map((item) => ({
-          batch_id: parseInt(item.batch_id),
+          product_id: item.id,
           quantity: parseInt(item.quantity),
-          price_at_time: parseFloat(item.price),
         })),
         payment_method: paymentMethod,
         delivery_method: "PICKUP",
@@ -83,14 +86,46 @@ const CheckoutModal = ({ isOpen, onClose, cartItems, onOrderComplete }) => {
         formData.append("payment_proof", paymentProof);
       }
 
+      // A changed order gets a new key, a retry of the same one reuses it
+      const signature = JSON.stringify([
+        orderData,
+        formData.get("prescription_file")?.name,
+        formData.get("payment_proof")?.name,
+      ]);
+      if (idempotency.current?.signature !== signature) {
+        idempotency.current = { key: crypto.randomUUID(), signature };
+      }
+
       // Submit order with prescription
-      await axios.post("http://127.0.0.1:8000/api/orders/", formData, {
+      const response = await axios.post("http://127.0.0.1:8000/api/orders/", formData, {
         headers: {
           "Content-Type": "multipart/form-data",
           Authorization: `Bearer ${user.accessToken}`,
+          "Idempotency-Key": idempotency.current.key,
         },
       });
 
+      idempotency.current = null;
+
+      // 202: the order was queued and its stock is taken shortly after
+      if (response.status === 202) {
+        const intake = await waitForIntake(response.data.status_url);
+        if (intake?.status === "rejected") {
+          toast.error(
+            intake.errors.join(", ") || "Your order could not be placed."
+          );
+          return;
+        }
+        if (!intake) {
+          toast.info(
+            "Your order is being confirmed. Check your order history for its status."
+          );
+          onOrderComplete();
+          onClose();
+          return;
+        }
+      }
+
       toast.success("Order placed successfully!");
       onOrderComplete();
       onClose();
@@ -118,6 +153,20 @@ const CheckoutModal = ({ isOpen, onClose, cartItems, onOrderComplete }) => {
     }
   };
 
+  // Polls a queued order until it is filled or rejected; null if it takes too long
+  const waitForIntake = async (statusUrl) => {
+    for (let attempt = 0; attempt < 30; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const { data } = await axios.get(statusUrl, {
+        headers: { Authorization: `Bearer ${user.accessToken}` },
+      });
+      if (data.status === "done" || data.status === "rejected") {
+        return data;
+      }
+    }
+    return null;
+  };
+
   const handleFileChange = (e, type) => {
     const file = e.target.files[0];
     if (file) {
@@ -284,7 +333,6 @@ CheckoutModal.propTypes = {
       product_name: PropTypes.string.isRequired,
       price: PropTypes.number.isRequired,
       quantity: PropTypes.number.isRequired,
-      batch_id: PropTypes.number.isRequired,
       requires_prescription: PropTypes.bool,
     })
   ).isRequired,
@@ -3,52 +3,41 @@ import axios from "axios";
 import { toast } from "react-toastify";
 import { FaTrash } from "react-icons/fa";
 
+const EXPIRED_BATCHES_URL =
+  "http://127.0.0.1:8000/api/batches/expired/?page_size=100";
+
 function ExpiredProducts() {
   const [expiredBatches, setExpiredBatches] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [totals, setTotals] = useState(null);
+  const [nextUrl, setNextUrl] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  const fetchExpiredBatches = async () => {
+  const fetchExpiredBatches = async (url = EXPIRED_BATCHES_URL) => {
     try {
-      setLoading(true);
+      if (url === EXPIRED_BATCHES_URL) {
+        setLoading(true);
+      } else {
+        setLoadingMore(true);
+      }
       setError(null);
-      const response = await axios.get("http://127.0.0.1:8000/api/batches/");
-
-      // Get all batches and fetch their product details
-      const batches = response.data;
-      const expired = batches.filter((batch) => {
-        const expirationDate = new Date(batch.expiration_date);
-        const today = new Date();
-        return expirationDate < today && batch.is_active;
-      });
+      // Expired batches come with their product fields and the overall totals
+      const response = await axios.get(url);
 
-      // Fetch product details for each batch
-      const batchesWithProducts = await Promise.all(
-        expired.map(async (batch) => {
-          try {
-            const productResponse = await axios.get(
-              `http://127.0.0.1:8000/api/products/${batch.product}/`
-            );
-            return {
-              ...batch,
-              product: productResponse.data,
-            };
-          } catch (error) {
-            console.error(
-              `Error fetching product details for batch ${batch.id}:`,
-              error
-            );
-            return batch;
-          }
-        })
+      setExpiredBatches((previous) =>
+        url === EXPIRED_BATCHES_URL
+          ? response.data.results
+          : [...previous, ...response.data.results]
       );
-
-      setExpiredBatches(batchesWithProducts);
+      setTotals(response.data.totals);
+      setNextUrl(response.data.next);
     } catch (error) {
       console.error("Error fetching expired batches:", error);
       setError("Failed to fetch expired products. Please try again.");
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -94,6 +83,11 @@ function ExpiredProducts() {
       <div className="bg-white shadow-[0_3px_10px_rgb(0,0,0,0.2)] rounded-lg p-6">
         <div className="flex justify-between items-center mb-4">
           <h2 className="text-xl font-semibold">Expired Batches</h2>
+          {totals && (
+            <div className="text-sm text-gray-600">
+              {totals.batches} batches, {totals.units} units, ₱{totals.value}
+            </div>
+          )}
         </div>
 
         <div className="overflow-x-auto">
@@ -158,6 +152,18 @@ function ExpiredProducts() {
             </tbody>
           </table>
         </div>
+
+        {nextUrl && (
+          <div className="flex justify-center mt-4">
+            <button
+              onClick={() => fetchExpiredBatches(nextUrl)}
+              disabled={loadingMore}
+              className="bg-blue-700 text-white px-4 py-2 rounded-md hover:bg-blue-800 disabled:opacity-50"
+            >
+              {loadingMore ? "Loading..." : "Load more"}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
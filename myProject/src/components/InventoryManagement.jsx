@@ -14,7 +14,7 @@ function InventoryManagement() {
 
   const fetchBatches = async () => {
     try {
-      const response = await axios.get("http://127.0.0.1:8000/api/batches/");
+      const response = await axios.get("http://127.0.0.1:8000/api/batches/?paginate=false");
       setBatches(response.data);
     } catch (error) {
       console.error("Error fetching batches:", error);
@@ -24,7 +24,7 @@ function InventoryManagement() {
 
   const fetchProducts = async () => {
     try {
-      const response = await axios.get("http://127.0.0.1:8000/api/products/");
+      const response = await axios.get("http://127.0.0.1:8000/api/products/?paginate=false");
       setProducts(response.data);
     } catch (error) {
       console.error("Error fetching products:", error);
@@ -59,7 +59,8 @@ function InventoryManagement() {
         0
       );
       const totalExpired = productBatches.reduce((sum, batch) => {
-        if (batch.is_expired && batch.is_active) {
+        // Expired batches are deactivated by the server's nightly sweep
+        if (batch.is_expired) {
           return sum + batch.quantity;
         }
         return sum;
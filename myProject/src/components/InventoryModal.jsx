@@ -32,37 +32,8 @@ function InventoryModal({ product, onClose, refreshBatches }) {
         `http://127.0.0.1:8000/api/product/${product.id}/batches/`
       );
 
-      // Process batches to handle expired ones
-      const processedBatches = await Promise.all(
-        response.data.map(async (batch) => {
-          if (batch.is_expired && batch.is_active) {
-            try {
-              // Update batch to inactive and set stock_out to current quantity
-              await axios.put(
-                `http://127.0.0.1:8000/api/product/${product.id}/batches/${batch.id}/update/`,
-                {
-                  ...batch,
-                  is_active: false,
-                  stock_out: batch.quantity, // Set stock_out to current quantity for expired batches
-                }
-              );
-
-              return {
-                ...batch,
-                is_active: false,
-                stock_out: batch.quantity,
-              };
-            } catch (error) {
-              console.error("Error processing expired batch:", error);
-              return batch;
-            }
-          }
-          return batch;
-        })
-      );
-
       // Sort batches by expiration date (earliest first)
-      const sortedBatches = processedBatches.sort(
+      const sortedBatches = response.data.sort(
         (a, b) => new Date(a.expiration_date) - new Date(b.expiration_date)
       );
 
@@ -3,6 +3,7 @@ import axios from "axios";
 import { toast } from "react-toastify";
 import { useEffect, useState } from "react";
 import { CheckCircle, Clock, XCircle, Loader2 } from "lucide-react";
+import { useAuth } from "../context/AuthContext";
 
 const statusIcon = (status) => {
   switch (status) {
@@ -14,35 +15,53 @@ const statusIcon = (status) => {
       return (
         <Loader2 className="inline w-5 h-5 text-blue-500 animate-spin mr-1" />
       );
+    case "Queued":
+      return <Clock className="inline w-5 h-5 text-gray-400 mr-1" />;
     case "Cancelled":
+    case "Rejected":
       return <XCircle className="inline w-5 h-5 text-red-600 mr-1" />;
     default:
       return null;
   }
 };
 
+const ORDER_HISTORY_URL = "http://127.0.0.1:8000/api/orders/mine/";
+
 const OrderHistory = ({ userId }) => {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextUrl, setNextUrl] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const { user } = useAuth();
 
-  useEffect(() => {
-    const fetchOrders = async () => {
+  // The server returns only the signed-in customer's orders, newest first
+  const fetchOrders = async (url = ORDER_HISTORY_URL) => {
+    if (url === ORDER_HISTORY_URL) {
       setLoading(true);
-      try {
-        const response = await axios.get("http://127.0.0.1:8000/api/orders/");
-        // Filter orders by userId
-        const userOrders = response.data.filter(
-          (order) => order.customer === userId
-        );
-        setOrders(userOrders);
-      } catch {
-        toast.error("Failed to fetch order history.");
-      } finally {
-        setLoading(false);
-      }
-    };
-    if (userId) fetchOrders();
-  }, [userId]);
+    } else {
+      setLoadingMore(true);
+    }
+    try {
+      const response = await axios.get(url, {
+        headers: { Authorization: `Bearer ${user.accessToken}` },
+      });
+      setOrders((previous) =>
+        url === ORDER_HISTORY_URL
+          ? response.data.results
+          : [...previous, ...response.data.results]
+      );
+      setNextUrl(response.data.next);
+    } catch {
+      toast.error("Failed to fetch order history.");
+    } finally {
+      setLoading(false);
+      setLoadingMore(false);
+    }
+  };
+
+  useEffect(() => {
+    if (userId && user?.accessToken) fetchOrders();
+  }, [userId, user?.accessToken]);
 
   return (
     <div className="mt-6">
@@ -91,6 +110,17 @@ const OrderHistory = ({ userId }) => {
               ))}
             </tbody>
           </table>
+          {nextUrl && (
+            <div className="flex justify-center p-3">
+              <button
+                onClick={() => fetchOrders(nextUrl)}
+                disabled={loadingMore}
+                className="bg-blue-700 text-white px-4 py-2 rounded-md hover:bg-blue-800 disabled:opacity-50"
+              >
+                {loadingMore ? "Loading..." : "Load more"}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
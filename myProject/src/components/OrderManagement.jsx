@@ -25,7 +25,7 @@ const OrderManagement = () => {
   const fetchOrders = async () => {
     setLoading(true);
     try {
-      const response = await axios.get("http://localhost:8000/api/orders/");
+      const response = await axios.get("http://localhost:8000/api/orders/?paginate=false");
       setOrders(response.data);
     } catch (error) {
       console.error("Error fetching orders:", error);
@@ -95,7 +95,10 @@ const OrderManagement = () => {
         return <CheckCircle size={16} className="text-green-500" />;
       case "Processing":
         return <Clock size={16} className="text-blue-500" />;
+      case "Queued":
+        return <Clock size={16} className="text-gray-400" />;
       case "Cancelled":
+      case "Rejected":
         return <XCircle size={16} className="text-red-500" />;
       case "Pending":
       default:
@@ -109,7 +112,10 @@ const OrderManagement = () => {
         return "bg-green-100 text-green-800";
       case "Processing":
         return "bg-blue-100 text-blue-800";
+      case "Queued":
+        return "bg-gray-100 text-gray-800";
       case "Cancelled":
+      case "Rejected":
         return "bg-red-100 text-red-800";
       case "Pending":
       default:
@@ -163,10 +169,12 @@ const OrderManagement = () => {
               className="border rounded-lg px-3 py-2 focus:ring-2 focus:ring-teal-500 focus:border-teal-500 bg-white"
             >
               <option value="All">All Status</option>
+              <option value="Queued">Queued</option>
               <option value="Pending">Pending</option>
               <option value="Processing">Processing</option>
               <option value="Completed">Completed</option>
               <option value="Cancelled">Cancelled</option>
+              <option value="Rejected">Rejected</option>
             </select>
           </div>
 
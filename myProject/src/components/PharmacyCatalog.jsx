@@ -24,7 +24,7 @@ const PharmacyCatalog = () => {
   const fetchProducts = async () => {
     setLoading(true);
     try {
-      const response = await axios.get("http://127.0.0.1:8000/api/products/");
+      const response = await axios.get("http://127.0.0.1:8000/api/products/?paginate=false");
       setProducts(response.data);
     } catch (error) {
       console.error("Error fetching products:", error);
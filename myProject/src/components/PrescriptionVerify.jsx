@@ -19,7 +19,7 @@ const PrescriptionVerify = () => {
     setLoading(true);
     try {
       const response = await axios.get(
-        "http://localhost:8000/api/prescriptions/"
+        "http://localhost:8000/api/prescriptions/?paginate=false"
       );
       setPrescriptions(response.data);
     } catch (error) {
@@ -2,7 +2,6 @@ import { useState } from "react";
 import { ShoppingCart } from "lucide-react";
 import { toast } from "react-toastify";
 import { useAuth } from "../context/AuthContext";
-import axios from "axios";
 import PropTypes from "prop-types";
 import ProductDetailModal from "./ProductDetailModal";
 
@@ -34,80 +33,31 @@ const ProductCard = ({ product, onAddToCart, cartItems }) => {
     const currentCartItem = cartItems.find((item) => item.id === product.id);
     const currentQuantity = currentCartItem ? currentCartItem.quantity : 0;
 
+    // Batches are allocated at checkout; only check against the sellable stock
+    const available = product.sellable_stock ?? 0;
+    if (available <= 0) {
+      toast.error("This product is out of stock");
+      return;
+    }
+    if (currentQuantity + 1 > available) {
+      toast.error(`Only ${available} items available`);
+      return;
+    }
+
     setLoading(true);
     try {
-      // Get active batches
-      const response = await axios.get(
-        `http://127.0.0.1:8000/api/product/${product.id}/batches/active/`
-      );
-
-      const batches = response.data;
-      if (!batches || batches.length === 0) {
-        toast.error("No active batches available for this product");
-        return;
-      }
-
-      // Find the first batch with quantity > 0
-      const availableBatch = batches.find((batch) => batch.quantity > 0);
-      if (!availableBatch) {
-        // If no batch has quantity, set all batches as inactive
-        await Promise.all(
-          batches.map((batch) =>
-            axios.put(
-              `http://127.0.0.1:8000/api/product/${product.id}/batches/${batch.id}/update/`,
-              { is_active: false }
-            )
-          )
-        );
-        toast.error("This product is out of stock");
-        return;
-      }
-
-      // Check if adding one more would exceed batch quantity
-      if (currentQuantity + 1 > availableBatch.quantity) {
-        // Try to get the next available batch
-        const nextBatch = batches.find(
-          (batch) =>
-            batch.id !== availableBatch.id &&
-            batch.quantity >= currentQuantity + 1
-        );
-
-        if (nextBatch) {
-          // Add product to cart with next batch information
-          onAddToCart({
-            id: product.id,
-            product_name: product.product_name,
-            price: product.price,
-            quantity: 1,
-            batch_id: nextBatch.id,
-            image: product.image,
-            requires_prescription: product.requires_prescription,
-          });
-        } else {
-          toast.error(
-            `Only ${availableBatch.quantity} items available in this batch`
-          );
-          return;
-        }
-      } else {
-        // Add product to cart with current batch information
-        onAddToCart({
-          id: product.id,
-          product_name: product.product_name,
-          price: product.price,
-          quantity: 1,
-          batch_id: availableBatch.id,
-          image: product.image,
-          requires_prescription: product.requires_prescription,
-        });
-      }
+      onAddToCart({
+        id: product.id,
+        product_name: product.product_name,
+        price: product.price,
+        quantity: 1,
+        stock: available,
+        image: product.image,
+        requires_prescription: product.requires_prescription,
+      });
     } catch (error) {
       console.error("Error adding to cart:", error);
-      if (error.response?.status === 404) {
-        toast.error("No active batches available for this product");
-      } else {
-        toast.error("Failed to add product to cart");
-      }
+      toast.error("Failed to add product to cart");
     } finally {
       setLoading(false);
     }
@@ -142,11 +92,24 @@ const ProductCard = ({ product, onAddToCart, cartItems }) => {
         onClick={() => setIsModalOpen(true)}
       >
         <div className="aspect-square mb-4 relative">
-          <img
-            src={product.image || "/placeholder.png"}
-            alt={product.product_name}
-            className="w-full h-full object-contain"
-          />
+          <picture>
+            {product.image_renditions?.card && (
+              <source
+                srcSet={product.image_renditions.card.webp}
+                type="image/webp"
+              />
+            )}
+            <img
+              src={
+                product.image_renditions?.card?.jpeg ||
+                product.image ||
+                "/placeholder.png"
+              }
+              alt={product.product_name}
+              loading="lazy"
+              className="w-full h-full object-contain"
+            />
+          </picture>
         </div>
 
         <h3 className="text-lg font-semibold mb-1 line-clamp-2">
@@ -204,9 +167,11 @@ ProductCard.propTypes = {
     price: PropTypes.number.isRequired,
     description: PropTypes.string,
     image: PropTypes.string,
+    image_renditions: PropTypes.object,
     requires_prescription: PropTypes.bool,
     is_available: PropTypes.bool,
     is_low_stock: PropTypes.bool,
+    sellable_stock: PropTypes.number,
     category: PropTypes.string.isRequired,
   }).isRequired,
   onAddToCart: PropTypes.func.isRequired,
@@ -1,7 +1,6 @@
-import { useState, useEffect } from "react";
+import { useState } from "react";
 import { X, ShoppingCart } from "lucide-react";
 import { toast } from "react-toastify";
-import axios from "axios";
 import { useAuth } from "../context/AuthContext";
 import PropTypes from "prop-types";
 
@@ -14,50 +13,10 @@ const ProductDetailModal = ({
 }) => {
   const { user } = useAuth();
   const [loading, setLoading] = useState(false);
-  const [batchInfo, setBatchInfo] = useState(null);
   const [quantity, setQuantity] = useState(1);
 
-  useEffect(() => {
-    if (isOpen && product) {
-      fetchBatchInfo();
-    }
-  }, [isOpen, product]);
-
-  const fetchBatchInfo = async () => {
-    try {
-      const response = await axios.get(
-        `http://127.0.0.1:8000/api/product/${product.id}/batches/active/`
-      );
-      const batches = response.data;
-
-      if (!batches || batches.length === 0) {
-        setBatchInfo(null);
-        return;
-      }
-
-      // Find the first batch with quantity > 0
-      const availableBatch = batches.find((batch) => batch.quantity > 0);
-      if (!availableBatch) {
-        // If no batch has quantity, set all batches as inactive
-        await Promise.all(
-          batches.map((batch) =>
-            axios.put(
-              `http://127.0.0.1:8000/api/product/${product.id}/batches/${batch.id}/update/`,
-              { is_active: false }
-            )
-          )
-        );
-        setBatchInfo(null);
-        return;
-      }
-
-      setBatchInfo(availableBatch);
-    } catch (error) {
-      console.error("Error fetching batch info:", error);
-      toast.error("Failed to load product details");
-      setBatchInfo(null);
-    }
-  };
+  // Batches are allocated at checkout, first expiry first out
+  const available = product?.sellable_stock ?? 0;
 
   const handleAddToCart = async () => {
     if (!user) {
@@ -78,8 +37,8 @@ const ProductDetailModal = ({
       }
     }
 
-    if (!batchInfo) {
-      toast.error("No active batch available for this product");
+    if (available <= 0) {
+      toast.error("This product is out of stock");
       return;
     }
 
@@ -87,34 +46,9 @@ const ProductDetailModal = ({
     const currentCartItem = cartItems.find((item) => item.id === product.id);
     const currentQuantity = currentCartItem ? currentCartItem.quantity : 0;
 
-    if (currentQuantity + quantity > batchInfo.quantity) {
-      // Try to get the next available batch
-      try {
-        const response = await axios.get(
-          `http://127.0.0.1:8000/api/product/${product.id}/batches/active/`
-        );
-        const batches = response.data;
-
-        // Find the next batch with sufficient quantity
-        const nextBatch = batches.find(
-          (batch) =>
-            batch.id !== batchInfo.id &&
-            batch.quantity >= currentQuantity + quantity
-        );
-
-        if (nextBatch) {
-          setBatchInfo(nextBatch);
-          toast.info("Switched to next available batch");
-        } else {
-          toast.error(
-            `Only ${batchInfo.quantity} items available in this batch`
-          );
-          return;
-        }
-      } catch (error) {
-        toast.error("Selected quantity exceeds available stock");
-        return;
-      }
+    if (currentQuantity + quantity > available) {
+      toast.error(`Only ${available} items available`);
+      return;
     }
 
     setLoading(true);
@@ -124,7 +58,7 @@ const ProductDetailModal = ({
         product_name: product.product_name,
         price: product.price,
         quantity: quantity,
-        batch_id: batchInfo.id,
+        stock: available,
         image: product.image,
         requires_prescription: product.requires_prescription,
       });
@@ -214,21 +148,21 @@ const ProductDetailModal = ({
                   {product.description}
                 </span>
               </div>
-              {batchInfo && (
-                <>
-                  <div>
-                    <span className="block text-xs text-gray-500">
-                      Current Batch Details
-                    </span>
+              {available > 0 && (
+                <div>
+                  <span className="block text-xs text-gray-500">
+                    Availability
+                  </span>
+                  {product.nearest_expiry && (
                     <span className="block text-gray-700 text-sm">
                       Expiration Date:{" "}
-                      {new Date(batchInfo.expiration_date).toLocaleDateString()}
+                      {new Date(product.nearest_expiry).toLocaleDateString()}
                     </span>
-                    <span className="block text-gray-700 text-sm">
-                      Quantity: {batchInfo.quantity}
-                    </span>
-                  </div>
-                </>
+                  )}
+                  <span className="block text-gray-700 text-sm">
+                    Quantity: {available}
+                  </span>
+                </div>
               )}
               {/* Prescription Warning */}
               {product.requires_prescription && (
@@ -243,13 +177,13 @@ const ProductDetailModal = ({
             {/* Add to Cart Button */}
             <button
               onClick={handleAddToCart}
-              disabled={loading || !batchInfo || batchInfo.quantity === 0}
+              disabled={loading || available <= 0}
               className="mt-6 w-full py-3 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors disabled:opacity-50 disabled:cursor-not-allowed text-lg font-semibold"
             >
               <ShoppingCart className="inline-block mr-2" />
               {loading
                 ? "Adding..."
-                : !batchInfo || batchInfo.quantity === 0
+                : available <= 0
                 ? "Out of Stock"
                 : "Add to Cart"}
             </button>
@@ -274,6 +208,8 @@ ProductDetailModal.propTypes = {
     category: PropTypes.string.isRequired,
     is_available: PropTypes.bool,
     is_low_stock: PropTypes.bool,
+    sellable_stock: PropTypes.number,
+    nearest_expiry: PropTypes.string,
   }).isRequired,
   onAddToCart: PropTypes.func.isRequired,
   cartItems: PropTypes.arrayOf(
@@ -25,7 +25,7 @@ export default function ProductManagement() {
   // Fetch all products from backend
   const fetchProducts = async () => {
     try {
-      const response = await axios.get("http://127.0.0.1:8000/api/products/");
+      const response = await axios.get("http://127.0.0.1:8000/api/products/?paginate=false");
       setProducts(response.data);
       setFilteredProducts(response.data);
     } catch (error) {
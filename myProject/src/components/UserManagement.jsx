@@ -25,7 +25,7 @@ export default function UserManagement() {
     const fetchUsers = async () => {
       setLoading(true);
       try {
-        const response = await axios.get("http://127.0.0.1:8000/api/users/");
+        const response = await axios.get("http://127.0.0.1:8000/api/users/?paginate=false");
         setUsers(response.data);
       } catch (error) {
         console.error("Error fetching users:", error);
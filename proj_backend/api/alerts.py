@@ -0,0 +1,55 @@
+"""
+Expiry alerts.
+
+create_expiry_alerts() runs once a day (the expiry_alerts command, or the
+in-process scheduler of api.sweeper) and adds a StockAlert for every active
+batch with stock that has come within STOCK_ALERTS['EXPIRY_HORIZON_DAYS'] of
+its expiration date. Each batch is alerted once; stock level alerts are
+created as stock changes, see StockAlert.for_stock_change().
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import ProductBatch, StockAlert
+
+
+def get_config():
+    return getattr(settings, 'STOCK_ALERTS', {})
+
+
+def create_expiry_alerts(today=None, horizon_days=None, chunk_size=1000):
+    """Returns the number of alerts created by this run, not counting batches a concurrent run alerted first."""
+    today = today or timezone.now().date()
+    if horizon_days is None:
+        horizon_days = get_config().get('EXPIRY_HORIZON_DAYS', 30)
+
+    batches = ProductBatch.objects.filter(
+        is_active=True,
+        quantity__gt=0,
+        expiration_date__gt=today,
+        expiration_date__lte=today + timedelta(days=horizon_days),
+    ).exclude(
+        Exists(StockAlert.objects.filter(batch=OuterRef('pk'), kind=StockAlert.EXPIRING))
+    ).values_list('pk', 'product_id', 'quantity')
+
+    created = 0
+    # Tags this run's rows, so only the alerts it inserted are counted
+    created_at = timezone.now()
+    pending = list(batches[:chunk_size])
+    while pending:
+        # ignore_conflicts: a concurrent run may have alerted some of them already
+        StockAlert.objects.bulk_create([
+            StockAlert(kind=StockAlert.EXPIRING, product_id=product_id, batch_id=batch_id, quantity=quantity,
+                       created_at=created_at)
+            for batch_id, product_id, quantity in pending
+        ], ignore_conflicts=True)
+        created += StockAlert.objects.filter(
+            kind=StockAlert.EXPIRING, batch_id__in=[batch_id for batch_id, _, _ in pending], created_at=created_at
+        ).count()
+        if len(pending) < chunk_size:
+            break
+        pending = list(batches[:chunk_size])
+    return created
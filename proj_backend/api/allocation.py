@@ -0,0 +1,303 @@
+"""
+Server-side allocation of checkout lines to product batches.
+
+A checkout names products and quantities; the batches are chosen here, first
+expiry first out (FEFO). The first few batches of every ordered product are
+read together in one query and, when they cover the order, stock is taken
+from all of them in a single conditional UPDATE (quantity = quantity - n
+WHERE quantity >= n for each batch), so the number of queries does not grow
+with the number of lines. Should another checkout get in between, or a
+product need more batches, the order falls back to reading batches a few at
+a time and taking stock batch by batch. Either way an order only locks the
+batch rows it actually changes. Every stock movement caused by an order goes
+through take_stock(), take_stock_bulk() and return_stock() and is recorded in
+the StockMovement ledger.
+"""
+from collections import defaultdict, namedtuple
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Product, ProductBatch, StockMovement
+
+Allocation = namedtuple('Allocation', ['product', 'batch', 'quantity'])
+
+# Batches of each product read by the first, shared query
+FIRST_BATCH_WINDOW = 4
+# Batches read per further query grow 1, 2, 4, ... up to this many
+MAX_BATCH_WINDOW = 16
+
+
+class AllocationError(Exception):
+    """A checkout line that is malformed or cannot be filled."""
+
+
+class InsufficientStock(AllocationError):
+    def __init__(self, product, requested, available):
+        self.product = product
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Only {available} unit(s) of {product.product_name} are available, {requested} requested."
+        )
+
+
+def take_stock(batch_id, quantity):
+    """
+    Removes `quantity` units from a batch in one conditional UPDATE. Returns
+    False, changing nothing, when the batch holds fewer units.
+    """
+    return ProductBatch.objects.filter(pk=batch_id, quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity
+    ) == 1
+
+
+class _StockChanged(Exception):
+    pass
+
+
+def take_stock_bulk(quantities):
+    """
+    Removes {batch_id: quantity} units from several batches in one conditional
+    UPDATE. Either every batch holds enough and all of them change, or the
+    statement is rolled back and False is returned.
+    """
+    if not quantities:
+        return True
+    try:
+        with transaction.atomic():
+            updated = ProductBatch.objects.filter(
+                reduce(or_, (Q(pk=batch_id, quantity__gte=quantity) for batch_id, quantity in quantities.items()))
+            ).update(quantity=F('quantity') - Case(
+                *(When(pk=batch_id, then=Value(quantity)) for batch_id, quantity in quantities.items()),
+                default=Value(0),
+            ))
+            if updated != len(quantities):
+                raise _StockChanged
+    except _StockChanged:
+        return False
+    return True
+
+
+def return_stock(batch_id, quantity):
+    """
+    Puts `quantity` units back into a batch in one UPDATE. An empty batch
+    that has not expired is made active again, since the sweeper (see
+    api.sweeper) deactivates batches once they run out.
+    """
+    # is_active comes first: MySQL applies the assignments left to right, so a
+    # condition on quantity placed after it would see the new value
+    ProductBatch.objects.filter(pk=batch_id).update(
+        is_active=Case(
+            When(quantity=0, expiration_date__gt=timezone.now().date(), then=Value(True)),
+            default=F('is_active'),
+        ),
+        quantity=F('quantity') + quantity,
+    )
+
+
+def _parse_id(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise AllocationError(f"Invalid {name}: {value!r}.")
+
+
+def parse_order_lines(order_items):
+    """
+    Turns checkout items into {product_id: quantity}, adding up repeated
+    products. Items are {'product_id', 'quantity'}; older clients send
+    {'batch_id', 'quantity'}, in which case the batch only identifies the product.
+    """
+    lines = {}
+    legacy_items = []
+    for item in order_items:
+        if not isinstance(item, dict):
+            raise AllocationError("Each order item must be an object.")
+        try:
+            quantity = int(item.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            raise AllocationError("Each order item needs a quantity of at least 1.")
+        if item.get('product_id') is not None:
+            product_id = _parse_id(item['product_id'], 'product_id')
+            lines[product_id] = lines.get(product_id, 0) + quantity
+        elif item.get('batch_id') is not None:
+            legacy_items.append((_parse_id(item['batch_id'], 'batch_id'), quantity))
+        else:
+            raise AllocationError("Each order item needs a product_id.")
+
+    if legacy_items:
+        batch_products = dict(
+            ProductBatch.objects.filter(pk__in={batch_id for batch_id, _ in legacy_items})
+            .values_list('pk', 'product_id')
+        )
+        for batch_id, quantity in legacy_items:
+            if batch_id not in batch_products:
+                raise AllocationError(f"Batch with id {batch_id} does not exist.")
+            product_id = batch_products[batch_id]
+            lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
+
+
+def load_products(product_ids):
+    """{id: Product} for the ordered products; every one of them must exist."""
+    products = Product.objects.in_bulk(list(product_ids))
+    missing = [str(product_id) for product_id in product_ids if product_id not in products]
+    if missing:
+        raise AllocationError(f"Product with id {', '.join(missing)} does not exist.")
+    return products
+
+
+def _sellable_batches(today):
+    return ProductBatch.objects.filter(is_active=True, expiration_date__gt=today, quantity__gt=0)
+
+
+def _first_batches(product_ids, today, window=FIRST_BATCH_WINDOW):
+    """{product_id: [batch]} with the first `window` sellable batches of each product, in one query."""
+    fefo_rank = Window(
+        RowNumber(),
+        partition_by=[F('product_id')],
+        order_by=[F('expiration_date').asc(), F('id').asc()],
+    )
+    batches = (
+        _sellable_batches(today).filter(product_id__in=list(product_ids))
+        .annotate(fefo_rank=fefo_rank).filter(fefo_rank__lte=window)
+        .order_by('product_id', 'expiration_date', 'id')
+    )
+    grouped = defaultdict(list)
+    for batch in batches:
+        grouped[batch.product_id].append(batch)
+    return grouped
+
+
+def _fefo_batches(product_id, today, after=None):
+    """Yields a product's sellable batches, earliest expiry first, optionally those after batch `after`."""
+    window = 1
+    while True:
+        batches = _sellable_batches(today).filter(product_id=product_id)
+        if after is not None:
+            batches = batches.filter(
+                Q(expiration_date__gt=after.expiration_date)
+                | Q(expiration_date=after.expiration_date, pk__gt=after.pk)
+            )
+        batches = list(batches.order_by('expiration_date', 'id')[:window])
+        yield from batches
+        if len(batches) < window:
+            return
+        after = batches[-1]
+        window = min(window * 2, MAX_BATCH_WINDOW)
+
+
+def _batches_in_fefo_order(product_id, first, today):
+    """The batches from _first_batches() and, if the product has more, the rest from the database."""
+    yield from first
+    if len(first) == FIRST_BATCH_WINDOW:
+        yield from _fefo_batches(product_id, today, after=first[-1])
+
+
+def _take_up_to(batch, wanted):
+    """Takes as much of `wanted` as the batch still holds and returns the amount taken."""
+    while True:
+        taken = min(batch.quantity, wanted)
+        if taken <= 0:
+            return 0
+        if take_stock(batch.pk, taken):
+            batch.quantity -= taken
+            return taken
+        # Another checkout took from it first. A locking read sees the latest
+        # committed quantity, even under REPEATABLE READ.
+        batch.quantity = ProductBatch.objects.select_for_update().filter(
+            pk=batch.pk
+        ).values_list('quantity', flat=True).get()
+
+
+def _plan_from_first_batches(lines, products, first_batches):
+    """
+    The allocations for the order if the batches read by _first_batches() are
+    enough to fill every line, going by their quantities as read; None if not.
+    """
+    plan = []
+    for product_id in sorted(lines):
+        remaining = lines[product_id]
+        for batch in first_batches[product_id]:
+            taken = min(batch.quantity, remaining)
+            plan.append(Allocation(products[product_id], batch, taken))
+            remaining -= taken
+            if not remaining:
+                break
+        if remaining:
+            return None
+    return plan
+
+
+def _allocate_batch_by_batch(lines, products, first_batches, today):
+    allocations = []
+    for product_id in sorted(lines):
+        product = products[product_id]
+        remaining = lines[product_id]
+        for batch in _batches_in_fefo_order(product_id, first_batches[product_id], today):
+            taken = _take_up_to(batch, remaining)
+            if taken:
+                allocations.append(Allocation(product, batch, taken))
+                remaining -= taken
+            if not remaining:
+                break
+        if remaining:
+            raise InsufficientStock(product, lines[product_id], lines[product_id] - remaining)
+    return allocations
+
+
+def allocate(lines, products, order=None, user=None, today=None):
+    """
+    Takes the stock for {product_id: quantity} from the products' batches in
+    FEFO order and returns one Allocation per batch used. A line larger than
+    any single batch is split across as many batches as it needs. Raises
+    InsufficientStock when a product runs out.
+
+    Must run inside transaction.atomic() so a failed line also gives back the
+    stock taken for the earlier ones. Products are handled in id order so
+    concurrent checkouts lock batches in the same order.
+    """
+    today = today or timezone.now().date()
+    first_batches = _first_batches(lines, today)
+    allocations = _plan_from_first_batches(lines, products, first_batches)
+    if allocations is not None and take_stock_bulk({
+        allocation.batch.pk: allocation.quantity for allocation in allocations
+    }):
+        for allocation in allocations:
+            allocation.batch.quantity -= allocation.quantity
+    else:
+        allocations = _allocate_batch_by_batch(lines, products, first_batches, today)
+
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            batch_id=allocation.batch.pk, product_id=allocation.product.pk, kind=StockMovement.SALE,
+            quantity=-allocation.quantity, reason='Order placed', order=order,
+            created_by=user if user and user.is_authenticated else None,
+        )
+        for allocation in allocations
+    ])
+    Product.objects.filter(pk__in=list(lines)).refresh_stock_summary()
+    return allocations
+
+
+def release_order_stock(order, user=None):
+    """Returns the stock of a cancelled order to the batches it was taken from."""
+    items = list(order.items.values_list('batch_id', 'batch__product_id', 'quantity'))
+    for batch_id, _, quantity in items:
+        return_stock(batch_id, quantity)
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            batch_id=batch_id, product_id=product_id, kind=StockMovement.CANCELLATION,
+            quantity=quantity, reason='Order cancelled', order=order,
+            created_by=user if user and user.is_authenticated else None,
+        )
+        for batch_id, product_id, quantity in items
+    ])
+    Product.objects.filter(pk__in={product_id for _, product_id, _ in items}).refresh_stock_summary()
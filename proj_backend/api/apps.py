@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from .search import ensure_search_index
+        # Registers the catalog change listeners
+        from . import caching, catalog_snapshot  # noqa: F401
+
+        post_migrate.connect(ensure_search_index, sender=self)
+
+        from .sweeper import start_scheduler
+        start_scheduler()
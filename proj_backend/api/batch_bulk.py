@@ -0,0 +1,106 @@
+"""
+Bulk edits of product batches.
+
+All items of a request are validated field by field first; then the batches
+are read with one locking query, batch_code uniqueness is checked for the
+whole request with one more, and the accepted changes are written with
+bulk_update in the same transaction. Quantity changes are recorded in the
+ledger as corrections, like single edits through ProductBatch.save().
+"""
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Product, ProductBatch, StockMovement
+from .serializers import BatchBulkUpdateSerializer
+
+UPDATE_FIELDS = ['batch_code', 'quantity', 'expiration_date', 'date_received', 'is_active']
+
+
+def get_config():
+    return getattr(settings, 'BATCH_BULK_UPDATE', {})
+
+
+def apply_batch_updates(items, user=None):
+    """
+    Applies a list of partial batch updates ({'id': ..., field: value, ...}).
+    Returns one result per item, in order: {'id', 'status': 'updated'} or
+    {'id', 'status': 'error', 'errors'}. Items with errors are skipped, the
+    others are saved.
+    """
+    results = [None] * len(items)
+    accepted = {}  # batch id -> (index, validated data)
+
+    # One serializer for all items, as a ListSerializer does: building the
+    # fields of a ModelSerializer costs more than validating a row
+    serializer = BatchBulkUpdateSerializer(partial=True)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'id': None, 'status': 'error', 'errors': {'non_field_errors': ['Each item must be an object.']}}
+            continue
+        try:
+            data = serializer.run_validation(item)
+        except serializers.ValidationError as exc:
+            results[index] = {'id': item.get('id'), 'status': 'error', 'errors': exc.detail}
+            continue
+        batch_id = data['id']
+        if batch_id in accepted:
+            results[index] = {'id': batch_id, 'status': 'error',
+                              'errors': {'id': [f'Duplicate of item {accepted[batch_id][0]}.']}}
+            continue
+        accepted[batch_id] = (index, data)
+
+    def reject(index, batch_id, field, message):
+        results[index] = {'id': batch_id, 'status': 'error', 'errors': {field: [message]}}
+
+    with transaction.atomic():
+        batches = ProductBatch.objects.select_for_update().in_bulk(list(accepted))
+
+        # Codes given to other batches, within the request or already in use
+        claimed = {}
+        for batch_id, (index, data) in list(accepted.items()):
+            if batch_id not in batches:
+                reject(index, batch_id, 'id', 'Batch not found.')
+                del accepted[batch_id]
+                continue
+            code = data.get('batch_code')
+            if code is None or code == batches[batch_id].batch_code:
+                continue
+            if code in claimed:
+                reject(index, batch_id, 'batch_code', f'Duplicate of item {claimed[code]}.')
+                del accepted[batch_id]
+                continue
+            claimed[code] = index
+        taken = set(ProductBatch.objects.filter(batch_code__in=list(claimed)).values_list('batch_code', flat=True))
+        for batch_id, (index, data) in list(accepted.items()):
+            if data.get('batch_code') in taken and data['batch_code'] != batches[batch_id].batch_code:
+                reject(index, batch_id, 'batch_code', 'A batch with this code already exists.')
+                del accepted[batch_id]
+
+        changed, fields, movements = [], set(), []
+        for batch_id, (index, data) in accepted.items():
+            batch = batches[batch_id]
+            previous_quantity = batch.quantity
+            updated_fields = [
+                field for field in UPDATE_FIELDS
+                if field in data and data[field] != getattr(batch, field)
+            ]
+            for field in updated_fields:
+                setattr(batch, field, data[field])
+            if updated_fields:
+                changed.append(batch)
+                fields.update(updated_fields)
+            if batch.quantity != previous_quantity:
+                movements.append(StockMovement(
+                    batch_id=batch.pk, product_id=batch.product_id, kind=StockMovement.CORRECTION,
+                    quantity=batch.quantity - previous_quantity, reason='Quantity edited',
+                    created_by=user if user and user.is_authenticated else None,
+                ))
+            results[index] = {'id': batch_id, 'status': 'updated'}
+
+        batch_size = get_config().get('BATCH_SIZE', 500)
+        if changed:
+            ProductBatch.objects.bulk_update(changed, [field for field in UPDATE_FIELDS if field in fields], batch_size=batch_size)
+            StockMovement.objects.bulk_create(movements, batch_size=batch_size)
+            Product.objects.filter(pk__in={batch.product_id for batch in changed}).refresh_stock_summary()
+    return results
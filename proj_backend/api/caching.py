@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import CATALOG_CHANGE_LISTENERS, CatalogVersion
+
+_version_cache = {'version': None, 'checked_at': 0.0}
+
+
+def current_catalog_version():
+    """
+    The CatalogVersion row, re-read at most every
+    CATALOG_SNAPSHOT['VERSION_CHECK_INTERVAL'] seconds. Changes made by this
+    process are seen immediately; other processes' after the interval.
+    """
+    interval = getattr(settings, 'CATALOG_SNAPSHOT', {}).get('VERSION_CHECK_INTERVAL', 0)
+    now = time.monotonic()
+    version = _version_cache['version']
+    if version is None or now - _version_cache['checked_at'] >= interval:
+        version = CatalogVersion.current()
+        _version_cache.update(version=version, checked_at=now)
+    return version
+
+
+def _forget_catalog_version(version, product_ids):
+    _version_cache['version'] = None
+
+
+CATALOG_CHANGE_LISTENERS.append(_forget_catalog_version)
+
+
+def _catalog_version(request):
+    # Both validators are computed per request; read the counter only once
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = current_catalog_version()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    Strong ETag for a catalog representation. Besides the catalog version it
+    covers the full URL (filters, cursor), the negotiated media type and the
+    current date, since expiry-related fields change at midnight.
+    """
+    version = _catalog_version(request)
+    key = '|'.join([
+        str(version.version),
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        timezone.now().date().isoformat(),
+    ])
+    return f'"catalog-{version.version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    version = _catalog_version(request)
+    start_of_day = datetime.datetime.combine(
+        timezone.now().date(), datetime.time.min, tzinfo=datetime.timezone.utc
+    )
+    return max(version.updated_at, start_of_day)
+
+
+def catalog_conditional(view_func):
+    """
+    Answers conditional GETs on catalog views with 304 before the view (and
+    its serializer) runs, and asks clients to revalidate cached copies.
+    """
+    conditional_view = condition(
+        etag_func=catalog_etag,
+        last_modified_func=catalog_last_modified
+    )(view_func)
+
+    @wraps(view_func)
+    def inner(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    return inner
@@ -0,0 +1,286 @@
+"""
+In-memory snapshot of the public product catalog.
+
+Anonymous, unfiltered GET /api/products/?paginate=false requests are answered
+from JSON that each process keeps pre-rendered (and pre-compressed), without
+any ORM query or serializer call. The snapshot stores one rendered entry per
+product. When catalog_changed() reports which products changed, the next
+request re-renders only those entries. If the snapshot cannot prove that it
+matches the current catalog version and date, the request takes the normal
+path and a full rebuild starts in the background.
+"""
+import gzip
+import logging
+import threading
+import time
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .caching import current_catalog_version
+from .models import CATALOG_CHANGE_LISTENERS, Product
+from .serializers import ProductSerializer
+
+logger = logging.getLogger(__name__)
+
+# Changes not yet applied to every snapshot: version -> product ids (None = unknown)
+MAX_PENDING_VERSIONS = 1000
+
+_lock = threading.RLock()
+_snapshots = {}
+_pending = {}
+_renderer = JSONRenderer()
+
+
+def get_config():
+    return getattr(settings, 'CATALOG_SNAPSHOT', {})
+
+
+class _SnapshotRequest:
+    """
+    Stands in for the request when rendering a snapshot: ProductSerializer only
+    needs absolute URLs for the snapshot's host and the default field set.
+    Snapshots are built from it so no live request outlives its response.
+    """
+    method = 'GET'
+    query_params = {}
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def build_absolute_uri(self, location):
+        return urljoin(self.base_url, location)
+
+
+class CatalogSnapshot:
+    """The rendered catalog for one host (image URLs are absolute)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.version = None
+        self.built_for = None
+        self.entries = {}
+        self.order = []
+        self.body = None
+        self.gzipped_body = None
+        self.building = False
+        self.stats = {
+            'full_builds': 0,
+            'patches': 0,
+            'patched_products': 0,
+            'hits': 0,
+            'fallbacks': 0,
+            'last_build_at': None,
+            'last_build_ms': None,
+            'last_patch_ms': None,
+        }
+
+    def is_current(self, version, today):
+        return self.version is not None and self.version >= version and self.built_for == today
+
+    def changed_products(self, version, today):
+        """
+        Ids of the products changed since the snapshot was built, or None if
+        that is not known and only a full rebuild can bring it up to date.
+        """
+        if self.version is None or self.built_for != today:
+            return None
+        changed = set()
+        for missed in range(self.version + 1, version + 1):
+            if _pending.get(missed) is None:
+                return None
+            changed |= _pending[missed]
+        return changed
+
+    def render(self, product_ids):
+        """{product id: rendered JSON} for the given products (all when None)."""
+        products = Product.objects.catalog().order_by('product_name', 'id')
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        products = list(products)
+        context = {'request': _SnapshotRequest(self.base_url)}
+        data = ProductSerializer(products, many=True, context=context).data
+        return {product.pk: _renderer.render(item) for product, item in zip(products, data)}
+
+    def build(self):
+        started = time.perf_counter()
+        # Read the version first: anything committed later is patched in again
+        version = current_catalog_version().version
+        today = timezone.now().date()
+        entries = self.render(None)
+        order = list(entries)
+
+        with _lock:
+            self.entries, self.order = entries, order
+            self.version, self.built_for = version, today
+            self._assemble()
+            self.stats['full_builds'] += 1
+            self.stats['last_build_at'] = timezone.now()
+            self.stats['last_build_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            _prune_pending()
+
+    def patch(self, base_version, version, product_ids):
+        """
+        Re-renders the changed products, then swaps them in under _lock (call
+        without it). Returns False, changing nothing, when the snapshot moved
+        away from `base_version` in the meantime.
+        """
+        started = time.perf_counter()
+        entries = self.render(product_ids)
+        # Names may have changed; let the database decide the order, as the live path does
+        order = list(Product.objects.order_by('product_name', 'id').values_list('id', flat=True)) if product_ids else None
+
+        with _lock:
+            if self.version != base_version:
+                return False
+            for product_id in product_ids:
+                if product_id in entries:
+                    self.entries[product_id] = entries[product_id]
+                else:
+                    self.entries.pop(product_id, None)
+            if order is not None:
+                self.order = order
+            self.version = version
+            self._assemble()
+            self.stats['patches'] += 1
+            self.stats['patched_products'] += len(product_ids)
+            self.stats['last_patch_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            _prune_pending()
+        return True
+
+    def _assemble(self):
+        self.body = b'[' + b','.join(self.entries[pk] for pk in self.order if pk in self.entries) + b']'
+        self.gzipped_body = gzip.compress(self.body, compresslevel=6)
+
+    def schedule_build(self):
+        """Starts a full rebuild unless one is running. Call without _lock held."""
+        with _lock:
+            if self.building:
+                return
+            self.building = True
+
+        if not get_config().get('BUILD_IN_BACKGROUND', True):
+            # Runs on the request's own connection, which must stay open
+            try:
+                self.build()
+            except Exception:
+                logger.exception("Could not build the catalog snapshot for %s", self.base_url)
+            finally:
+                self.building = False
+            return
+
+        def run():
+            close_old_connections()
+            try:
+                self.build()
+            except Exception:
+                logger.exception("Could not build the catalog snapshot for %s", self.base_url)
+            finally:
+                self.building = False
+                close_old_connections()
+
+        threading.Thread(target=run, name='catalog-snapshot', daemon=True).start()
+
+    def get_stats(self):
+        return {
+            'base_url': self.base_url,
+            'version': self.version,
+            'built_for': self.built_for,
+            'products': len(self.entries),
+            'bytes': len(self.body) if self.body is not None else 0,
+            'gzip_bytes': len(self.gzipped_body) if self.gzipped_body is not None else 0,
+            'building': self.building,
+            **self.stats,
+        }
+
+
+def _record_change(version, product_ids):
+    with _lock:
+        _pending[version] = product_ids
+        while len(_pending) > MAX_PENDING_VERSIONS:
+            del _pending[min(_pending)]
+
+
+CATALOG_CHANGE_LISTENERS.append(_record_change)
+
+
+def _prune_pending():
+    versions = [snapshot.version for snapshot in _snapshots.values() if snapshot.version is not None]
+    if versions:
+        oldest = min(versions)
+        for version in [version for version in _pending if version <= oldest]:
+            del _pending[version]
+
+
+def can_serve(request):
+    """Whether the request would get exactly the snapshot from the live path."""
+    if not get_config().get('ENABLED', True):
+        return False
+    if request.method != 'GET' or request.user.is_authenticated:
+        return False
+    if set(request.query_params) != {'paginate'} or request.query_params['paginate'].lower() not in ('false', '0', 'no'):
+        return False
+    if not getattr(settings, 'API_PAGINATION', {}).get('ALLOW_UNPAGINATED', False):
+        return False
+    # Only plain compact JSON; not the browsable API or ?indent= variants
+    return isinstance(request.accepted_renderer, JSONRenderer) and request.accepted_media_type == 'application/json'
+
+
+def snapshot_response(request):
+    """
+    The catalog response for the request built from the snapshot, or None when
+    the snapshot is missing or stale and the live path has to answer.
+    """
+    if not can_serve(request):
+        return None
+
+    version = current_catalog_version().version
+    today = timezone.now().date()
+    base_url = request.build_absolute_uri('/')
+
+    with _lock:
+        snapshot = _snapshots.setdefault(base_url, CatalogSnapshot(base_url))
+        current = snapshot.is_current(version, today)
+        if not current:
+            base_version = snapshot.version
+            changed = None if snapshot.building else snapshot.changed_products(version, today)
+            if changed is None:
+                snapshot.stats['fallbacks'] += 1
+
+    if not current:
+        if changed is None:
+            snapshot.schedule_build()
+            return None
+        try:
+            patched = snapshot.patch(base_version, version, changed)
+        except Exception:
+            logger.exception("Could not patch the catalog snapshot for %s", base_url)
+            patched = False
+        if not patched:
+            with _lock:
+                snapshot.stats['fallbacks'] += 1
+            return None
+
+    use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    with _lock:
+        snapshot.stats['hits'] += 1
+        body = snapshot.gzipped_body if use_gzip else snapshot.body
+
+    response = HttpResponse(body, content_type='application/json')
+    response['Vary'] = 'Accept, Accept-Encoding'
+    if use_gzip:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def snapshot_stats():
+    with _lock:
+        return {
+            'enabled': get_config().get('ENABLED', True),
+            'pending_versions': sorted(_pending),
+            'snapshots': [snapshot.get_stats() for snapshot in _snapshots.values()],
+        }
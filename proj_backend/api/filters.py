@@ -0,0 +1,107 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, ProductFacet
+
+
+class ProductFilter:
+    """
+    Server-side catalog filters for /api/products/:
+
+    ?category=Tablet,Capsule        one or more of Product.CATEGORY_CHOICES
+    ?requires_prescription=true     true or false
+    ?availability=in_stock,low_stock  one or more of Product.AVAILABILITY_CHOICES
+    ?min_price=10&max_price=250     inclusive price range
+
+    Availability and the facet counts read the stock summary stored on the
+    product. A batch that expires overnight leaves it stale until the first
+    batch sweep of the day (api.sweeper) refreshes the affected products; the
+    product list itself recomputes availability from the sellable batches.
+    """
+    TRUE_VALUES = ('true', '1', 'yes')
+    FALSE_VALUES = ('false', '0', 'no')
+
+    def __init__(self, query_params):
+        errors = {}
+        self.categories = self._parse_choices(
+            query_params, 'category', Product.CATEGORY_CHOICES, errors
+        )
+        self.availability_states = self._parse_choices(
+            query_params, 'availability', Product.AVAILABILITY_CHOICES, errors
+        )
+        self.requires_prescription = self._parse_bool(query_params, 'requires_prescription', errors)
+        self.min_price = self._parse_price(query_params, 'min_price', errors)
+        self.max_price = self._parse_price(query_params, 'max_price', errors)
+
+        if errors:
+            raise ValidationError(errors)
+
+    @staticmethod
+    def _parse_choices(query_params, name, choices, errors):
+        raw = query_params.get(name)
+        if not raw:
+            return None
+        values = [value.strip() for value in raw.split(',') if value.strip()]
+        valid = dict(choices)
+        invalid = [value for value in values if value not in valid]
+        if invalid:
+            errors[name] = f"Invalid value(s): {', '.join(invalid)}."
+        return values
+
+    def _parse_bool(self, query_params, name, errors):
+        raw = query_params.get(name)
+        if raw is None or raw == '':
+            return None
+        if raw.lower() in self.TRUE_VALUES:
+            return True
+        if raw.lower() in self.FALSE_VALUES:
+            return False
+        errors[name] = 'Must be true or false.'
+        return None
+
+    @staticmethod
+    def _parse_price(query_params, name, errors):
+        raw = query_params.get(name)
+        if not raw:
+            return None
+        try:
+            price = Decimal(raw)
+        except InvalidOperation:
+            errors[name] = 'Must be a number.'
+            return None
+        if price < 0:
+            errors[name] = 'Cannot be negative.'
+        return price
+
+    @property
+    def is_active(self):
+        return any(value is not None for value in (
+            self.categories, self.availability_states, self.requires_prescription,
+            self.min_price, self.max_price,
+        ))
+
+    def filter_queryset(self, queryset):
+        if self.categories:
+            queryset = queryset.filter(category__in=self.categories)
+        if self.availability_states:
+            queryset = queryset.filter(availability_state__in=self.availability_states)
+        if self.requires_prescription is not None:
+            queryset = queryset.filter(requires_prescription=self.requires_prescription)
+        if self.min_price is not None:
+            queryset = queryset.filter(price__gte=self.min_price)
+        if self.max_price is not None:
+            queryset = queryset.filter(price__lte=self.max_price)
+        return queryset
+
+    def facet_counts(self):
+        """
+        Counts per category, availability state and prescription flag from the
+        ProductFacet table. The price range is not part of that table and does
+        not narrow these counts.
+        """
+        return ProductFacet.counts(
+            categories=self.categories,
+            availability_states=self.availability_states,
+            requires_prescription=self.requires_prescription,
+        )
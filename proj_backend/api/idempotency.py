@@ -0,0 +1,171 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+A client that may retry a request, e.g. after a timeout, sends a unique
+Idempotency-Key header with it. The first request with a key stores an
+IdempotencyKey row before the view runs and the response after it; a retry
+with the same key gets the stored response back, marked with an
+Idempotent-Replayed header, without running the view again. A retry that
+arrives while the first request is still running gets 409, and a key reused
+for a different request 422. 5xx and 429 responses are not stored, so those
+requests can be retried. A first request still unanswered after
+IDEMPOTENCY['LEASE_SECONDS'] is taken to have died with its worker; the next
+retry takes the key over and runs the view.
+
+A retry costs one read of the unique key index; the first request that read
+plus one INSERT and one UPDATE. Requests without the header are not affected.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def get_config():
+    return getattr(settings, 'IDEMPOTENCY', {})
+
+
+def key_ttl():
+    return timedelta(hours=get_config().get('TTL_HOURS', 24))
+
+
+def claim_lease():
+    return timedelta(seconds=get_config().get('LEASE_SECONDS', 60))
+
+
+def scoped_key(request, key):
+    user_id = request.user.pk if request.user.is_authenticated else ''
+    return hashlib.sha256(f'{user_id}:{key}'.encode()).hexdigest()
+
+
+def request_fingerprint(request):
+    """sha256 of the method, path, parsed data and uploaded files of a DRF request."""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    data = request.data
+    if hasattr(data, 'lists'):
+        # Form data: the multipart boundary differs between retries, the fields do not
+        data = {name: values for name, values in data.lists() if name not in request.FILES}
+    digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+    for name in sorted(request.FILES):
+        for upload in request.FILES.getlist(name):
+            digest.update(f'\n{name}={upload.name}:{upload.size}\n'.encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    return digest.hexdigest()
+
+
+def _claim(request, key, fingerprint):
+    """
+    (record, created): reads the row for `key` or, when there is none, inserts
+    it. A row past its TTL that was not purged yet is replaced, and so is an
+    unanswered claim for the same request past its lease.
+    """
+    now = timezone.now()
+    cutoff = now - key_ttl()
+    lease_cutoff = now - claim_lease()
+    for _ in range(2):
+        record = IdempotencyKey.objects.filter(key=key).first()
+        if record is not None:
+            abandoned = (
+                record.status_code is None and record.created_at < lease_cutoff
+                and record.fingerprint == fingerprint
+            )
+            if record.created_at >= cutoff and not abandoned:
+                return record, False
+            # Conditional, so of two retries taking over the same claim only one runs
+            IdempotencyKey.objects.filter(
+                pk=record.pk, status_code=record.status_code, created_at=record.created_at
+            ).delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    key=key,
+                    user=request.user if request.user.is_authenticated else None,
+                    method=request.method,
+                    path=request.path[:255],
+                    fingerprint=fingerprint,
+                ), True
+        except IntegrityError:
+            # A request with the same key got in between
+            continue
+    return IdempotencyKey.objects.filter(key=key).first(), False
+
+
+def _replay(record, fingerprint):
+    if record is not None and record.fingerprint != fingerprint:
+        return Response(
+            {"error": f"This {HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record is None or record.status_code is None:
+        return Response(
+            {"error": f"A request with this {HEADER} is still being processed, try again shortly"},
+            status=status.HTTP_409_CONFLICT
+        )
+    return Response(record.response_body, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_func):
+    """
+    Makes a DRF view (or view method, with method_decorator) answer retries
+    that carry the same Idempotency-Key header with the first response.
+    """
+    @wraps(view_func)
+    def inner(request, *args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if client_key is None:
+            return view_func(request, *args, **kwargs)
+        client_key = client_key.strip()
+        if not client_key or len(client_key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters long"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, created = _claim(request, scoped_key(request, client_key), fingerprint)
+        if not created:
+            return _replay(record, fingerprint)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            record.delete()
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code,
+                response_body=getattr(response, 'data', None),
+            )
+        return response
+
+    return inner
+
+
+def purge_expired_keys(chunk_size=1000):
+    """Deletes the keys older than IDEMPOTENCY['TTL_HOURS'], `chunk_size` rows at a time. Returns how many."""
+    cutoff = timezone.now() - key_ttl()
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(created_at__lt=cutoff)
+            .order_by('created_at').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,109 @@
+"""
+Daily inventory snapshots.
+
+write_inventory_snapshot(day) stores one InventorySnapshot row per product
+with its stock at the end of `day`. Quantities come from the stock ledger
+(api.ledger), so any past day can be written, and writing a day again
+replaces its rows. Reports for a past date then read one row per product.
+
+The ledger has no history of the is_active flag: a batch counts as sellable
+on a past day when it had not expired by then and is active now.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .ledger import ledger_balances
+from .models import InventorySnapshot, Product, ProductBatch
+
+
+def get_config():
+    return getattr(settings, 'INVENTORY_SNAPSHOT', {})
+
+
+def end_of_day(day):
+    """
+    The last moment of `day` in the current time zone, or now for today. A
+    movement at midnight belongs to the day it starts.
+    """
+    return min(timezone.make_aware(datetime.combine(day, time.max)), timezone.now())
+
+
+def stock_on(day, chunk_size=1000):
+    """{product_id: {'on_hand', 'sellable', 'expiring'}} at the end of `day`."""
+    at = end_of_day(day)
+    expiring_by = day + timedelta(days=get_config().get('EXPIRY_WINDOW_DAYS', 30))
+    stock = defaultdict(lambda: {'on_hand': 0, 'sellable': 0, 'expiring': 0})
+
+    batches = ProductBatch.objects.order_by('pk').values_list('pk', 'product_id', 'expiration_date', 'is_active')
+    last_pk = 0
+    while True:
+        chunk = list(batches.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        balances = ledger_balances([batch[0] for batch in chunk], at=at)
+        for pk, product_id, expiration_date, is_active in chunk:
+            quantity = max(balances[pk], 0)
+            if not quantity:
+                continue
+            totals = stock[product_id]
+            totals['on_hand'] += quantity
+            if is_active and expiration_date > day:
+                totals['sellable'] += quantity
+                if expiration_date <= expiring_by:
+                    totals['expiring'] += quantity
+    return stock
+
+
+def write_inventory_snapshot(day, chunk_size=1000):
+    """Writes (or rewrites) the snapshot of `day` and returns the number of rows."""
+    stock = stock_on(day, chunk_size=chunk_size)
+    empty = {'on_hand': 0, 'sellable': 0, 'expiring': 0}
+    rows = [
+        InventorySnapshot(
+            date=day, product_id=pk, product_name=name, brand_name=brand, category=category,
+            price=price, low_stock_threshold=threshold,
+            value=Decimal(stock.get(pk, empty)['on_hand']) * price,
+            **stock.get(pk, empty),
+        )
+        for pk, name, brand, category, price, threshold in Product.objects.order_by('pk').values_list(
+            'pk', 'product_name', 'brand_name', 'category', 'price', 'low_stock_threshold'
+        )
+    ]
+    with transaction.atomic():
+        InventorySnapshot.objects.filter(date=day).delete()
+        InventorySnapshot.objects.bulk_create(rows, batch_size=chunk_size)
+    return len(rows)
+
+
+def inventory_report(day):
+    """
+    The inventory report as of the end of `day`, in the shape of the live
+    report, counting products rather than batches. None if `day` has no snapshot.
+    """
+    rows = list(InventorySnapshot.objects.filter(date=day).order_by('product_name', 'product_id'))
+    if not rows:
+        return None
+    return {
+        'asOf': day,
+        'totalProducts': len(rows),
+        'lowStockItems': sum(1 for row in rows if 0 < row.sellable <= row.low_stock_threshold),
+        'outOfStockItems': sum(1 for row in rows if row.sellable == 0),
+        'expiringItems': sum(1 for row in rows if row.expiring),
+        'totalValue': sum((row.value for row in rows), Decimal('0.00')),
+        'stockLevels': [{
+            'name': f"{row.product_name} ({row.brand_name})",
+            'category': row.category,
+            'price': row.price,
+            'current': row.on_hand,
+            'sellable': row.sellable,
+            'expiring': row.expiring,
+            'value': row.value,
+            'threshold': row.low_stock_threshold,
+        } for row in rows],
+    }
@@ -0,0 +1,103 @@
+"""
+Balances from the stock movement ledger.
+
+The balance of a batch at some point is its latest StockSnapshot taken by then
+plus the movements recorded after that snapshot, so working it out reads only
+the movements since the last snapshot run, however old the ledger is.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from .models import ProductBatch, StockMovement, StockSnapshot
+
+
+def ledger_balances(batch_ids, at=None, up_to_movement=None):
+    """
+    {batch_id: quantity} according to the ledger, as of `at` (a datetime) or
+    including the movements up to id `up_to_movement`; currently when neither
+    is given. Batches without any movement are reported as 0.
+    """
+    batch_ids = list(batch_ids)
+    if not batch_ids:
+        return {}
+
+    snapshots = StockSnapshot.objects.filter(batch_id__in=batch_ids)
+    if at is not None:
+        snapshots = snapshots.filter(taken_at__lte=at)
+    if up_to_movement is not None:
+        snapshots = snapshots.filter(movement_id__lte=up_to_movement)
+    latest = dict(snapshots.values('batch_id').annotate(last=Max('movement_id')).values_list('batch_id', 'last'))
+
+    balances = dict.fromkeys(batch_ids, 0)
+    if latest:
+        pairs = reduce(or_, (Q(batch_id=batch_id, movement_id=movement_id) for batch_id, movement_id in latest.items()))
+        balances.update(StockSnapshot.objects.filter(pairs).values_list('batch_id', 'quantity'))
+
+    # Batches snapshotted in the same run share a boundary; one condition per boundary
+    since = defaultdict(list)
+    for batch_id in batch_ids:
+        since[latest.get(batch_id, 0)].append(batch_id)
+    movements = StockMovement.objects.filter(
+        reduce(or_, (Q(batch_id__in=ids, id__gt=boundary) for boundary, ids in since.items()))
+    )
+    if at is not None:
+        movements = movements.filter(created_at__lte=at)
+    if up_to_movement is not None:
+        movements = movements.filter(id__lte=up_to_movement)
+    for batch_id, delta in movements.values('batch_id').annotate(delta=Sum('quantity')).values_list('batch_id', 'delta'):
+        balances[batch_id] += delta
+    return balances
+
+
+def quantity_at(batch_id, at):
+    """The quantity of a batch at a past moment, from the ledger."""
+    return ledger_balances([batch_id], at=at)[batch_id]
+
+
+def take_snapshots(lag=timedelta(minutes=5), chunk_size=1000):
+    """
+    Writes a snapshot for every batch with movements since the previous run.
+
+    Only movements older than `lag` are included: ids are handed out before a
+    transaction commits, so a boundary right at the newest id could pass over a
+    movement that commits later. Returns (number of snapshots, boundary id).
+    """
+    previous = StockSnapshot.objects.aggregate(last=Max('movement_id'))['last'] or 0
+    boundary = StockMovement.objects.filter(
+        id__gt=previous, created_at__lte=timezone.now() - lag
+    ).aggregate(last=Max('id'))['last']
+    if boundary is None:
+        return 0, previous
+
+    moved = list(
+        StockMovement.objects.filter(id__gt=previous, id__lte=boundary)
+        .values_list('batch_id', flat=True).distinct().order_by('batch_id')
+    )
+    taken_at = timezone.now()
+    written = 0
+    for start in range(0, len(moved), chunk_size):
+        balances = ledger_balances(moved[start:start + chunk_size], up_to_movement=boundary)
+        with transaction.atomic():
+            StockSnapshot.objects.bulk_create([
+                StockSnapshot(batch_id=batch_id, quantity=quantity, movement_id=boundary, taken_at=taken_at)
+                for batch_id, quantity in balances.items()
+            ], ignore_conflicts=True)
+        written += len(balances)
+    return written, boundary
+
+
+def find_drift(batch_ids):
+    """[(batch_id, stored quantity, ledger quantity)] for batches whose quantity disagrees with the ledger."""
+    stored = dict(ProductBatch.objects.filter(pk__in=batch_ids).values_list('pk', 'quantity'))
+    balances = ledger_balances(stored)
+    return [
+        (batch_id, quantity, balances[batch_id])
+        for batch_id, quantity in sorted(stored.items())
+        if quantity != balances[batch_id]
+    ]
@@ -0,0 +1,135 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Sum
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from rest_framework import serializers
+
+from api.models import CustomUser, OrderItem, Product, ProductBatch
+from api.serializers import OrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures checkout throughput when many buyers order the same product at "
+        "once. Runs in a throw-away test database (like manage.py test, so the "
+        "database user needs the same rights): creates a product, customer and "
+        "batches, runs concurrent checkouts through OrderSerializer until the "
+        "stock runs out, checks that nothing was oversold and drops the database. "
+        "The configured database, its stock ledger and catalog version are never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=16, help='Concurrent buyer threads (default: 16).')
+        parser.add_argument('--stock', type=int, default=1000, help='Units in stock (default: 1000).')
+        parser.add_argument('--batches', type=int, default=3, help='Batches the stock is split across (default: 3).')
+        parser.add_argument('--quantity', type=int, default=1, help='Units per checkout (default: 1).')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs.')
+
+    def handle(self, *args, **options):
+        if min(options['buyers'], options['stock'], options['batches'], options['quantity']) < 1:
+            raise CommandError('--buyers, --stock, --batches and --quantity must be at least 1.')
+
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'], aliases={'default'})
+        try:
+            self.run_benchmark(options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+    def run_benchmark(self, options):
+        product, customer = self.create_fixture(options['stock'], options['batches'])
+        results = {'orders': 0, 'sold_out': 0, 'errors': 0}
+        latencies = []
+        error_messages = set()
+        lock = threading.Lock()
+        pickup_date = (timezone.localtime() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+        order_data = {
+            'order_items': [{'product_id': product.pk, 'quantity': options['quantity']}],
+            'payment_method': 'Cash',
+            'delivery_method': 'PICKUP',
+            'pickup_date': pickup_date.strftime('%Y-%m-%dT%H:%M'),
+        }
+        request = SimpleNamespace(user=customer, method='POST')
+        sold_out = threading.Event()
+
+        def buyer():
+            close_old_connections()
+            try:
+                while not sold_out.is_set():
+                    started = time.perf_counter()
+                    outcome = 'orders'
+                    try:
+                        serializer = OrderSerializer(data=order_data, context={'request': request})
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                    except serializers.ValidationError:
+                        outcome = 'sold_out'
+                        sold_out.set()
+                    except DatabaseError as error:
+                        # Lock timeouts and deadlocks; SQLite reports every write conflict this way
+                        outcome = 'errors'
+                        error_messages.add(f'{type(error).__name__}: {error}')
+                    with lock:
+                        results[outcome] += 1
+                        if outcome == 'orders':
+                            latencies.append(time.perf_counter() - started)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=buyer) for _ in range(options['buyers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        remaining = sum(ProductBatch.objects.filter(product=product).values_list('quantity', flat=True))
+        # From the order items: a checkout whose commit hook failed still sold its units
+        sold = OrderItem.objects.filter(batch__product=product).aggregate(sold=Sum('quantity'))['sold'] or 0
+        latencies.sort()
+
+        self.stdout.write(f"{options['buyers']} buyers, {options['stock']} units in {options['batches']} batches")
+        self.stdout.write(f"{results['orders']} checkouts in {elapsed:.2f}s: {results['orders'] / elapsed:.1f} checkouts/s")
+        if latencies:
+            self.stdout.write(
+                f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms"
+            )
+        self.stdout.write(f"{results['sold_out']} rejected as sold out, {results['errors']} database errors")
+        for message in sorted(error_messages):
+            self.stderr.write(message)
+
+        if remaining < 0 or sold + remaining != options['stock']:
+            raise CommandError(f'Stock mismatch: {sold} sold + {remaining} left != {options["stock"]}.')
+        self.stdout.write(self.style.SUCCESS(f'No overselling: {sold} sold, {remaining} left.'))
+
+    def create_fixture(self, stock, batch_count):
+        tag = uuid.uuid4().hex[:8]
+        product = Product.objects.create(
+            product_name=f'Checkout benchmark {tag}',
+            brand_name=f'Benchmark {tag}',
+            category='Others',
+            price='1.00',
+        )
+        today = timezone.now().date()
+        for index in range(batch_count):
+            units = stock // batch_count + (1 if index < stock % batch_count else 0)
+            ProductBatch.objects.create(
+                product=product,
+                batch_code=f'{int(tag, 16)}{index:03d}',
+                quantity=units,
+                expiration_date=today + timedelta(days=30 + index),
+            )
+        customer = CustomUser.objects.create_user(
+            username=f'checkout-bench-{tag}',
+            password=uuid.uuid4().hex,
+            userrole='Customer',
+        )
+        return product, customer
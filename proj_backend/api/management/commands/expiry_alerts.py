@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.alerts import create_expiry_alerts, get_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds an alert to the staff feed for every active batch that will expire "
+        "within the expiry horizon. Each batch is alerted once; schedule it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=get_config().get('EXPIRY_HORIZON_DAYS', 30),
+            help='Expiry horizon in days (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+        created = create_expiry_alerts(horizon_days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f'{created} expiry alerts created.'))
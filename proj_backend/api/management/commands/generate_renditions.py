@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Product
+from api.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    help = "Renders the resized image renditions of products (only those missing them, unless --all)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render every product image, not only the ones without renditions.',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            products = products.filter(image_renditions={})
+
+        rendered = failed = 0
+        for product_id in products.order_by('pk').values_list('pk', flat=True).iterator():
+            try:
+                if generate_renditions(product_id):
+                    rendered += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Product #{product_id}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} products, {failed} failed.'))
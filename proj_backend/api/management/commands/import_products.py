@@ -0,0 +1,81 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.product_import import FORMATS, ProductImport, detect_format, get_config, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or updates products from a CSV or NDJSON file (use - for stdin). "
+        "A row whose product_name exists updates that product. Rejected rows are "
+        "written to the error report as they are found."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file, or - to read standard input.')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='File format (default: from the file extension, csv otherwise).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=get_config().get('CHUNK_SIZE', 500),
+            help='Rows validated and written per transaction (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--no-update',
+            action='store_true',
+            help='Reject rows for products that already exist instead of updating them.',
+        )
+        parser.add_argument(
+            '--report',
+            help='Write rejected rows to this CSV file (row, field, error) instead of stderr.',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        path = options['path']
+        file_format = options['format'] or detect_format(path)
+
+        report_file = open(options['report'], 'w', newline='', encoding='utf-8') if options['report'] else None
+        try:
+            report = csv.writer(report_file or self.stderr)
+            report.writerow(['row', 'field', 'error'])
+
+            def on_error(row_number, errors):
+                for field, messages in errors.items():
+                    for message in messages if isinstance(messages, list) else [messages]:
+                        report.writerow([row_number, field, message if isinstance(message, str) else json.dumps(message)])
+
+            try:
+                source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+            except OSError as e:
+                raise CommandError(f'Could not open {path}: {e}')
+            try:
+                product_import = ProductImport(
+                    chunk_size=options['chunk_size'],
+                    update_existing=not options['no_update'],
+                    on_error=on_error,
+                ).run(read_rows(source, file_format))
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                raise CommandError(f'Could not read {path}: {e}')
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+        finally:
+            if report_file:
+                report_file.close()
+
+        summary = product_import.summary()
+        message = (
+            f"{summary['rows']} rows: {summary['created']} created, "
+            f"{summary['updated']} updated, {summary['failed']} rejected."
+        )
+        self.stdout.write(self.style.WARNING(message) if summary['failed'] else self.style.SUCCESS(message))
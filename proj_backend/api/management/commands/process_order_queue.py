@@ -0,0 +1,85 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from api.models import OrderIntake
+from api.order_intake import claim_next, get_config, process_intake
+
+
+def run_worker(poll_interval, drain):
+    """
+    Claims and fills queued orders until stopped, or until the queue is empty
+    with `drain`. A worker killed mid-order leaves nothing half done: the
+    order's transaction rolls back and another worker takes the intake over.
+    """
+    handled = 0
+    while True:
+        close_old_connections()
+        intake, token = claim_next()
+        if intake is None:
+            if drain:
+                break
+            time.sleep(poll_interval)
+            continue
+        outcome = process_intake(intake, token)
+        if outcome == OrderIntake.QUEUED:
+            # Put back after a database error; give the lock holder time to finish
+            time.sleep(poll_interval)
+        elif outcome is not None:
+            handled += 1
+    connections.close_all()
+    return handled
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the workers that take the stock for orders accepted by the intake "
+        "queue (ORDER_INTAKE['MODE'] 'async' or 'prefer'). Orders are filled "
+        "oldest first per product; orders for different products in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=get_config().get('WORKERS', 4),
+            help="Worker processes (default: ORDER_INTAKE['WORKERS']).",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=get_config().get('POLL_INTERVAL', 0.5),
+            help="Seconds an idle worker waits before looking again (default: ORDER_INTAKE['POLL_INTERVAL']).",
+        )
+        parser.add_argument(
+            '--drain',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for new orders.',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        worker_args = (options['poll_interval'], options['drain'])
+
+        if options['workers'] == 1:
+            handled = run_worker(*worker_args)
+            self.stdout.write(self.style.SUCCESS(f'Processed {handled} queued orders.'))
+            return
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(options['workers']) as pool:
+            results = [pool.apply_async(run_worker, worker_args) for _ in range(options['workers'])]
+            try:
+                handled = sum(result.get() for result in results)
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise CommandError(
+                    "Stopped. Orders that were being processed are taken over after "
+                    "ORDER_INTAKE['STALE_AFTER_SECONDS']."
+                )
+        self.stdout.write(self.style.SUCCESS(f'Processed {handled} queued orders with {options["workers"]} workers.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.idempotency import key_ttl, purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes stored Idempotency-Key responses older than IDEMPOTENCY['TTL_HOURS']. "
+        "Schedule it hourly or daily; expired keys are ignored even before they are purged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows deleted per statement (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        deleted = purge_expired_keys(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys older than {key_ttl()}.'))
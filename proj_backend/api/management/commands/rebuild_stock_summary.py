@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Product, ProductFacet
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the stored stock summary (active/sellable stock, nearest expiry, "
+        "availability) of every product from its batches, then the catalog facet "
+        "counts. Run it daily so batches that expired overnight stop counting as sellable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the stored summaries with the batch data and report drift.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of products processed per query (default: 500).',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        checked = changed = 0
+
+        for start in range(0, len(product_ids), chunk_size):
+            chunk = Product.objects.filter(pk__in=product_ids[start:start + chunk_size])
+
+            if options['verify']:
+                changed += self.report_drift(chunk)
+            else:
+                changed += chunk.refresh_stock_summary()
+            checked += len(product_ids[start:start + chunk_size])
+
+        if options['verify']:
+            stale_facets = self.report_facet_drift()
+            if changed or stale_facets:
+                raise CommandError(
+                    f'{changed} of {checked} products have a stale stock summary, '
+                    f'{stale_facets} facet counts are off.'
+                )
+            self.stdout.write(self.style.SUCCESS(f'All {checked} product stock summaries are up to date.'))
+        else:
+            ProductFacet.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {checked} products, {changed} updated.'))
+
+    def report_drift(self, products):
+        summaries = products.compute_stock_summaries()
+        stale = 0
+        for product in products.only('id', 'product_name', *Product.STOCK_SUMMARY_FIELDS):
+            drift = {
+                field: (getattr(product, field), value)
+                for field, value in summaries[product.pk].items()
+                if getattr(product, field) != value
+            }
+            if drift:
+                stale += 1
+                details = ', '.join(f'{field}: {stored!r} != {actual!r}' for field, (stored, actual) in drift.items())
+                self.stdout.write(f'Product #{product.pk} {product.product_name}: {details}')
+        return stale
+
+    def report_facet_drift(self):
+        expected = ProductFacet.expected_counts()
+        stored = {
+            (facet.category, facet.availability_state, facet.requires_prescription): facet.product_count
+            for facet in ProductFacet.objects.all()
+        }
+        stale = 0
+        for key in sorted(set(expected) | set(stored)):
+            if expected.get(key, 0) != stored.get(key, 0):
+                stale += 1
+                self.stdout.write(f'Facet {key}: {stored.get(key, 0)} != {expected.get(key, 0)}')
+        return stale
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.ledger import find_drift
+from api.models import ProductBatch, StockMovement
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares every batch's quantity with its ledger balance (latest snapshot "
+        "plus the movements after it) and reports the batches that disagree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--record-corrections',
+            action='store_true',
+            help='Append a correction movement for each difference so the ledger matches the stored quantity.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Batches checked per query (default: 500).',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        batch_ids = list(ProductBatch.objects.order_by('pk').values_list('pk', flat=True))
+        drifted = []
+        for start in range(0, len(batch_ids), chunk_size):
+            for batch_id, stored, ledger in find_drift(batch_ids[start:start + chunk_size]):
+                self.stdout.write(f'Batch #{batch_id}: quantity {stored}, ledger {ledger}')
+                drifted.append((batch_id, stored - ledger))
+
+        if drifted and options['record_corrections']:
+            products = dict(ProductBatch.objects.filter(pk__in=[batch_id for batch_id, _ in drifted]).values_list('pk', 'product_id'))
+            with transaction.atomic():
+                StockMovement.objects.bulk_create([
+                    StockMovement(batch_id=batch_id, product_id=products[batch_id], kind=StockMovement.CORRECTION,
+                                  quantity=difference, reason='Reconciliation')
+                    for batch_id, difference in drifted
+                ])
+            self.stdout.write(self.style.SUCCESS(f'Recorded {len(drifted)} corrections.'))
+        elif drifted:
+            raise CommandError(f'{len(drifted)} of {len(batch_ids)} batches disagree with the ledger.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {len(batch_ids)} batches match the ledger.'))
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.inventory_snapshot import write_inventory_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the per-product inventory snapshot for the end of a day (by "
+        "default yesterday; schedule it shortly after midnight). Quantities come "
+        "from the stock ledger, so past days can be backfilled with --from/--to. "
+        "Writing a day again replaces its snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to snapshot, YYYY-MM-DD (default: yesterday).')
+        parser.add_argument('--from', dest='start', help='First day to backfill, YYYY-MM-DD.')
+        parser.add_argument('--to', dest='end', help='Last day to backfill, YYYY-MM-DD (default: yesterday).')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Batches read from the ledger per query (default: %(default)s).',
+        )
+
+    def parse_day(self, value, option):
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f'{option} must be a date in YYYY-MM-DD format.')
+        if day > timezone.now().date():
+            raise CommandError(f'{option} cannot be in the future.')
+        return day
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        yesterday = timezone.now().date() - timedelta(days=1)
+
+        if options['start']:
+            if options['date']:
+                raise CommandError('Use either --date or --from/--to.')
+            start = self.parse_day(options['start'], '--from')
+            end = self.parse_day(options['end'], '--to') if options['end'] else yesterday
+            if start > end:
+                raise CommandError('--from must not be after --to.')
+            days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        else:
+            days = [self.parse_day(options['date'], '--date') if options['date'] else yesterday]
+
+        for day in days:
+            rows = write_inventory_snapshot(day, chunk_size=options['chunk_size'])
+            self.stdout.write(f'{day}: {rows} products')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(days)} daily inventory snapshot(s).'))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshots the ledger balance of every batch that moved since the last run, "
+        "so balances and audits only read the movements after the latest snapshot. "
+        "Run it periodically (e.g. hourly or nightly)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag-minutes',
+            type=int,
+            default=5,
+            help='Leave out movements newer than this, which may belong to open transactions (default: 5).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Batches snapshotted per query (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        if options['lag_minutes'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--lag-minutes must be 0 or more and --chunk-size at least 1.')
+
+        written, boundary = take_snapshots(
+            lag=timedelta(minutes=options['lag_minutes']),
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Snapshotted {written} batches up to movement #{boundary}.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.sweeper import sweep_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Deactivates every active batch that has expired or has no units left, "
+        "in one UPDATE, and records the run. Schedule it daily, shortly after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the batches that would be deactivated.',
+        )
+
+    def handle(self, *args, **options):
+        run = sweep_batches(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f'Expired: {run.expired_batch_ids or "none"}')
+            self.stdout.write(f'Depleted: {run.depleted_batch_ids or "none"}')
+            self.stdout.write(self.style.SUCCESS(f'{run.deactivated_count} batches would be deactivated.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Deactivated {run.deactivated_count} batches '
+            f'({len(run.expired_batch_ids)} expired, {len(run.depleted_batch_ids)} empty) '
+            f'in {run.duration_ms}ms.'
+        ))
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:20
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+# The stock summary rules as they were when the columns were added. They are
+# copied here rather than imported so later changes to api.models do not change
+# what this migration does.
+AVAILABILITY_MESSAGES = {
+    'no_batch': "No Batch",
+    'no_active_batches': "Out of Stock - No Active Batches",
+    'depleted': "Out of Stock - All Batches Depleted",
+    'low_stock': "Low Stock",
+    'in_stock': "In Stock",
+}
+
+
+def summarize_stock(low_stock_threshold, aggregates):
+    aggregates = aggregates or {}
+
+    if not aggregates.get('batch_count'):
+        state = 'no_batch'
+    elif not aggregates.get('sellable_count'):
+        state = 'no_active_batches'
+    elif (aggregates.get('sellable_max') or 0) <= 0:
+        state = 'depleted'
+    elif aggregates['sellable_min'] <= low_stock_threshold:
+        state = 'low_stock'
+    else:
+        state = 'in_stock'
+
+    return {
+        'active_stock': aggregates.get('active_stock') or 0,
+        'sellable_stock': aggregates.get('sellable_stock') or 0,
+        'nearest_expiry': aggregates.get('nearest_expiry'),
+        'availability_state': state,
+        'availability_message': AVAILABILITY_MESSAGES[state],
+    }
+
+
+def populate_stock_summary(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductBatch = apps.get_model('api', 'ProductBatch')
+
+    sellable = Q(is_active=True, expiration_date__gt=timezone.now().date())
+    aggregates = {
+        row['product_id']: row
+        for row in ProductBatch.objects.order_by().values('product_id').annotate(
+            batch_count=Count('id'),
+            active_stock=Sum('quantity', filter=Q(is_active=True)),
+            sellable_count=Count('id', filter=sellable),
+            sellable_stock=Sum('quantity', filter=sellable),
+            sellable_min=Min('quantity', filter=sellable),
+            sellable_max=Max('quantity', filter=sellable),
+            nearest_expiry=Min('expiration_date', filter=sellable),
+        )
+    }
+    products = list(Product.objects.all())
+    for product in products:
+        for field, value in summarize_stock(product.low_stock_threshold, aggregates.get(product.pk)).items():
+            setattr(product, field, value)
+    Product.objects.bulk_update(products, [
+        'active_stock', 'sellable_stock', 'nearest_expiry',
+        'availability_state', 'availability_message',
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_remove_prescription_verified_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='active_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='availability_message',
+            field=models.CharField(default='No Batch', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='availability_state',
+            field=models.CharField(choices=[('no_batch', 'No Batch'), ('no_active_batches', 'No Active Batches'), ('depleted', 'Depleted'), ('low_stock', 'Low Stock'), ('in_stock', 'In Stock')], default='no_batch', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='nearest_expiry',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sellable_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_stock_summary, migrations.RunPython.noop),
+    ]
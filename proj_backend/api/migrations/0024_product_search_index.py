@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:31
+
+from django.db import OperationalError, migrations
+
+# The search index as it was when it was added. The DDL is copied here rather
+# than imported from api.search so later changes there do not change what this
+# migration does.
+SEARCH_COLUMNS = 'product_name, brand_name, description'
+NEW_VALUES = 'new.product_name, new.brand_name, new.description'
+OLD_VALUES = 'old.product_name, old.brand_name, old.description'
+
+MYSQL_CREATE = "ALTER TABLE api_product ADD FULLTEXT INDEX product_fulltext_idx (product_name, brand_name, description)"
+MYSQL_DROP = "ALTER TABLE api_product DROP INDEX product_fulltext_idx"
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS api_product_fts USING fts5("
+    f"{SEARCH_COLUMNS}, content='api_product', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_ai AFTER INSERT ON api_product BEGIN "
+    f"INSERT INTO api_product_fts(rowid, {SEARCH_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END",
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_ad AFTER DELETE ON api_product BEGIN "
+    f"INSERT INTO api_product_fts(api_product_fts, rowid, {SEARCH_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); END",
+    f"CREATE TRIGGER IF NOT EXISTS api_product_fts_au AFTER UPDATE OF {SEARCH_COLUMNS} ON api_product BEGIN "
+    f"INSERT INTO api_product_fts(api_product_fts, rowid, {SEARCH_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); "
+    f"INSERT INTO api_product_fts(rowid, {SEARCH_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END",
+    "INSERT INTO api_product_fts(api_product_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS api_product_fts_ai",
+    "DROP TRIGGER IF EXISTS api_product_fts_ad",
+    "DROP TRIGGER IF EXISTS api_product_fts_au",
+    "DROP TABLE IF EXISTS api_product_fts",
+]
+
+
+def run(schema_editor, mysql, sqlite):
+    connection = schema_editor.connection
+    if connection.vendor == 'mysql':
+        statements = mysql
+    elif connection.vendor == 'sqlite':
+        statements = sqlite
+    else:
+        # Other backends search with LIKE
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    try:
+        run(schema_editor, [MYSQL_CREATE], SQLITE_CREATE)
+    except OperationalError:
+        if schema_editor.connection.vendor != 'sqlite':
+            raise
+        # SQLite built without FTS5; search falls back to LIKE
+
+
+def drop_search_index(apps, schema_editor):
+    run(schema_editor, [MYSQL_DROP], SQLITE_DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
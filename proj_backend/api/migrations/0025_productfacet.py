@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:24
+
+from django.db import migrations, models
+
+
+def populate_facets(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductFacet = apps.get_model('api', 'ProductFacet')
+
+    rows = Product.objects.order_by().values(
+        'category', 'availability_state', 'requires_prescription'
+    ).annotate(product_count=models.Count('id'))
+    ProductFacet.objects.bulk_create([ProductFacet(**row) for row in rows])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('Liquid', 'Liquid'), ('Tablet', 'Tablet'), ('Capsule', 'Capsule'), ('Topical', 'Topical'), ('Suppositories', 'Suppositories'), ('Drops', 'Drops'), ('Injection', 'Injection'), ('Inhaler', 'Inhaler'), ('Others', 'Others')], max_length=50)),
+                ('availability_state', models.CharField(choices=[('no_batch', 'No Batch'), ('no_active_batches', 'No Active Batches'), ('depleted', 'Depleted'), ('low_stock', 'Low Stock'), ('in_stock', 'In Stock')], max_length=20)),
+                ('requires_prescription', models.BooleanField()),
+                ('product_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'availability_state', 'requires_prescription'), name='unique_product_facet')],
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
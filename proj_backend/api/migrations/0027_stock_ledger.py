@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    # Start every batch's ledger with what it holds today
+    ProductBatch = apps.get_model('api', 'ProductBatch')
+    StockMovement = apps.get_model('api', 'StockMovement')
+
+    batches = ProductBatch.objects.filter(quantity__gt=0).order_by('pk').values_list('pk', 'product_id', 'quantity')
+    StockMovement.objects.bulk_create([
+        StockMovement(batch_id=batch_id, product_id=product_id, kind='receipt',
+                      quantity=quantity, reason='Opening balance')
+        for batch_id, product_id, quantity in batches.iterator()
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_product_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('cancellation', 'Cancellation'), ('write_off', 'Write-off'), ('correction', 'Count correction')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movements', to='api.productbatch')),
+                ('created_by', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.order')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['batch', 'id'], name='movement_batch_id_idx'), models.Index(fields=['created_at', 'id'], name='movement_created_idx'), models.Index(fields=['order'], name='movement_order_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('movement_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='snapshots', to='api.productbatch')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['batch', 'taken_at'], name='snapshot_batch_taken_idx')],
+                'constraints': [models.UniqueConstraint(fields=('batch', 'movement_id'), name='unique_batch_snapshot')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
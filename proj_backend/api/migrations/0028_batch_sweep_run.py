@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchSweepRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ran_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('swept_for', models.DateField()),
+                ('trigger', models.CharField(choices=[('command', 'Management command'), ('scheduler', 'Scheduler')], default='command', max_length=20)),
+                ('expired_batch_ids', models.JSONField(blank=True, default=list)),
+                ('depleted_batch_ids', models.JSONField(blank=True, default=list)),
+                ('deactivated_count', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-ran_at'],
+            },
+        ),
+    ]
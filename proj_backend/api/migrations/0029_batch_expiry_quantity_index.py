@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_batch_sweep_run'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(fields=['expiration_date', 'quantity'], name='batch_expiry_quantity_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_goods_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('product_name', models.CharField(max_length=255)),
+                ('brand_name', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=50)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('low_stock_threshold', models.PositiveIntegerField()),
+                ('on_hand', models.PositiveIntegerField(default=0)),
+                ('sellable', models.PositiveIntegerField(default=0)),
+                ('expiring', models.PositiveIntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.product')),
+            ],
+            options={
+                'ordering': ['date', 'product_name'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='unique_daily_inventory')],
+            },
+        ),
+    ]
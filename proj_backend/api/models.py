@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-from datetime import date
+from django.utils.functional import cached_property
+from collections import Counter
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 
 # -----------------------------
 # Custom User Model
@@ -29,6 +32,189 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+# -----------------------------
+# Stock Summary Helpers
+# -----------------------------
+AVAILABILITY_MESSAGES = {
+    'no_batch': "No Batch",
+    'no_active_batches': "Out of Stock - No Active Batches",
+    'depleted': "Out of Stock - All Batches Depleted",
+    'low_stock': "Low Stock",
+    'in_stock': "In Stock",
+}
+
+def stock_summary_aggregates(today=None):
+    """
+    Aggregate expressions over ProductBatch rows that feed summarize_stock().
+    A batch is sellable when it is active and expires after today.
+    """
+    today = today or timezone.now().date()
+    sellable = Q(is_active=True, expiration_date__gt=today)
+    return {
+        'batch_count': Count('id'),
+        'active_stock': Sum('quantity', filter=Q(is_active=True)),
+        'sellable_count': Count('id', filter=sellable),
+        'sellable_stock': Sum('quantity', filter=sellable),
+        'sellable_min': Min('quantity', filter=sellable),
+        'sellable_max': Max('quantity', filter=sellable),
+        'nearest_expiry': Min('expiration_date', filter=sellable),
+    }
+
+def summarize_stock(low_stock_threshold, aggregates=None):
+    """
+    Turns the result of stock_summary_aggregates() for one product into the
+    values stored on Product. Mirrors the old per-request availability rules.
+    """
+    aggregates = aggregates or {}
+
+    if not aggregates.get('batch_count'):
+        state = 'no_batch'
+    elif not aggregates.get('sellable_count'):
+        state = 'no_active_batches'
+    elif (aggregates.get('sellable_max') or 0) <= 0:
+        state = 'depleted'
+    elif aggregates['sellable_min'] <= low_stock_threshold:
+        state = 'low_stock'
+    else:
+        state = 'in_stock'
+
+    return {
+        'active_stock': aggregates.get('active_stock') or 0,
+        'sellable_stock': aggregates.get('sellable_stock') or 0,
+        'nearest_expiry': aggregates.get('nearest_expiry'),
+        'availability_state': state,
+        'availability_message': AVAILABILITY_MESSAGES[state],
+    }
+
+# -----------------------------
+# Catalog Version
+# -----------------------------
+class CatalogVersion(models.Model):
+    """
+    Single-row counter bumped whenever a product or batch changes. The catalog
+    endpoints derive their ETag and Last-Modified headers from it.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    SINGLETON_PK = 1
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+    @classmethod
+    def current(cls):
+        version, _ = cls.objects.get_or_create(pk=cls.SINGLETON_PK)
+        return version
+
+    @classmethod
+    def bump(cls):
+        updated = cls.objects.filter(pk=cls.SINGLETON_PK).update(
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(pk=cls.SINGLETON_PK, defaults={'version': 1})
+        return cls.objects.values_list('version', flat=True).get(pk=cls.SINGLETON_PK)
+
+# Callables run as listener(version, product_ids) after each bump made by this
+# process; product_ids is None when the change is not tied to specific products.
+CATALOG_CHANGE_LISTENERS = []
+
+def catalog_changed(product_ids=None):
+    """
+    Records that the catalog changed. The bump runs after the surrounding
+    transaction commits so checkouts never queue up on the counter row.
+    """
+    product_ids = frozenset(product_ids) if product_ids is not None else None
+
+    def bump():
+        version = CatalogVersion.bump()
+        for listener in CATALOG_CHANGE_LISTENERS:
+            listener(version, product_ids)
+
+    transaction.on_commit(bump)
+
+class ProductQuerySet(models.QuerySet):
+    def catalog(self):
+        """
+        Products ready for ProductSerializer. The stock summary is read from the
+        product row itself and the sellable batches come from one prefetch into
+        `sellable_batches`, so a page of products costs two queries in total.
+        """
+        sellable_batches = ProductBatch.objects.filter(
+            is_active=True,
+            expiration_date__gt=timezone.now().date()
+        ).order_by('expiration_date', 'id')
+        return self.prefetch_related(
+            Prefetch('batches', queryset=sellable_batches, to_attr='sellable_batches')
+        )
+
+    def compute_stock_summaries(self):
+        """
+        Returns {product_id: summary} computed from the live batch data of the
+        products in this queryset, using a single grouped query.
+        """
+        thresholds = dict(self.order_by().values_list('pk', 'low_stock_threshold'))
+        if not thresholds:
+            return {}
+
+        aggregates = {
+            row['product_id']: row
+            for row in ProductBatch.objects.filter(product_id__in=thresholds)
+            .order_by()
+            .values('product_id')
+            .annotate(**stock_summary_aggregates())
+        }
+        return {
+            pk: summarize_stock(threshold, aggregates.get(pk))
+            for pk, threshold in thresholds.items()
+        }
+
+    def refresh_stock_summary(self):
+        """
+        Recomputes and stores the stock summary of the products in this queryset.
+        The product rows are locked for the duration so concurrent batch writes
+        cannot interleave. Returns the number of products that changed.
+        """
+        with transaction.atomic():
+            products = list(
+                self.select_for_update()
+                .order_by('pk')
+                .only(
+                    'id', 'low_stock_threshold', 'category', 'requires_prescription',
+                    *Product.STOCK_SUMMARY_FIELDS
+                )
+            )
+            summaries = self.model.objects.filter(
+                pk__in=[product.pk for product in products]
+            ).compute_stock_summaries()
+
+            changed = []
+            alerts = []
+            facet_deltas = Counter()
+            for product in products:
+                summary = summaries[product.pk]
+                if any(getattr(product, field) != value for field, value in summary.items()):
+                    alert = StockAlert.for_stock_change(product, product.sellable_stock, summary['sellable_stock'])
+                    if alert:
+                        alerts.append(alert)
+                    facet_deltas[ProductFacet.key(product)] -= 1
+                    for field, value in summary.items():
+                        setattr(product, field, value)
+                    facet_deltas[ProductFacet.key(product)] += 1
+                    changed.append(product)
+
+            if changed:
+                self.model.objects.bulk_update(changed, Product.STOCK_SUMMARY_FIELDS)
+                ProductFacet.apply_deltas(facet_deltas)
+            if alerts:
+                StockAlert.objects.bulk_create(alerts)
+            if products:
+                catalog_changed(product.pk for product in products)
+
+        return len(changed)
+
 # -----------------------------
 # Product Model 
 # -----------------------------
@@ -45,31 +231,142 @@ class Product(models.Model):
         ('Others', 'Others'),
     ]
 
+    AVAILABILITY_CHOICES = [
+        ('no_batch', 'No Batch'),
+        ('no_active_batches', 'No Active Batches'),
+        ('depleted', 'Depleted'),
+        ('low_stock', 'Low Stock'),
+        ('in_stock', 'In Stock'),
+    ]
+
+    STOCK_SUMMARY_FIELDS = [
+        'active_stock', 'sellable_stock', 'nearest_expiry',
+        'availability_state', 'availability_message',
+    ]
+
     product_name = models.CharField(max_length=255)
     brand_name = models.CharField(max_length=255)
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     image = models.ImageField(upload_to='product_images/', null=True, blank=True)
+    # {rendition: {format: storage name}}, filled in by api.renditions after upload
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField(blank=True)
     requires_prescription = models.BooleanField(default=False)
     
     low_stock_threshold = models.PositiveIntegerField(default=10) 
 
+    # Stock summary, kept in sync with the batches by ProductQuerySet.refresh_stock_summary()
+    active_stock = models.PositiveIntegerField(default=0, editable=False)
+    sellable_stock = models.PositiveIntegerField(default=0, editable=False)
+    nearest_expiry = models.DateField(null=True, blank=True, editable=False)
+    availability_state = models.CharField(
+        max_length=20, choices=AVAILABILITY_CHOICES, default='no_batch', editable=False
+    )
+    availability_message = models.CharField(
+        max_length=64, default=AVAILABILITY_MESSAGES['no_batch'], editable=False
+    )
+
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.product_name} ({self.brand_name})"
 
     class Meta:
         ordering = ['product_name']
+        indexes = [
+            models.Index(fields=['product_name', 'id'], name='product_name_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .renditions import schedule_renditions
+
+        adding = self._state.adding
+        with transaction.atomic():
+            previous = None
+            if not adding:
+                previous = Product.objects.select_for_update().filter(pk=self.pk).values(
+                    'category', 'requires_prescription', 'image', 'image_renditions',
+                    *self.STOCK_SUMMARY_FIELDS
+                ).first()
+            if previous:
+                # The summary columns are owned by refresh_stock_summary(); never
+                # write back a stale in-memory copy of them
+                for field in self.STOCK_SUMMARY_FIELDS:
+                    setattr(self, field, previous[field])
+
+            image_changed = self._image_changed(previous['image'] if previous else None)
+            if previous and not image_changed:
+                self.image_renditions = previous['image_renditions']
+            elif image_changed:
+                self.image_renditions = {}
+
+            super().save(*args, **kwargs)
+
+            if image_changed and self.image:
+                schedule_renditions(self.pk)
+
+            if previous:
+                ProductFacet.apply_deltas(Counter({
+                    ProductFacet.key(self, **previous): -1,
+                    ProductFacet.key(self, availability_state=previous['availability_state']): 1,
+                }))
+                # The low stock threshold feeds the availability state
+                Product.objects.filter(pk=self.pk).refresh_stock_summary()
+                self.refresh_from_db(fields=self.STOCK_SUMMARY_FIELDS)
+            else:
+                ProductFacet.apply_deltas({ProductFacet.key(self): 1})
+                catalog_changed([self.pk])
+
+    def delete(self, *args, **kwargs):
+        product_id = self.pk
+        with transaction.atomic():
+            # The in-memory summary may be stale; count down what is stored
+            current = Product.objects.select_for_update().filter(pk=self.pk).values(
+                'category', 'availability_state', 'requires_prescription'
+            ).first()
+            StockMovement.write_off_batches(self.batches.all(), 'Product deleted')
+            result = super().delete(*args, **kwargs)
+            if current:
+                ProductFacet.apply_deltas({ProductFacet.key(self, **current): -1})
+            catalog_changed([product_id])
+        return result
+
+    def _image_changed(self, previous_name):
+        if self.image and not self.image._committed:
+            return True
+        return (self.image.name or '') != (previous_name or '')
+
+    @cached_property
+    def stock_summary(self):
+        """
+        The stock summary as of today. When the sellable batches were prefetched by
+        ProductQuerySet.catalog() it is derived from them, so a batch that expired
+        since the last refresh no longer counts; otherwise the stored values are used.
+        """
+        batches = getattr(self, 'sellable_batches', None)
+        if batches is None:
+            return {field: getattr(self, field) for field in self.STOCK_SUMMARY_FIELDS}
+
+        quantities = [batch.quantity for batch in batches]
+        return summarize_stock(self.low_stock_threshold, {
+            # Batches are only added or removed by writes, which refresh the state
+            'batch_count': 0 if self.availability_state == 'no_batch' else 1,
+            'active_stock': self.active_stock,
+            'sellable_count': len(batches),
+            'sellable_stock': sum(quantities),
+            'sellable_min': min(quantities, default=None),
+            'sellable_max': max(quantities, default=None),
+            'nearest_expiry': min((batch.expiration_date for batch in batches), default=None),
+        })
 
     @property
     def total_stock(self):
-        return self.batches.filter(is_active=True).aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
+        return self.active_stock
 
     @property
     def has_batches(self):
-        return self.batches.exists()
+        return self.availability_state != 'no_batch'
 
     @property
     def is_low_stock(self):
@@ -84,33 +381,140 @@ class Product(models.Model):
         """
         Returns a tuple of (is_available, status_message) based on batch availability
         """
-        if not self.has_batches:
-            return False, "No Batch"
+        summary = self.stock_summary
+        is_available = summary['availability_state'] in ('low_stock', 'in_stock')
+        return is_available, summary['availability_message']
 
-        active_batches = self.batches.filter(
-            is_active=True,
-            expiration_date__gt=timezone.now().date()
-        ).order_by('expiration_date')
+# -----------------------------
+# Product Facet Model
+# -----------------------------
+class ProductFacet(models.Model):
+    """
+    Number of products per (category, availability state, prescription)
+    combination. Product writes adjust it incrementally, so catalog facet counts
+    never need a GROUP BY over the product table.
+    """
+    category = models.CharField(max_length=50, choices=Product.CATEGORY_CHOICES)
+    availability_state = models.CharField(max_length=20, choices=Product.AVAILABILITY_CHOICES)
+    requires_prescription = models.BooleanField()
+    product_count = models.IntegerField(default=0)
 
-        if not active_batches.exists():
-            return False, "Out of Stock - No Active Batches"
+    def __str__(self):
+        return f"{self.category} / {self.availability_state} / Rx={self.requires_prescription}: {self.product_count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'availability_state', 'requires_prescription'],
+                name='unique_product_facet'
+            ),
+        ]
+
+    @staticmethod
+    def key(product, **overrides):
+        values = {
+            'category': product.category,
+            'availability_state': product.availability_state,
+            'requires_prescription': product.requires_prescription,
+        }
+        values.update((field, overrides[field]) for field in values if field in overrides)
+        return values['category'], values['availability_state'], values['requires_prescription']
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Adds {(category, availability_state, requires_prescription): delta} to the counts."""
+        # Sorted so concurrent writers lock the rows in the same order
+        for (category, state, requires_prescription), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            facet, _ = cls.objects.get_or_create(
+                category=category,
+                availability_state=state,
+                requires_prescription=requires_prescription
+            )
+            cls.objects.filter(pk=facet.pk).update(product_count=F('product_count') + delta)
 
-        # Check if all batches are out of stock
-        all_batches_out_of_stock = all(batch.quantity <= 0 for batch in active_batches)
-        if all_batches_out_of_stock:
-            return False, "Out of Stock - All Batches Depleted"
+    @classmethod
+    def expected_counts(cls):
+        """The counts as a GROUP BY over the product table would give them."""
+        rows = Product.objects.order_by().values(
+            'category', 'availability_state', 'requires_prescription'
+        ).annotate(product_count=Count('id'))
+        return {
+            (row['category'], row['availability_state'], row['requires_prescription']): row['product_count']
+            for row in rows
+        }
 
-        # Check if any batch has stock
-        has_stock = any(batch.quantity > 0 for batch in active_batches)
-        if not has_stock:
-            return False, "Out of Stock - No Available Stock"
+    @classmethod
+    def rebuild(cls):
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(category=category, availability_state=state,
+                    requires_prescription=requires_prescription, product_count=count)
+                for (category, state, requires_prescription), count in cls.expected_counts().items()
+            ])
 
-        # Check if any batch is low on stock
-        low_stock_batches = [batch for batch in active_batches if batch.quantity <= self.low_stock_threshold]
-        if low_stock_batches:
-            return True, "Low Stock"
+    @classmethod
+    def counts(cls, categories=None, availability_states=None, requires_prescription=None):
+        """
+        Facet counts for a catalog filtered by the given values (None means not
+        filtered). Each facet ignores its own filter, so every option reports how
+        many products selecting it would return.
+        """
+        rows = list(cls.objects.filter(product_count__gt=0))
+
+        def total(ignore, value_of):
+            counts = Counter()
+            for row in rows:
+                if ignore != 'category' and categories and row.category not in categories:
+                    continue
+                if ignore != 'availability' and availability_states and row.availability_state not in availability_states:
+                    continue
+                if ignore != 'requires_prescription' and requires_prescription is not None \
+                        and row.requires_prescription != requires_prescription:
+                    continue
+                counts[value_of(row)] += row.product_count
+            return counts
 
-        return True, "In Stock"
+        by_category = total('category', lambda row: row.category)
+        by_availability = total('availability', lambda row: row.availability_state)
+        by_prescription = total('requires_prescription', lambda row: row.requires_prescription)
+
+        return {
+            'category': [
+                {'value': value, 'label': label, 'count': by_category[value]}
+                for value, label in Product.CATEGORY_CHOICES
+            ],
+            'availability': [
+                {'value': value, 'label': label, 'count': by_availability[value]}
+                for value, label in Product.AVAILABILITY_CHOICES
+            ],
+            'requires_prescription': [
+                {'value': value, 'count': by_prescription[value]}
+                for value in (True, False)
+            ],
+        }
+
+# -----------------------------
+# Goods Receipt Model
+# -----------------------------
+class GoodsReceipt(models.Model):
+    """A delivery received as one document; its batches are created by api.receiving."""
+    reference = models.CharField(max_length=100, blank=True)  # Supplier's delivery note number
+    supplier = models.CharField(max_length=255, blank=True)
+    received_on = models.DateField(default=timezone.now)
+    notes = models.TextField(blank=True)
+    batch_count = models.PositiveIntegerField(default=0)
+    total_units = models.PositiveIntegerField(default=0)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Goods receipt #{self.pk} {self.reference}".strip()
+
+    class Meta:
+        ordering = ['-created_at']
 
 # -----------------------------
 # Product Batch Model
@@ -122,6 +526,7 @@ class ProductBatch(models.Model):
     expiration_date = models.DateField()
     date_received = models.DateField(default=timezone.now)
     is_active = models.BooleanField(default=True)  
+    receipt = models.ForeignKey(GoodsReceipt, on_delete=models.SET_NULL, null=True, blank=True, related_name='batches')
 
     def __str__(self):
         return f"Batch {self.batch_code} - {self.product.product_name}"
@@ -131,9 +536,44 @@ class ProductBatch(models.Model):
         if not self.batch_code.isdigit():
             raise ValidationError({'batch_code': 'Batch code must contain only numbers.'})
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def save(self, *args, reason='', **kwargs):
+        """
+        Saves the batch and records its stock change in the ledger: the initial
+        quantity as a receipt, any later change of `quantity` as a correction
+        (with `reason`). Order stock goes through api.allocation instead.
+        """
         self.full_clean()  # This will run the clean method and validate
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous_quantity = None
+            if not self._state.adding:
+                previous_quantity = ProductBatch.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('quantity', flat=True).first()
+            super().save(*args, **kwargs)
+
+            if previous_quantity is None:
+                StockMovement.record(self, StockMovement.RECEIPT, self.quantity, reason=reason or 'Batch received')
+            elif previous_quantity != self.quantity:
+                StockMovement.record(self, StockMovement.CORRECTION, self.quantity - previous_quantity,
+                                     reason=reason or 'Quantity edited')
+
+            # Keep the stock summary of the owning product(s) in step
+            product_ids = {self.product_id, getattr(self, '_loaded_product_id', None)} - {None}
+            Product.objects.filter(pk__in=product_ids).refresh_stock_summary()
+        self._loaded_product_id = self.product_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StockMovement.write_off_batches(ProductBatch.objects.filter(pk=self.pk), 'Batch deleted')
+            result = super().delete(*args, **kwargs)
+            Product.objects.filter(pk=self.product_id).refresh_stock_summary()
+        return result
 
     @property
     def is_expired(self):
@@ -141,16 +581,65 @@ class ProductBatch(models.Model):
 
     class Meta:
         ordering = ['expiration_date']  # FEFO
+        indexes = [
+            models.Index(fields=['expiration_date', 'id'], name='batch_expiry_id_idx'),
+            # Expired stock: the quantity > 0 check is answered from the index
+            models.Index(fields=['expiration_date', 'quantity'], name='batch_expiry_quantity_idx'),
+            # Sellable batches of a product in FEFO order
+            models.Index(fields=['product', 'is_active', 'expiration_date'], name='batch_product_active_exp_idx'),
+        ]
+
+class BatchSweepRun(models.Model):
+    """One run of api.sweeper.sweep_batches and the batches it deactivated."""
+    TRIGGER_CHOICES = [
+        ('command', 'Management command'),
+        ('scheduler', 'Scheduler'),
+    ]
+
+    ran_at = models.DateTimeField(default=timezone.now)
+    # Batches that expired before this date were deactivated
+    swept_for = models.DateField()
+    trigger = models.CharField(max_length=20, choices=TRIGGER_CHOICES, default='command')
+    expired_batch_ids = models.JSONField(default=list, blank=True)
+    depleted_batch_ids = models.JSONField(default=list, blank=True)
+    deactivated_count = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sweep {self.ran_at:%Y-%m-%d %H:%M}: {self.deactivated_count} batches"
+
+    class Meta:
+        ordering = ['-ran_at']
 
 # -----------------------------
 # Order Models
 # -----------------------------
+class OrderQuerySet(models.QuerySet):
+    def with_prescription_info(self):
+        """
+        Annotates the status of each order's latest prescription as
+        `latest_prescription_status` and whether it holds a prescription-only
+        product as `has_prescription_items`, both as subqueries, so a list of
+        orders needs no query per order for them.
+        """
+        latest = Prescription.objects.filter(order=OuterRef('pk')).order_by('-uploaded_at', '-id')
+        return self.annotate(
+            latest_prescription_status=Subquery(latest.values('status')[:1]),
+            has_prescription_items=Exists(
+                OrderItem.objects.filter(order=OuterRef('pk'), batch__product__requires_prescription=True)
+            ),
+        )
+
 class Order(models.Model):
     STATUS_CHOICES = [
+        # Accepted by the intake queue, stock not taken yet (see api.order_intake)
+        ('Queued', 'Queued'),
         ('Pending', 'Pending'),
         ('Processing', 'Processing'),
         ('Completed', 'Completed'),
         ('Cancelled', 'Cancelled'),
+        # Left the intake queue without stock, e.g. sold out meanwhile
+        ('Rejected', 'Rejected'),
     ]
 
     PAYMENT_METHOD_CHOICES = [
@@ -177,6 +666,8 @@ class Order(models.Model):
     payment_proof = models.ImageField(upload_to='payments/', blank=True, null=True)
     delivery_method = models.CharField(max_length=10, choices=DELIVERY_METHOD_CHOICES, default='PICKUP')
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f"Order #{self.id} - {self.customer.username}"
 
@@ -198,6 +689,15 @@ class Order(models.Model):
         self.full_clean()  # This will run the clean method and validate
         super().save(*args, **kwargs)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date', 'id'], name='order_date_id_idx'),
+            # Sales reports and dashboard totals; total_amount makes it covering
+            models.Index(fields=['status', 'order_date', 'total_amount'], name='order_status_date_idx'),
+            # Order history of a customer
+            models.Index(fields=['customer', 'order_date'], name='order_customer_date_idx'),
+        ]
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     batch = models.ForeignKey(ProductBatch, on_delete=models.PROTECT)
@@ -206,16 +706,217 @@ class OrderItem(models.Model):
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
 
     def save(self, *args, **kwargs):
+        # Stock is taken when the order is placed, see api.allocation
         self.subtotal = self.quantity * self.price_at_time
-        if self.order.status == 'Completed':
-            # Update batch quantity directly
-            self.batch.quantity -= self.quantity
-            self.batch.save()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.batch.product.product_name} - {self.quantity} units"
 
+class OrderIntake(models.Model):
+    """
+    An order accepted by the intake queue: the ordered lines and prescription
+    of a Queued order until a process_order_queue worker takes the stock for
+    it (see api.order_intake).
+    """
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    REJECTED = 'rejected'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (REJECTED, 'Rejected'),
+    ]
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='intake')
+    # {product_id: quantity}, as returned by api.allocation.parse_order_lines
+    lines = models.JSONField()
+    prescription_file = models.FileField(upload_to='prescriptions/', null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    errors = models.JSONField(default=list, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Identifies the worker that claimed the intake, see api.order_intake.claim_next
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Intake of order #{self.order_id} ({self.status})"
+
+    def product_ids(self):
+        return {int(product_id) for product_id in self.lines}
+
+    class Meta:
+        indexes = [
+            # Queue scans and depth checks
+            models.Index(fields=['status', 'id'], name='intake_status_idx'),
+        ]
+
+# -----------------------------
+# Stock Ledger Models
+# -----------------------------
+class StockMovementQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError("Stock movements are append-only.")
+
+    def delete(self):
+        raise TypeError("Stock movements are append-only.")
+
+class StockMovement(models.Model):
+    """
+    One change of a batch's quantity. Rows are only ever appended; a batch's
+    quantity is the sum of its movements. The batch, product and order are
+    plain references without database constraints so the history survives
+    their deletion.
+    """
+    RECEIPT = 'receipt'
+    SALE = 'sale'
+    CANCELLATION = 'cancellation'
+    WRITE_OFF = 'write_off'
+    CORRECTION = 'correction'
+
+    KIND_CHOICES = [
+        (RECEIPT, 'Receipt'),
+        (SALE, 'Sale'),
+        (CANCELLATION, 'Cancellation'),
+        (WRITE_OFF, 'Write-off'),
+        (CORRECTION, 'Count correction'),
+    ]
+
+    batch = models.ForeignKey(ProductBatch, on_delete=models.DO_NOTHING, db_constraint=False, related_name='movements')
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Signed change of the batch quantity
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=255, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+')
+    created_by = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} on batch #{self.batch_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Stock movements are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Stock movements are append-only.")
+
+    @classmethod
+    def record(cls, batch, kind, quantity, reason='', order=None, user=None):
+        if not quantity:
+            return None
+        return cls.objects.create(
+            batch_id=batch.pk, product_id=batch.product_id, kind=kind, quantity=quantity,
+            reason=reason, order=order, created_by=user if user and user.is_authenticated else None,
+        )
+
+    @classmethod
+    def write_off_batches(cls, batches, reason, user=None):
+        """Records the removal of whatever the given batches still hold."""
+        cls.objects.bulk_create([
+            cls(batch_id=batch_id, product_id=product_id, kind=cls.WRITE_OFF, quantity=-quantity,
+                reason=reason, created_by=user if user and user.is_authenticated else None)
+            for batch_id, product_id, quantity in batches.filter(quantity__gt=0).values_list('pk', 'product_id', 'quantity')
+        ])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['batch', 'id'], name='movement_batch_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='movement_created_idx'),
+            models.Index(fields=['order'], name='movement_order_idx'),
+        ]
+
+class StockSnapshot(models.Model):
+    """
+    A batch's ledger balance including every movement up to `movement_id`.
+    Written by the snapshot_stock command for the batches that moved since the
+    previous run, so a balance is the latest snapshot plus the few movements
+    after it (see api.ledger).
+    """
+    batch = models.ForeignKey(ProductBatch, on_delete=models.DO_NOTHING, db_constraint=False, related_name='snapshots')
+    quantity = models.IntegerField()
+    movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Batch #{self.batch_id}: {self.quantity} as of movement #{self.movement_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'movement_id'], name='unique_batch_snapshot'),
+        ]
+        indexes = [
+            models.Index(fields=['batch', 'taken_at'], name='snapshot_batch_taken_idx'),
+        ]
+
+# -----------------------------
+# Stock Alert Models
+# -----------------------------
+class StockAlert(models.Model):
+    """
+    A stock event for the staff feed. Stock level alerts are created by
+    ProductQuerySet.refresh_stock_summary() when a product's sellable stock
+    crosses its low stock threshold or zero; expiry alerts by the daily
+    expiry_alerts job (see api.alerts) when a batch gets close to expiring.
+    """
+    LOW_STOCK = 'low_stock'
+    OUT_OF_STOCK = 'out_of_stock'
+    RESTOCKED = 'restocked'
+    EXPIRING = 'expiring'
+    KIND_CHOICES = [
+        (LOW_STOCK, 'Low stock'),
+        (OUT_OF_STOCK, 'Out of stock'),
+        (RESTOCKED, 'Back in stock'),
+        (EXPIRING, 'Expiring soon'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='alerts')
+    # Only set for expiry alerts
+    batch = models.ForeignKey(ProductBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='alerts')
+    # Sellable units of the product, or units in the batch for expiry alerts
+    quantity = models.PositiveIntegerField()
+    threshold = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+    read_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: product #{self.product_id}"
+
+    @staticmethod
+    def stock_level(quantity, threshold):
+        if quantity <= 0:
+            return 'out'
+        return 'low' if quantity <= threshold else 'ok'
+
+    @classmethod
+    def for_stock_change(cls, product, previous_stock, stock):
+        """The (unsaved) alert for a change of sellable stock, or None if the level stayed the same."""
+        threshold = product.low_stock_threshold
+        previous_level, level = cls.stock_level(previous_stock, threshold), cls.stock_level(stock, threshold)
+        if level == previous_level:
+            return None
+        kind = {'out': cls.OUT_OF_STOCK, 'low': cls.LOW_STOCK, 'ok': cls.RESTOCKED}[level]
+        return cls(kind=kind, product_id=product.pk, quantity=stock, threshold=threshold)
+
+    class Meta:
+        constraints = [
+            # One expiry alert per batch; stock level alerts have no batch
+            models.UniqueConstraint(fields=['batch', 'kind'], name='unique_batch_alert'),
+        ]
+        indexes = [
+            models.Index(fields=['read_at', 'id'], name='alert_read_id_idx'),
+        ]
+
 # -----------------------------
 # Prescription Model
 # -----------------------------
@@ -238,6 +939,10 @@ class Prescription(models.Model):
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Verification queue and prescription reports
+            models.Index(fields=['status', 'uploaded_at'], name='rx_status_uploaded_idx'),
+        ]
 
 # -----------------------------
 # Report Models
@@ -261,3 +966,60 @@ class Report(models.Model):
 
     class Meta:
         ordering = ['-generated_at']
+
+class InventorySnapshot(models.Model):
+    """
+    A product's stock at the end of one day, written by the snapshot_inventory
+    command (see api.inventory_snapshot). The product's name, category, price
+    and threshold are copied so past reports read only this table.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    product_name = models.CharField(max_length=255)
+    brand_name = models.CharField(max_length=255)
+    category = models.CharField(max_length=50)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    low_stock_threshold = models.PositiveIntegerField()
+    # Units in all batches, including expired ones not yet written off
+    on_hand = models.PositiveIntegerField(default=0)
+    # Units in active batches that had not expired
+    sellable = models.PositiveIntegerField(default=0)
+    # Sellable units expiring within INVENTORY_SNAPSHOT['EXPIRY_WINDOW_DAYS']
+    expiring = models.PositiveIntegerField(default=0)
+    # on_hand at the product's price
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.product_name} on {self.date}: {self.on_hand}"
+
+    class Meta:
+        ordering = ['date', 'product_name']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_inventory'),
+        ]
+
+# -----------------------------
+# Idempotency Models
+# -----------------------------
+class IdempotencyKey(models.Model):
+    """
+    A mutating request sent with an Idempotency-Key header and the response
+    it got, so a retry with the same key is answered with that response
+    instead of running again (see api.idempotency). Rows older than
+    IDEMPOTENCY['TTL_HOURS'] are removed by the purge_idempotency_keys command.
+    """
+    # sha256 of the user and the client's key, so keys of different users never collide
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    # sha256 of the method, path, data and uploaded files
+    fingerprint = models.CharField(max_length=64)
+    # Empty while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.status_code or 'in progress'})"
@@ -0,0 +1,216 @@
+"""
+Order placement and the asynchronous intake queue.
+
+fill_order() takes the stock for an order and writes its items and
+prescription; checkout calls it inline. With ORDER_INTAKE['MODE'] set to
+'async' (or to 'prefer', for requests sent with "Prefer: respond-async"),
+checkout only validates the order, stores it as a Queued order with an
+OrderIntake holding its lines and prescription, and answers 202. Workers
+started by the process_order_queue command then fill the queued orders.
+
+Intakes are handled oldest first per product: a worker skips an intake that
+shares a product with an older intake that is still queued or being worked
+on, so customers who ordered the same product earlier get it first. Other
+intakes are handled in parallel by the other workers. An intake whose worker
+stopped without finishing is taken over after ORDER_INTAKE['STALE_AFTER_SECONDS'].
+
+The queue holds at most ORDER_INTAKE['MAX_DEPTH'] intakes, and
+MAX_DEPTH_PER_CUSTOMER per customer; checkout answers 429 with a Retry-After
+header beyond that, before it parses the order. The limits are checked
+without locking, so a burst can overshoot them by a few orders.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .allocation import AllocationError, allocate, load_products
+from .models import Order, OrderIntake, OrderItem, Prescription
+
+logger = logging.getLogger(__name__)
+
+PREFER_ASYNC = 'respond-async'
+
+
+def get_config():
+    return getattr(settings, 'ORDER_INTAKE', {})
+
+
+def wants_queue(request):
+    """Whether a checkout request goes through the intake queue."""
+    mode = get_config().get('MODE', 'sync')
+    if mode == 'async':
+        return True
+    prefer = request.headers.get('Prefer', '')
+    return mode == 'prefer' and PREFER_ASYNC in [token.strip().lower() for token in prefer.split(',')]
+
+
+def fill_order(order, lines, products, prescription_file=None, user=None):
+    """
+    Takes the stock for {product_id: quantity}, writes one order item per
+    batch used and, when a prescription-only product is ordered, the
+    prescription. Raises AllocationError when the stock is not there. Must run
+    inside transaction.atomic(). Returns the order total.
+    """
+    allocations = allocate(lines, products, order=order, user=user)
+
+    # One order item per batch used; bulk_create skips OrderItem.save, so the
+    # subtotal is set here
+    items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            batch=allocation.batch,
+            quantity=allocation.quantity,
+            price_at_time=allocation.product.price,
+            subtotal=allocation.quantity * allocation.product.price,
+        )
+        for allocation in allocations
+    ])
+
+    # One prescription covers every prescription-only product in the order
+    if prescription_file and any(products[product_id].requires_prescription for product_id in lines):
+        Prescription.objects.create(
+            order=order,
+            prescription_file=prescription_file,
+            status='Pending'
+        )
+    return sum(item.subtotal for item in items)
+
+
+class QueueFull(Exception):
+    def __init__(self, message, retry_after):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+def check_queue_depth(customer):
+    """Raises QueueFull when the queue, or the customer's share of it, is at its limit."""
+    config = get_config()
+    retry_after = config.get('RETRY_AFTER_SECONDS', 30)
+    queued = OrderIntake.objects.filter(status__in=[OrderIntake.QUEUED, OrderIntake.PROCESSING])
+    if queued.count() >= config.get('MAX_DEPTH', 500):
+        raise QueueFull("Checkout is busy right now, please try again in a moment.", retry_after)
+    per_customer = config.get('MAX_DEPTH_PER_CUSTOMER', 5)
+    if queued.filter(order__customer=customer).count() >= per_customer:
+        raise QueueFull(
+            f"You already have {per_customer} orders waiting to be confirmed, please wait for them first.",
+            retry_after,
+        )
+
+
+def queue_order(validated_data, customer):
+    """
+    Stores a validated checkout (OrderSerializer.validated_data) as a Queued
+    order and its intake, without taking any stock. Call check_queue_depth()
+    first.
+    """
+    validated_data = dict(validated_data)
+    lines = validated_data.pop('order_items')
+    products = validated_data.pop('products')
+    prescription_file = validated_data.pop('prescription_file', None)
+
+    with transaction.atomic():
+        order = Order.objects.create(
+            customer=customer,
+            status='Queued',
+            total_amount=sum(products[product_id].price * quantity for product_id, quantity in lines.items()),
+            **validated_data
+        )
+        OrderIntake.objects.create(
+            order=order,
+            lines={str(product_id): quantity for product_id, quantity in lines.items()},
+            prescription_file=prescription_file,
+        )
+    return order
+
+
+def _stale_cutoff():
+    return timezone.now() - timedelta(seconds=get_config().get('STALE_AFTER_SECONDS', 300))
+
+
+def claim_next():
+    """
+    Claims the oldest intake that no older unfinished intake shares a product
+    with. Returns (intake, claim token), or (None, None) when there is none.
+    """
+    stale = _stale_cutoff()
+    open_intakes = (
+        OrderIntake.objects.filter(status__in=[OrderIntake.QUEUED, OrderIntake.PROCESSING])
+        .order_by('id').only('id', 'lines', 'status', 'claimed_at')[:get_config().get('SCAN_SIZE', 200)]
+    )
+    blocked = set()
+    for intake in open_intakes:
+        product_ids = intake.product_ids()
+        abandoned = intake.status == OrderIntake.PROCESSING and intake.claimed_at and intake.claimed_at < stale
+        if intake.status == OrderIntake.QUEUED or abandoned:
+            if not product_ids & blocked:
+                token = uuid.uuid4().hex
+                claimed = OrderIntake.objects.filter(pk=intake.pk).filter(
+                    Q(status=OrderIntake.QUEUED)
+                    | Q(status=OrderIntake.PROCESSING, claimed_at__lt=stale)
+                ).update(
+                    status=OrderIntake.PROCESSING, claim_token=token,
+                    claimed_at=timezone.now(), attempts=F('attempts') + 1,
+                )
+                if claimed:
+                    return OrderIntake.objects.get(pk=intake.pk), token
+        # Later intakes for these products wait for this one
+        blocked |= product_ids
+    return None, None
+
+
+def _finish(intake, token, status, order_status, errors=(), total=None):
+    """Records the outcome, unless another worker has taken the intake over. Returns whether it did."""
+    updated = OrderIntake.objects.filter(pk=intake.pk, claim_token=token).update(
+        status=status, errors=list(errors), finished_at=timezone.now()
+    )
+    if updated:
+        changes = {'status': order_status}
+        if total is not None:
+            changes['total_amount'] = total
+        Order.objects.filter(pk=intake.order_id, status='Queued').update(**changes)
+    return bool(updated)
+
+
+def process_intake(intake, token):
+    """
+    Fills the order of a claimed intake, or rejects it when the stock is gone.
+    A database error (lock timeout, deadlock) puts the intake back in the
+    queue, up to ORDER_INTAKE['MAX_ATTEMPTS'] tries. Returns the intake status.
+    """
+    order = Order.objects.select_related('customer').get(pk=intake.order_id)
+    lines = {int(product_id): quantity for product_id, quantity in intake.lines.items()}
+    try:
+        with transaction.atomic():
+            # Holding the intake row keeps a worker that takes it over waiting until this one is done
+            if not OrderIntake.objects.select_for_update().filter(pk=intake.pk, claim_token=token).exists():
+                return None
+            total = fill_order(
+                order, lines, load_products(lines),
+                prescription_file=intake.prescription_file.name or None, user=order.customer,
+            )
+            _finish(intake, token, OrderIntake.DONE, 'Pending', total=total)
+        return OrderIntake.DONE
+    except AllocationError as e:
+        _finish(intake, token, OrderIntake.REJECTED, 'Rejected', errors=[str(e)])
+        return OrderIntake.REJECTED
+    except DatabaseError:
+        logger.exception("Order intake %s failed", intake.pk)
+        if intake.attempts < get_config().get('MAX_ATTEMPTS', 3):
+            OrderIntake.objects.filter(pk=intake.pk, claim_token=token).update(status=OrderIntake.QUEUED, claim_token='')
+            return OrderIntake.QUEUED
+        _finish(intake, token, OrderIntake.REJECTED, 'Rejected', errors=["The order could not be processed, please try again."])
+        return OrderIntake.REJECTED
+
+
+def queue_position(intake):
+    """How many unfinished intakes were queued before this one, or None once it is finished."""
+    if intake.status not in (OrderIntake.QUEUED, OrderIntake.PROCESSING):
+        return None
+    return OrderIntake.objects.filter(
+        status__in=[OrderIntake.QUEUED, OrderIntake.PROCESSING], id__lt=intake.pk
+    ).count()
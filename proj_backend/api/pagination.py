@@ -0,0 +1,109 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination over a stable, indexed ordering.
+
+    Page sizes are read from settings.API_PAGINATION['PAGE_SIZES'][page_size_key]
+    and can be lowered or raised per request with ?page_size= up to MAX_PAGE_SIZE.
+    While ALLOW_UNPAGINATED is on, ?paginate=false returns the whole list as a plain
+    array, which is the shape the React client was written against.
+    """
+    page_size_key = None
+    page_size_query_param = 'page_size'
+    unpaginated_query_param = 'paginate'
+
+    @staticmethod
+    def get_config():
+        return getattr(settings, 'API_PAGINATION', {})
+
+    def get_page_size(self, request):
+        config = self.get_config()
+        self.page_size = config.get('PAGE_SIZES', {}).get(self.page_size_key, config.get('PAGE_SIZE', 50))
+        self.max_page_size = config.get('MAX_PAGE_SIZE', 500)
+        return super().get_page_size(request)
+
+    def is_unpaginated(self, request):
+        if not self.get_config().get('ALLOW_UNPAGINATED', False):
+            return False
+        value = request.query_params.get(self.unpaginated_query_param, '')
+        return value.lower() in ('false', '0', 'no')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_unpaginated(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('product_name', 'id')
+    page_size_key = 'products'
+
+
+class ProductBatchPagination(KeysetPagination):
+    ordering = ('expiration_date', 'id')
+    page_size_key = 'batches'
+
+
+class OrderPagination(KeysetPagination):
+    ordering = ('-order_date', 'id')
+    page_size_key = 'orders'
+
+
+class OrderHistoryPagination(KeysetPagination):
+    """
+    A customer's orders, newest first. Both keys descend so the database
+    reads the (customer, order_date) index backwards without sorting, and
+    the history is always paged, however long it is.
+    """
+    ordering = ('-order_date', '-id')
+    page_size_key = 'order_history'
+
+    def is_unpaginated(self, request):
+        return False
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('username', 'id')
+    page_size_key = 'users'
+
+
+class PrescriptionPagination(KeysetPagination):
+    ordering = ('-uploaded_at', 'id')
+    page_size_key = 'prescriptions'
+
+
+class ReportPagination(KeysetPagination):
+    ordering = ('-generated_at', 'id')
+    page_size_key = 'reports'
+
+
+class StockMovementPagination(KeysetPagination):
+    ordering = ('-id',)
+    page_size_key = 'movements'
+
+
+class StockAlertPagination(KeysetPagination):
+    ordering = ('-id',)
+    page_size_key = 'alerts'
+
+
+class GoodsReceiptPagination(KeysetPagination):
+    ordering = ('-created_at', 'id')
+    page_size_key = 'receipts'
+
+
+class SearchPagination(PageNumberPagination):
+    """
+    Relevance-ranked results have no stable key to page on, so search pages by
+    number instead. The page size comes from PAGE_SIZES['search'].
+    """
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        config = KeysetPagination.get_config()
+        self.page_size = config.get('PAGE_SIZES', {}).get('search', config.get('PAGE_SIZE', 50))
+        self.max_page_size = config.get('MAX_PAGE_SIZE', 500)
+        return super().get_page_size(request)
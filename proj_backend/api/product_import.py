@@ -0,0 +1,195 @@
+"""
+Bulk product import from CSV or NDJSON.
+
+Rows are read one at a time from a text stream and processed in chunks: each
+row's fields are validated on their own, then name and brand uniqueness for the
+whole chunk is checked with a single query, and the chunk is written with
+bulk_create/bulk_update in one transaction. A row whose product_name already
+exists updates that product (unless updates are turned off). Names and brands
+are compared case-insensitively, like the database collation does for
+ProductSerializer.validate. Only the current chunk and the names and brands
+seen so far are held in memory; errors are handed to a callback as they are
+found.
+"""
+import csv
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Product, ProductFacet, catalog_changed
+from .serializers import ProductImportSerializer
+
+FORMATS = ('csv', 'ndjson')
+UPDATE_FIELDS = [
+    'brand_name', 'category', 'price', 'description',
+    'requires_prescription', 'low_stock_threshold',
+]
+
+
+def get_config():
+    return getattr(settings, 'PRODUCT_IMPORT', {})
+
+
+def unique_key(value):
+    """The form a product name or brand is compared in."""
+    return value.casefold()
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, file_format):
+    """
+    Yields (row number, dict or None, parse error or None) from a text stream.
+    Row numbers are file line numbers, so they can be looked up in the source.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            # Empty cells fall back to the model defaults
+            yield reader.line_num, {
+                key.strip(): value.strip() for key, value in record.items()
+                if key and isinstance(value, str) and value.strip()
+            }, None
+    elif file_format == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_number, None, f'Invalid JSON: {exc}'
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, 'Each line must be a JSON object.'
+                continue
+            yield line_number, record, None
+    else:
+        raise ValueError(f"Unknown import format '{file_format}'.")
+
+
+class ProductImport:
+    """
+    Runs an import and keeps its totals. `on_error(row_number, errors)` is
+    called for every rejected row.
+    """
+
+    def __init__(self, chunk_size=None, update_existing=True, on_error=None):
+        self.chunk_size = chunk_size or get_config().get('CHUNK_SIZE', 500)
+        self.update_existing = update_existing
+        self.on_error = on_error or (lambda row_number, errors: None)
+        self.rows = self.created = self.updated = self.failed = 0
+        # {unique_key: row number} of the rows imported so far, across chunks
+        self.seen_names, self.seen_brands = {}, {}
+
+    def run(self, rows):
+        chunk = []
+        for row_number, record, parse_error in rows:
+            self.rows += 1
+            if parse_error:
+                self.reject(row_number, {'non_field_errors': [parse_error]})
+                continue
+            serializer = ProductImportSerializer(data=record)
+            if not serializer.is_valid():
+                self.reject(row_number, serializer.errors)
+                continue
+            chunk.append((row_number, serializer.validated_data))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self
+
+    def reject(self, row_number, errors):
+        self.failed += 1
+        self.on_error(row_number, errors)
+
+    def import_chunk(self, chunk):
+        names = {data['product_name'] for _, data in chunk}
+        brands = {data['brand_name'] for _, data in chunk}
+
+        with transaction.atomic():
+            existing = list(
+                Product.objects.select_for_update()
+                .filter(Q(product_name__in=names) | Q(brand_name__in=brands))
+                .order_by('pk')
+            )
+            by_name = {unique_key(product.product_name): product for product in existing}
+            by_brand = {unique_key(product.brand_name): product for product in existing}
+
+            to_create, to_update = [], []
+            facet_deltas = Counter()
+            seen_names, seen_brands = self.seen_names, self.seen_brands
+
+            for row_number, data in chunk:
+                name, brand = unique_key(data['product_name']), unique_key(data['brand_name'])
+                errors = {}
+                if name in seen_names:
+                    errors['product_name'] = [f'Duplicate of row {seen_names[name]}.']
+                if brand in seen_brands:
+                    errors['brand_name'] = [f'Duplicate of row {seen_brands[brand]}.']
+
+                product = by_name.get(name)
+                if product is not None and not self.update_existing:
+                    errors['product_name'] = ['A product with this name already exists.']
+                brand_owner = by_brand.get(brand)
+                if brand_owner is not None and brand_owner is not product:
+                    errors['brand_name'] = ['A product with this brand already exists.']
+
+                if errors:
+                    self.reject(row_number, errors)
+                    continue
+                seen_names[name] = seen_brands[brand] = row_number
+
+                if product is None:
+                    product = Product(**data)
+                    facet_deltas[ProductFacet.key(product)] += 1
+                    to_create.append(product)
+                else:
+                    facet_deltas[ProductFacet.key(product)] -= 1
+                    for field in UPDATE_FIELDS:
+                        if field in data:
+                            setattr(product, field, data[field])
+                    facet_deltas[ProductFacet.key(product)] += 1
+                    to_update.append(product)
+
+            created = Product.objects.bulk_create(to_create, batch_size=self.chunk_size)
+            if to_update:
+                Product.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=self.chunk_size)
+            ProductFacet.apply_deltas(facet_deltas)
+
+            changed_ids = [product.pk for product in to_update]
+            if any(product.pk is None for product in created):
+                # The backend does not return ids from bulk inserts
+                changed_ids += Product.objects.filter(
+                    product_name__in=[product.product_name for product in created]
+                ).values_list('pk', flat=True)
+            else:
+                changed_ids += [product.pk for product in created]
+
+            if to_update:
+                # A new low stock threshold can change the availability state
+                Product.objects.filter(pk__in=[product.pk for product in to_update]).refresh_stock_summary()
+            if changed_ids:
+                catalog_changed(changed_ids)
+
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+        }
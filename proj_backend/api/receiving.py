@@ -0,0 +1,143 @@
+"""
+Goods receiving: a whole delivery booked as one GoodsReceipt.
+
+The lines of a delivery are validated field by field with one serializer,
+then the products are looked up and batch_code uniqueness is checked for the
+whole delivery with a query each. A delivery with any invalid line is
+rejected as a whole; otherwise its batches are inserted with bulk_create and
+their receipt movements with another, in one transaction.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import GoodsReceipt, Product, ProductBatch, StockMovement
+from .serializers import GoodsReceiptLineSerializer
+
+
+class ReceivingError(Exception):
+    """A rejected delivery; `errors` is a list of {'line', 'errors'}."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid line(s).")
+
+
+def get_config():
+    return getattr(settings, 'GOODS_RECEIVING', {})
+
+
+def validate_lines(lines):
+    """
+    Validates (line number, record, parse error) tuples and returns
+    [(line number, validated data)] with `product_id` resolved.
+    Raises ReceivingError listing every invalid line.
+    """
+    max_lines = get_config().get('MAX_LINES', 5000)
+    errors, accepted = [], []
+
+    # One serializer for all lines; building its fields costs more than a line
+    serializer = GoodsReceiptLineSerializer()
+    for count, (line, record, parse_error) in enumerate(lines, start=1):
+        if count > max_lines:
+            raise ReceivingError([{'line': line, 'errors': {'non_field_errors': [f'A receipt can have at most {max_lines} lines.']}}])
+        if parse_error:
+            errors.append({'line': line, 'errors': {'non_field_errors': [parse_error]}})
+            continue
+        try:
+            accepted.append((line, serializer.run_validation(record)))
+        except serializers.ValidationError as exc:
+            errors.append({'line': line, 'errors': exc.detail})
+
+    if not accepted and not errors:
+        raise ReceivingError([{'line': None, 'errors': {'non_field_errors': ['The receipt has no lines.']}}])
+
+    product_ids = Product.objects.in_bulk({data['product'] for _, data in accepted if 'product' in data})
+    by_name = defaultdict(list)
+    for pk, name in Product.objects.filter(
+        product_name__in={data['product_name'] for _, data in accepted if 'product_name' in data}
+    ).values_list('pk', 'product_name'):
+        by_name[name].append(pk)
+    taken = set(ProductBatch.objects.filter(
+        batch_code__in={data['batch_code'] for _, data in accepted}
+    ).values_list('batch_code', flat=True))
+
+    seen_codes = {}
+    for line, data in accepted:
+        line_errors = {}
+        if 'product' in data:
+            if data['product'] not in product_ids:
+                line_errors['product'] = ['Product not found.']
+            else:
+                data['product_id'] = data['product']
+        else:
+            matches = by_name.get(data['product_name'], [])
+            if len(matches) == 1:
+                data['product_id'] = matches[0]
+            else:
+                line_errors['product_name'] = [
+                    'Product not found.' if not matches else 'Several products have this name; give the product id.'
+                ]
+
+        code = data['batch_code']
+        if code in seen_codes:
+            line_errors['batch_code'] = [f'Duplicate of line {seen_codes[code]}.']
+        elif code in taken:
+            line_errors['batch_code'] = ['A batch with this code already exists.']
+        seen_codes.setdefault(code, line)
+
+        if line_errors:
+            errors.append({'line': line, 'errors': line_errors})
+
+    if errors:
+        raise ReceivingError(sorted(errors, key=lambda error: error['line'] or 0))
+    return accepted
+
+
+def receive_goods(header, lines, user=None):
+    """
+    Books a delivery: `header` holds the GoodsReceipt fields, `lines` yields
+    (line number, record, parse error). Returns the saved GoodsReceipt.
+    """
+    accepted = validate_lines(lines)
+    user = user if user and user.is_authenticated else None
+    batch_size = get_config().get('BATCH_SIZE', 500)
+
+    try:
+        with transaction.atomic():
+            receipt = GoodsReceipt.objects.create(
+                **{'received_on': timezone.now().date(), **header},
+                batch_count=len(accepted),
+                total_units=sum(data['quantity'] for _, data in accepted),
+                created_by=user,
+            )
+            ProductBatch.objects.bulk_create([
+                ProductBatch(
+                    product_id=data['product_id'],
+                    batch_code=data['batch_code'],
+                    quantity=data['quantity'],
+                    expiration_date=data['expiration_date'],
+                    date_received=receipt.received_on,
+                    receipt=receipt,
+                )
+                for _, data in accepted
+            ], batch_size=batch_size)
+
+            # Not every backend returns ids from bulk inserts
+            batches = list(receipt.batches.values_list('pk', 'product_id', 'quantity'))
+            reason = f'Goods receipt {receipt.reference or f"#{receipt.pk}"}'
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    batch_id=batch_id, product_id=product_id, kind=StockMovement.RECEIPT,
+                    quantity=quantity, reason=reason, created_by=user,
+                )
+                for batch_id, product_id, quantity in batches
+            ], batch_size=batch_size)
+            Product.objects.filter(pk__in={product_id for _, product_id, _ in batches}).refresh_stock_summary()
+    except IntegrityError:
+        # A batch code was taken between the check and the insert
+        raise ReceivingError([{'line': None, 'errors': {'batch_code': ['A batch code in this delivery was just taken; send it again.']}}])
+    return receipt
@@ -0,0 +1,150 @@
+"""
+Resized renditions of Product.image.
+
+After an upload commits, a background worker thread renders every size in
+settings.PRODUCT_IMAGE_RENDITIONS['SIZES'] as WebP and JPEG, stores them under
+content-hashed names and records them in Product.image_renditions. Because a
+name changes whenever its content does, the files can be cached forever.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.views.static import serve
+from PIL import Image, ImageOps
+
+from .models import Product, catalog_changed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'thumbnail': 160, 'card': 400, 'detail': 1000}
+RENDITION_DIR = 'product_images/renditions'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_executor = None
+
+
+def get_config():
+    return getattr(settings, 'PRODUCT_IMAGE_RENDITIONS', {})
+
+
+def get_sizes():
+    return get_config().get('SIZES', DEFAULT_SIZES)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_config().get('WORKERS', 2),
+            thread_name_prefix='renditions'
+        )
+    return _executor
+
+
+def schedule_renditions(product_id):
+    """Renders the product's image once the current transaction commits."""
+    def submit():
+        if get_config().get('ASYNC', True):
+            _get_executor().submit(_run_in_worker, product_id)
+        else:
+            generate_renditions(product_id)
+
+    transaction.on_commit(submit)
+
+
+def _run_in_worker(product_id):
+    close_old_connections()
+    try:
+        generate_renditions(product_id)
+    except Exception:
+        logger.exception("Could not render images for product %s", product_id)
+    finally:
+        close_old_connections()
+
+
+def _encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    else:
+        if image.mode != 'RGB':
+            # JPEG has no alpha channel; flatten onto white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+            image = background
+        image.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def generate_renditions(product_id):
+    """
+    Renders and stores every rendition of a product's current image and saves
+    their names on the product. Returns the renditions, or None when the product
+    has no image (or it changed while rendering).
+    """
+    product = Product.objects.filter(pk=product_id).only('id', 'image').first()
+    if product is None or not product.image:
+        return None
+
+    source_name = product.image.name
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+
+    with product.image.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in original.getbands() or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    renditions = {}
+    for name, max_size in get_sizes().items():
+        resized = original.copy()
+        resized.thumbnail((max_size, max_size), Image.LANCZOS)
+        renditions[name] = {}
+        for image_format in ('webp', 'jpeg'):
+            content = _encode(resized, image_format)
+            digest = hashlib.sha256(content).hexdigest()[:16]
+            path = f'{RENDITION_DIR}/{stem}.{name}.{digest}.{"jpg" if image_format == "jpeg" else "webp"}'
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(content))
+            renditions[name][image_format] = path
+
+    # Only record them if the image was not replaced in the meantime
+    updated = Product.objects.filter(pk=product_id, image=source_name).update(image_renditions=renditions)
+    if not updated:
+        return None
+    catalog_changed([product_id])
+    return renditions
+
+
+def rendition_urls(product, request=None):
+    """{rendition: {format: url}} for a product, or None until they are rendered."""
+    if not product.image or not product.image_renditions:
+        return None
+
+    def url(name):
+        location = default_storage.url(name)
+        return request.build_absolute_uri(location) if request else location
+
+    return {
+        rendition: {image_format: url(path) for image_format, path in formats.items()}
+        for rendition, formats in product.image_renditions.items()
+    }
+
+
+def serve_rendition(request, path):
+    """
+    Development server view for rendition files with far-future caching. In
+    production the web server serving MEDIA_ROOT should send the same header
+    for product_images/renditions/.
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
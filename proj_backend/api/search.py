@@ -0,0 +1,149 @@
+"""
+Full-text product search.
+
+MySQL uses a FULLTEXT index on api_product. SQLite (local development) uses an
+external-content FTS5 table kept in sync with api_product by triggers. Any
+other backend falls back to case-insensitive substring matching.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+PRODUCT_TABLE = 'api_product'
+SEARCH_COLUMNS = ('product_name', 'brand_name', 'description')
+MYSQL_INDEX = 'product_fulltext_idx'
+FTS_TABLE = 'api_product_fts'
+MAX_TERMS = 10
+
+# InnoDB leaves words shorter than innodb_ft_min_token_size and its default
+# stopwords out of the index, so a required (+) term among them would make the
+# whole query match nothing. These mirror the server defaults.
+MYSQL_MIN_TOKEN_SIZE = 3
+MYSQL_STOPWORDS = frozenset({
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for',
+    'from', 'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the',
+    'this', 'to', 'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und',
+    'www',
+})
+
+_columns = ', '.join(SEARCH_COLUMNS)
+_new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+_old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+
+SQLITE_FTS_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_columns}, content='{PRODUCT_TABLE}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {_columns} ON {PRODUCT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+]
+
+
+def search_terms(query):
+    """Splits a user query into plain word tokens, dropping any search operators."""
+    return re.findall(r'\w+', query or '')[:MAX_TERMS]
+
+
+def mysql_boolean_query(terms):
+    """
+    The MATCH ... AGAINST query for `terms` in boolean mode. Indexed terms are
+    required and also match longer words; the others are only optional, so
+    they can raise the rank but never exclude a product.
+    """
+    parts = []
+    for term in terms:
+        indexed = len(term) >= MYSQL_MIN_TOKEN_SIZE and term.lower() not in MYSQL_STOPWORDS
+        parts.append(f'+{term}*' if indexed else f'{term}*')
+    return ' '.join(parts)
+
+
+# {database alias: whether the FTS5 index is in place}, so searches do not
+# look it up every time; set by ensure_search_index() after each migrate
+_fts_available = {}
+
+
+def _sqlite_fts_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{FTS_TABLE}_a_'],
+        )
+        return cursor.fetchone()[0] == 3
+
+
+def sqlite_fts_available(connection):
+    """Whether search can use the FTS5 index, checked once per process and database."""
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = _sqlite_fts_available(connection)
+    return _fts_available[connection.alias]
+
+
+def ensure_sqlite_search_index(connection):
+    """
+    (Re)creates the FTS5 table and its triggers. SQLite migrations that alter
+    api_product rebuild the table and drop its triggers, so this also runs after
+    every migrate; the index is repopulated whenever the triggers were missing.
+    """
+    try:
+        if not _sqlite_fts_available(connection):
+            with connection.cursor() as cursor:
+                for statement in SQLITE_FTS_SQL:
+                    cursor.execute(statement)
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        _fts_available[connection.alias] = True
+    except OperationalError:
+        # SQLite built without FTS5; search_products() falls back to LIKE
+        _fts_available[connection.alias] = False
+
+
+def ensure_search_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate handler, see ApiConfig.ready()."""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        ensure_sqlite_search_index(connection)
+
+
+def search_products(queryset, query):
+    """
+    Filters a Product queryset down to the products matching `query`, ordered
+    by relevance (best first) and annotated with `search_rank`.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'mysql':
+        boolean_query = mysql_boolean_query(terms)
+        columns = ', '.join(f'{PRODUCT_TABLE}.{column}' for column in SEARCH_COLUMNS)
+        return queryset.annotate(
+            search_rank=RawSQL(f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)", (boolean_query,))
+        ).filter(search_rank__gt=0).order_by('-search_rank', 'id')
+
+    if connection.vendor == 'sqlite' and sqlite_fts_available(connection):
+        match_query = ' '.join(f'"{term}"*' for term in terms)
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match_query,))
+        # bm25() is lower for better matches; only computed for the matching rows
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {PRODUCT_TABLE}.id",
+            (match_query,),
+        )
+        return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(product_name__icontains=term)
+            | Q(brand_name__icontains=term)
+            | Q(description__icontains=term)
+        )
+    return queryset.filter(condition).order_by('product_name', 'id')
@@ -1,10 +1,10 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth import get_user_model
-from .models import Product, ProductBatch, Prescription, Order, OrderItem, Report
-from datetime import date
-from django.utils import timezone
-import json
-from decimal import Decimal
+from .models import GoodsReceipt, Product, ProductBatch, Prescription, Order, OrderItem, Report, StockAlert, StockMovement
+from .renditions import rendition_urls
+from .allocation import AllocationError, load_products, parse_order_lines
+from .order_intake import fill_order
 from django.utils import timezone
 from django.db import transaction
 from django.db import models
@@ -12,6 +12,67 @@ from django.db import models
 
 User = get_user_model()
 
+# -----------------------------
+# Sparse Fieldsets
+# -----------------------------
+class SparseFieldsMixin:
+    """
+    Lets read requests trim a serializer: ?fields=a,b keeps only the listed
+    fields (plus id), and ?expand=x,y picks which nested relations from
+    `expandable_fields` are included (an empty ?expand= includes none; without
+    ?expand= all of them, or none when `expand_by_default` is off).
+    Dropped fields are removed before serialization, so their methods never run.
+    A name the serializer does not have is answered with 400.
+    """
+    expandable_fields = ()
+    # Whether the expandable fields are included when the request names none
+    expand_by_default = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = self.requested_fields(self.context.get('request'))
+        if wanted is not None:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Names of the fields a request asked for, or None for every field."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if fields is None and expand is None:
+            return None if cls.expand_by_default else set(cls.Meta.fields) - set(cls.expandable_fields)
+
+        available = set(cls.Meta.fields)
+        if fields is not None:
+            wanted = cls._parse_names('fields', fields, available)
+            wanted.add('id')
+        else:
+            wanted = available - set(cls.expandable_fields)
+        if expand is not None:
+            wanted |= cls._parse_names('expand', expand, set(cls.expandable_fields))
+        return wanted
+
+    @staticmethod
+    def _parse_names(param, value, available):
+        names = {name.strip() for name in value.split(',')} - {''}
+        unknown = names - available
+        if unknown:
+            raise serializers.ValidationError({param: [
+                f"Unknown field(s): {', '.join(sorted(unknown))}. "
+                f"Available: {', '.join(sorted(available)) or 'none'}."
+            ]})
+        return names
+
+    @classmethod
+    def wants_any(cls, request, names):
+        """Whether the representation for this request includes any of `names`."""
+        wanted = cls.requested_fields(request)
+        return wanted is None or bool(wanted & set(names))
+
 # -----------------------------
 # User Serializers
 # -----------------------------
@@ -50,23 +111,37 @@ class UserSerializer(serializers.ModelSerializer):
 # -----------------------------
 # Product Serializer
 # -----------------------------
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     total_stock = serializers.IntegerField(read_only=True)
     is_low_stock = serializers.BooleanField(read_only=True)
     is_out_of_stock = serializers.BooleanField(read_only=True)
+    sellable_stock = serializers.IntegerField(source='stock_summary.sellable_stock', read_only=True)
+    nearest_expiry = serializers.DateField(source='stock_summary.nearest_expiry', read_only=True)
+    availability_state = serializers.CharField(source='stock_summary.availability_state', read_only=True)
     is_available = serializers.SerializerMethodField()
-    availability_message = serializers.SerializerMethodField()
+    availability_message = serializers.CharField(source='stock_summary.availability_message', read_only=True)
     active_batches = serializers.SerializerMethodField()
+    image_renditions = serializers.SerializerMethodField()
+
+    expandable_fields = ('active_batches',)
+    # Fields computed from the batches that ProductQuerySet.catalog() prefetches
+    batch_fields = (
+        'active_batches', 'sellable_stock', 'nearest_expiry',
+        'availability_state', 'is_available', 'availability_message',
+    )
 
     class Meta:
         model = Product
         fields = [
             'id', 'product_name', 'brand_name', 'category',
-            'image', 'price', 'description', 'requires_prescription',
+            'image', 'image_renditions', 'price', 'description', 'requires_prescription',
             'low_stock_threshold', 
             'total_stock',         
             'is_low_stock',         
             'is_out_of_stock',
+            'sellable_stock',
+            'nearest_expiry',
+            'availability_state',
             'is_available',
             'availability_message',
             'active_batches'
@@ -75,14 +150,16 @@ class ProductSerializer(serializers.ModelSerializer):
     def get_is_available(self, obj):
         return obj.availability_status[0]
 
-    def get_availability_message(self, obj):
-        return obj.availability_status[1]
+    def get_image_renditions(self, obj):
+        return rendition_urls(obj, self.context.get('request'))
 
     def get_active_batches(self, obj):
-        active_batches = obj.batches.filter(
-            is_active=True,
-            expiration_date__gt=timezone.now().date()
-        ).order_by('expiration_date')
+        active_batches = getattr(obj, 'sellable_batches', None)
+        if active_batches is None:
+            active_batches = obj.batches.filter(
+                is_active=True,
+                expiration_date__gt=timezone.now().date()
+            ).order_by('expiration_date')
         return ProductBatchSerializer(active_batches, many=True).data
 
     def validate(self, data):
@@ -111,11 +188,24 @@ class ProductSerializer(serializers.ModelSerializer):
         return data
 
 
+class ProductImportSerializer(serializers.ModelSerializer):
+    """
+    Field validation for one row of a product import. Name and brand uniqueness
+    are checked for a whole chunk at once by api.product_import.
+    """
+    class Meta:
+        model = Product
+        fields = [
+            'product_name', 'brand_name', 'category', 'price',
+            'description', 'requires_prescription', 'low_stock_threshold',
+        ]
+
+
 # -----------------------------
 # Product Batch Serializer
 # -----------------------------
 
-class ProductBatchSerializer(serializers.ModelSerializer):
+class ProductBatchSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     stock_status = serializers.SerializerMethodField()
     is_expired = serializers.SerializerMethodField()
     days_until_expiry = serializers.SerializerMethodField()
@@ -145,6 +235,24 @@ class ProductBatchSerializer(serializers.ModelSerializer):
         return max(0, days)
 
     def validate(self, data):
+        errors = self.value_errors(data)
+
+        # Validate batch code uniqueness
+        if 'batch_code' in data:
+            batch_qs = ProductBatch.objects.filter(batch_code=data['batch_code'])
+            if self.instance:
+                batch_qs = batch_qs.exclude(pk=self.instance.pk)
+            if batch_qs.exists():
+                errors['batch_code'] = 'A batch with this code already exists.'
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return data
+
+    @staticmethod
+    def value_errors(data):
+        """Checks of the dates and quantity, which need no other rows."""
         errors = {}
 
         # Validate expiration date
@@ -162,19 +270,172 @@ class ProductBatchSerializer(serializers.ModelSerializer):
             if data['date_received'] > timezone.now().date():
                 errors['date_received'] = 'Date received cannot be in the future.'
 
-        # Validate batch code uniqueness
-        if 'batch_code' in data:
-            batch_qs = ProductBatch.objects.filter(batch_code=data['batch_code'])
-            if self.instance:
-                batch_qs = batch_qs.exclude(pk=self.instance.pk)
-            if batch_qs.exists():
-                errors['batch_code'] = 'A batch with this code already exists.'
+        return errors
+
+class BatchBulkUpdateSerializer(serializers.ModelSerializer):
+    """
+    One item of PATCH /api/batches/bulk/: a batch id and the fields to change.
+    batch_code uniqueness is checked for all items together in api.batch_bulk.
+    """
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = ProductBatch
+        fields = ['id', 'batch_code', 'quantity', 'expiration_date', 'date_received', 'is_active']
+        extra_kwargs = {'batch_code': {'validators': []}}
+
+    def validate(self, data):
+        errors = ProductBatchSerializer.value_errors(data)
+        if 'id' not in data:
+            errors['id'] = 'This field is required.'
+        if 'batch_code' in data and not data['batch_code'].isdigit():
+            errors['batch_code'] = 'Batch code must contain only numbers.'
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
+
+class BatchProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'product_name', 'brand_name', 'category', 'price', 'requires_prescription']
+
+class ExpiredBatchSerializer(serializers.ModelSerializer):
+    """A batch past its expiration date that still holds units, with its product."""
+    product = BatchProductSerializer(read_only=True)
+    days_expired = serializers.SerializerMethodField()
+    value = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = ProductBatch
+        fields = [
+            'id', 'batch_code', 'quantity', 'expiration_date', 'date_received',
+            'is_active', 'days_expired', 'value', 'product',
+        ]
+        read_only_fields = fields
+
+    def get_days_expired(self, obj):
+        return (timezone.now().date() - obj.expiration_date).days
 
+class ExpiredProductSerializer(serializers.ModelSerializer):
+    """The expired stock of one product, summed over its batches."""
+    expired_batches = serializers.IntegerField(read_only=True)
+    expired_units = serializers.IntegerField(read_only=True)
+    expired_value = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+    earliest_expiry = serializers.DateField(read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'product_name', 'brand_name', 'category', 'price', 'requires_prescription',
+            'expired_batches', 'expired_units', 'expired_value', 'earliest_expiry',
+        ]
+        read_only_fields = fields
+
+# -----------------------------
+# Goods Receipt Serializers
+# -----------------------------
+class GoodsReceiptLineSerializer(serializers.Serializer):
+    """
+    One batch of a delivery. The product is given by id or by exact name;
+    lookups and batch_code uniqueness are checked for all lines in api.receiving.
+    """
+    product = serializers.IntegerField(required=False)
+    product_name = serializers.CharField(max_length=255, required=False)
+    batch_code = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1)
+    expiration_date = serializers.DateField()
+
+    def validate(self, data):
+        errors = ProductBatchSerializer.value_errors(data)
+        if not data['batch_code'].isdigit():
+            errors['batch_code'] = 'Batch code must contain only numbers.'
+        if ('product' in data) == ('product_name' in data):
+            errors['product'] = 'Give either product or product_name.'
         if errors:
             raise serializers.ValidationError(errors)
+        return data
+
+class GoodsReceiptSerializer(serializers.ModelSerializer):
+    created_by_name = serializers.CharField(source='created_by.username', read_only=True, default=None)
+
+    class Meta:
+        model = GoodsReceipt
+        fields = [
+            'id', 'reference', 'supplier', 'received_on', 'notes',
+            'batch_count', 'total_units', 'created_by', 'created_by_name', 'created_at',
+        ]
+        read_only_fields = ['id', 'batch_count', 'total_units', 'created_by', 'created_by_name', 'created_at']
+
+    def validate_received_on(self, value):
+        if value > timezone.now().date():
+            raise serializers.ValidationError('Date received cannot be in the future.')
+        return value
+
+class GoodsReceiptDetailSerializer(GoodsReceiptSerializer):
+    batches = ProductBatchSerializer(many=True, read_only=True)
+
+    class Meta(GoodsReceiptSerializer.Meta):
+        fields = GoodsReceiptSerializer.Meta.fields + ['batches']
+
+# -----------------------------
+# Stock Ledger Serializers
+# -----------------------------
+class StockMovementSerializer(serializers.ModelSerializer):
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+
+    class Meta:
+        model = StockMovement
+        fields = [
+            'id', 'batch', 'product', 'kind', 'kind_display', 'quantity',
+            'reason', 'order', 'created_by', 'created_at',
+        ]
+        read_only_fields = fields
 
+class StockAdjustmentSerializer(serializers.Serializer):
+    """
+    A manual stock change. A write-off removes `quantity` units; a count
+    correction changes the quantity by `quantity`, which may be negative.
+    """
+    kind = serializers.ChoiceField(choices=[StockMovement.WRITE_OFF, StockMovement.CORRECTION])
+    quantity = serializers.IntegerField()
+    reason = serializers.CharField(max_length=255)
+
+    def validate(self, data):
+        if data['quantity'] == 0:
+            raise serializers.ValidationError({'quantity': 'Must not be 0.'})
+        if data['kind'] == StockMovement.WRITE_OFF:
+            if data['quantity'] < 0:
+                raise serializers.ValidationError({'quantity': 'Write off a positive number of units.'})
+            data['quantity'] = -data['quantity']
         return data
 
+# -----------------------------
+# Stock Alert Serializers
+# -----------------------------
+class StockAlertSerializer(serializers.ModelSerializer):
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+    product_name = serializers.CharField(source='product.product_name', read_only=True)
+    batch_code = serializers.CharField(source='batch.batch_code', read_only=True, default=None)
+    message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StockAlert
+        fields = [
+            'id', 'kind', 'kind_display', 'product', 'product_name', 'batch', 'batch_code',
+            'quantity', 'threshold', 'message', 'created_at', 'read_at',
+        ]
+        read_only_fields = fields
+
+    def get_message(self, obj):
+        name = obj.product.product_name
+        if obj.kind == StockAlert.OUT_OF_STOCK:
+            return f"{name} is out of stock."
+        if obj.kind == StockAlert.LOW_STOCK:
+            return f"{name} is running low: {obj.quantity} left (threshold {obj.threshold})."
+        if obj.kind == StockAlert.RESTOCKED:
+            return f"{name} is back in stock: {obj.quantity} available."
+        return f"Batch {obj.batch.batch_code} of {name} ({obj.quantity} units) expires on {obj.batch.expiration_date}."
+
 # -----------------------------
 # Prescription Serializer
 # -----------------------------
@@ -254,7 +515,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
 # Order Serializer
 # -----------------------------
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -269,6 +530,12 @@ class OrderSerializer(serializers.ModelSerializer):
     requires_prescription = serializers.SerializerMethodField()
     pickup_date = serializers.DateTimeField(format="%Y-%m-%dT%H:%M")
 
+    expandable_fields = ('items',)
+    # Fields computed from the order items
+    item_fields = ('items',)
+    # Fields annotated by Order.objects.with_prescription_info()
+    prescription_fields = ('prescription_status', 'requires_prescription')
+
     class Meta:
         model = Order
         fields = [
@@ -287,12 +554,17 @@ class OrderSerializer(serializers.ModelSerializer):
         return None
 
     def get_prescription_status(self, obj):
+        # Annotated by Order.objects.with_prescription_info() on the list and detail views
+        if hasattr(obj, 'latest_prescription_status'):
+            return obj.latest_prescription_status
         prescription = Prescription.objects.filter(order=obj).first()
         if prescription:
             return prescription.status
         return None
 
     def get_requires_prescription(self, obj):
+        if hasattr(obj, 'has_prescription_items'):
+            return obj.has_prescription_items
         return any(item.batch.product.requires_prescription for item in obj.items.all())
 
     def validate(self, data):
@@ -311,18 +583,23 @@ class OrderSerializer(serializers.ModelSerializer):
             if pickup_hour < 9 or pickup_hour >= 17:
                 raise serializers.ValidationError("Pickup time must be between 9:00 AM and 5:00 PM.")
 
-        # Validate prescription file for prescription-required products
-        requires_prescription = False
-        for item in order_items:
-            try:
-                batch = ProductBatch.objects.get(id=item['batch_id'])
-                if batch.product.requires_prescription:
-                    requires_prescription = True
-                    break
-            except ProductBatch.DoesNotExist:
-                raise serializers.ValidationError(
-                    f"Batch with id {item['batch_id']} does not exist."
-                )
+        # Resolve the ordered products; batches are allocated when the order is created
+        try:
+            lines = parse_order_lines(order_items)
+            products = load_products(lines)
+        except AllocationError as e:
+            raise serializers.ValidationError({'order_items': [str(e)]})
+
+        for product_id, quantity in lines.items():
+            product = products[product_id]
+            if product.sellable_stock < quantity:
+                raise serializers.ValidationError({'order_items': [
+                    f"Only {product.sellable_stock} unit(s) of {product.product_name} are available."
+                ]})
+        data['order_items'] = lines
+        data['products'] = products
+
+        requires_prescription = any(product.requires_prescription for product in products.values())
 
         if requires_prescription and not data.get('prescription_file'):
             raise serializers.ValidationError(
@@ -338,7 +615,8 @@ class OrderSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        order_items = validated_data.pop('order_items', [])
+        lines = validated_data.pop('order_items')
+        products = validated_data.pop('products')
         prescription_file = validated_data.pop('prescription_file', None)
         payment_proof = validated_data.pop('payment_proof', None)
         
@@ -348,53 +626,51 @@ class OrderSerializer(serializers.ModelSerializer):
             if not request or not request.user.is_authenticated:
                 raise serializers.ValidationError("User must be authenticated to create an order")
             
-            # Create the order with the authenticated user as customer
+            # Create the order with the authenticated user as customer. Items
+            # are priced from the catalog, so the total is known up front.
             order = Order.objects.create(
                 customer=request.user,
                 payment_proof=payment_proof,
+                total_amount=sum(products[product_id].price * quantity for product_id, quantity in lines.items()),
                 **validated_data
             )
-            total_amount = 0
-
-            # Create order items and update batch quantities
-            for item_data in order_items:
-                try:
-                    batch = ProductBatch.objects.get(id=item_data['batch_id'])
-                    product = batch.product
-
-                    # Create order item
-                    order_item = OrderItem.objects.create(
-                        order=order,
-                        batch=batch,
-                        quantity=item_data['quantity'],
-                        price_at_time=item_data['price_at_time']
-                    )
-
-                    # Update batch quantity
-                    batch.quantity -= item_data['quantity']
-                    batch.save()
-
-                    # Update total amount
-                    total_amount += order_item.quantity * order_item.price_at_time
-
-                    # Create prescription if required and file is provided
-                    if product.requires_prescription and prescription_file:
-                        Prescription.objects.create(
-                            order=order,
-                            prescription_file=prescription_file,
-                            status='Pending'
-                        )
-                except ProductBatch.DoesNotExist:
-                    raise serializers.ValidationError(
-                        f"Batch with id {item_data['batch_id']} does not exist."
-                    )
-
-            # Update order total
-            order.total_amount = total_amount
-            order.save()
 
+            # Take the stock from the batches that expire first
+            try:
+                fill_order(order, lines, products, prescription_file, user=request.user)
+            except AllocationError as e:
+                raise serializers.ValidationError({'order_items': [str(e)]})
+
+        # The response lists every item with its batch and product; load them in one query
+        models.prefetch_related_objects(
+            [order], models.Prefetch('items', queryset=OrderItem.objects.select_related('batch__product'))
+        )
         return order
 
+class OrderSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    A customer's order as listed in their order history; the items are only
+    included with ?expand=items. Expects the annotations added by
+    views.order_history_queryset().
+    """
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    payment_method_display = serializers.CharField(source='get_payment_method_display', read_only=True)
+    prescription_status = serializers.CharField(source='latest_prescription_status', read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    items = OrderItemSerializer(many=True, read_only=True)
+    pickup_date = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+
+    expandable_fields = ('items',)
+    expand_by_default = False
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_date', 'status', 'status_display', 'total_amount', 'total_quantity',
+            'payment_method', 'payment_method_display', 'pickup_date', 'prescription_status', 'items'
+        ]
+        read_only_fields = fields
+
 # -----------------------------
 # Report Serializers
 # -----------------------------
@@ -0,0 +1,122 @@
+"""
+Deactivation of expired and depleted batches.
+
+sweep_batches() finds every active batch that expired before today or has no
+units left and deactivates them all with one UPDATE, recording the run in
+BatchSweepRun. It also refreshes the stored stock summary of the products
+whose batches stopped being sellable with the date, including batches that
+expire today and stay active until the next day's sweep, so the catalog
+filters and facet counts agree with the product list again after the first
+sweep of the day. It runs from the sweep_batches command (e.g. nightly from
+cron) or, when BATCH_SWEEPER['SCHEDULE'] is on, from a background thread in
+each web process. Concurrent runs are harmless: a batch is only updated while
+it still matches.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BatchSweepRun, Product, ProductBatch
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+
+
+def get_config():
+    return getattr(settings, 'BATCH_SWEEPER', {})
+
+
+def stale_batches(today):
+    return ProductBatch.objects.filter(is_active=True).filter(
+        Q(expiration_date__lt=today) | Q(quantity=0)
+    )
+
+
+def sweep_batches(today=None, trigger='command', dry_run=False):
+    """
+    Deactivates the active batches that expired before `today` or are empty.
+    Returns the BatchSweepRun (unsaved when `dry_run`).
+    """
+    started = time.perf_counter()
+    today = today or timezone.now().date()
+
+    with transaction.atomic():
+        found = list(stale_batches(today).select_for_update().values_list('pk', 'product_id', 'expiration_date'))
+        expired = [pk for pk, _, expiration_date in found if expiration_date < today]
+        depleted = [pk for pk, _, expiration_date in found if expiration_date >= today]
+
+        run = BatchSweepRun(
+            swept_for=today,
+            trigger=trigger,
+            expired_batch_ids=expired,
+            depleted_batch_ids=depleted,
+        )
+        if dry_run:
+            run.deactivated_count = len(found)
+            return run
+
+        if found:
+            run.deactivated_count = stale_batches(today).filter(
+                pk__in=[pk for pk, _, _ in found]
+            ).update(is_active=False)
+        # Batches expiring today stopped being sellable at midnight
+        expiring = ProductBatch.objects.filter(is_active=True, expiration_date=today).values_list('product_id', flat=True)
+        product_ids = {product_id for _, product_id, _ in found} | set(expiring)
+        if product_ids:
+            Product.objects.filter(pk__in=product_ids).refresh_stock_summary()
+        run.duration_ms = round((time.perf_counter() - started) * 1000)
+        run.save()
+    return run
+
+
+def _run_scheduler(interval, stop):
+    from .alerts import create_expiry_alerts
+
+    while not stop.wait(interval):
+        close_old_connections()
+        try:
+            run = sweep_batches(trigger='scheduler')
+            if run.deactivated_count:
+                logger.info("Deactivated %s expired or empty batches", run.deactivated_count)
+            # Batches are alerted once, so running it more than daily is harmless
+            create_expiry_alerts()
+        except Exception:
+            logger.exception("Batch sweep failed")
+        finally:
+            close_old_connections()
+
+
+def _serves_requests():
+    """False for management commands other than runserver's serving process."""
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program not in ('manage.py', 'django-admin', 'django-admin.py'):
+        return True
+    if sys.argv[1:2] != ['runserver']:
+        return False
+    # The autoreloader's parent process only watches files
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+
+def start_scheduler():
+    """Starts the in-process sweeper if BATCH_SWEEPER['SCHEDULE'] is on (see ApiConfig.ready)."""
+    global _scheduler
+    config = get_config()
+    if _scheduler is not None or not config.get('SCHEDULE', False) or not _serves_requests():
+        return
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_run_scheduler,
+        args=(config.get('INTERVAL_MINUTES', 60) * 60, stop),
+        name='batch-sweeper',
+        daemon=True,
+    )
+    thread.start()
+    _scheduler = (thread, stop)
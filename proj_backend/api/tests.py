@@ -1,3 +1,1680 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, time as day_time, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from . import catalog_snapshot
+from .alerts import create_expiry_alerts
+from .allocation import (
+    InsufficientStock, _fefo_batches, _first_batches, allocate, return_stock, take_stock, take_stock_bulk,
+)
+from .inventory_snapshot import write_inventory_snapshot
+from .ledger import find_drift, ledger_balances, take_snapshots
+from .models import (
+    CatalogVersion, CustomUser, GoodsReceipt, IdempotencyKey, InventorySnapshot, Order, OrderIntake, OrderItem,
+    Prescription, Product, ProductBatch, ProductFacet, StockAlert, StockMovement, StockSnapshot,
+)
+from .order_intake import _finish, claim_next, process_intake
+from .product_import import ProductImport
+from .renditions import RENDITION_DIR, serve_rendition
+from .serializers import ProductBatchSerializer, ProductSerializer
+from .search import _sqlite_fts_available, mysql_boolean_query
+from .sweeper import sweep_batches
+
+HOT_TABLES = {ProductBatch._meta.db_table, Order._meta.db_table, Prescription._meta.db_table}
+
+
+def full_table_scans(sql, tables):
+    """The tables out of `tables` that the database would read in full to run `sql`."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+            # "SCAN t USING INDEX i" walks an index; a bare "SCAN t" reads the table
+            scanned = [re.fullmatch(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?', detail) for detail in details]
+            return {match.group(1) for match in scanned if match} & tables
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return {row['table'] for row in rows if row['type'] == 'ALL'} & tables
+        if connection.vendor == 'postgresql':
+            # Small test tables are always cheaper to read in full otherwise
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            return set(re.findall(r'Seq Scan on (\w+)', plan)) & tables
+    raise NotImplementedError(connection.vendor)
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    The hottest filters must be answered from an index. Each test runs an
+    endpoint or query, EXPLAINs the SELECTs it sent and fails when one of them
+    reads a whole batch, order or prescription table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        Product.objects.bulk_create([
+            Product(product_name=f'Plan {i}', brand_name=f'Plan brand {i}', category='Tablet', price='10.00')
+            for i in range(20)
+        ])
+        products = list(Product.objects.filter(product_name__startswith='Plan '))
+        ProductBatch.objects.bulk_create([
+            ProductBatch(
+                product=product,
+                batch_code=f'{product.pk}{index:03d}',
+                quantity=index * 5,
+                expiration_date=today + timedelta(days=30 * index - 30),
+                is_active=index != 3,
+            )
+            for product in products for index in range(6)
+        ])
+        cls.product = products[0]
+
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'plan-customer-{i}', userrole='Customer') for i in range(10)
+        ])
+        customers = list(CustomUser.objects.filter(username__startswith='plan-customer-'))
+        cls.customer = customers[0]
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        Order.objects.bulk_create([
+            Order(customer=customers[i % len(customers)], status=statuses[i % len(statuses)], total_amount=i)
+            for i in range(300)
+        ])
+        Prescription.objects.bulk_create([
+            Prescription(order=order, prescription_file='prescriptions/plan.jpg', status=status)
+            for order, status in zip(Order.objects.all()[:150], ['Pending', 'Approved', 'Rejected'] * 50)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        today = timezone.now().date()
+        self.report_range = {
+            'start_date': (today - timedelta(days=7)).isoformat(),
+            'end_date': today.isoformat(),
+        }
+
+    def assertNoFullScans(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            scans = full_table_scans(sql, HOT_TABLES)
+            self.assertFalse(scans, f"Full scan of {', '.join(sorted(scans))}:\n{sql}")
+
+    def test_sellable_batches(self):
+        today = timezone.now().date()
+        self.assertNoFullScans(lambda: self.client.get(f'/api/product/{self.product.pk}/batches/active/'))
+        self.assertNoFullScans(lambda: list(_fefo_batches(self.product.pk, today)))
+        self.assertNoFullScans(lambda: _first_batches([self.product.pk], today))
+        self.assertNoFullScans(lambda: Product.objects.filter(pk=self.product.pk).compute_stock_summaries())
+
+    def test_dashboard_and_sales_report(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/dashboard/stats/'))
+        self.assertNoFullScans(lambda: self.client.get('/api/reports/sales/', self.report_range))
+
+    def test_order_history(self):
+        self.client.force_authenticate(self.customer)
+        self.assertNoFullScans(lambda: self.client.get('/api/orders/mine/', {'expand': 'items'}))
+
+    def test_prescription_queue(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/prescriptions/pending/'))
+        self.assertNoFullScans(lambda: self.client.get('/api/reports/prescriptions/', self.report_range))
+
+
+class OrderListQueryTests(TestCase):
+    """/api/orders/ runs the same queries for a page of 5 orders as for 25."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        Product.objects.bulk_create([
+            Product(product_name=f'Listed {i}', brand_name=f'Listed brand {i}', category='Tablet',
+                    price='10.00', requires_prescription=i == 0)
+            for i in range(3)
+        ])
+        products = list(Product.objects.filter(product_name__startswith='Listed '))
+        ProductBatch.objects.bulk_create([
+            ProductBatch(product=product, batch_code=f'{product.pk}900', quantity=100,
+                         expiration_date=today + timedelta(days=90))
+            for product in products
+        ])
+        cls.batches = list(ProductBatch.objects.filter(product__in=products))
+        cls.customer = CustomUser.objects.create(username='list-customer', userrole='Customer')
+
+    def add_orders(self, count):
+        Order.objects.bulk_create([Order(customer=self.customer, total_amount=30) for _ in range(count)])
+        orders = list(Order.objects.order_by('-id')[:count])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, batch=batch, quantity=1, price_at_time=10, subtotal=10)
+            for order in orders for batch in self.batches
+        ])
+        Prescription.objects.bulk_create([
+            Prescription(order=order, prescription_file='prescriptions/list.jpg', status='Approved')
+            for order in orders[::2]
+        ])
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.add_orders(5)
+        orders, small = self.list_queries()
+        self.assertEqual(len(orders), 5)
+        self.add_orders(20)
+        orders, large = self.list_queries()
+        self.assertEqual(len(orders), 25)
+        self.assertEqual(small, large)
+        self.assertTrue(all(order['requires_prescription'] for order in orders))
+        statuses = [order['prescription_status'] for order in orders]
+        self.assertEqual((statuses.count('Approved'), statuses.count(None)), (13, 12))
+
+
+@override_settings(CATALOG_SNAPSHOT={'ENABLED': False, 'VERSION_CHECK_INTERVAL': 0})
+class ProductListQueryTests(TestCase):
+    """/api/products/ runs the same queries for 3 products as for 30, paginated or not."""
+
+    @classmethod
+    def setUpTestData(cls):
+        CatalogVersion.current()
+
+    def add_products(self, count):
+        today = timezone.now().date()
+        start = Product.objects.count()
+        Product.objects.bulk_create([
+            Product(product_name=f'Catalog {i:03d}', brand_name=f'Catalog brand {i:03d}', category='Tablet',
+                    price='2.00', low_stock_threshold=10)
+            for i in range(start, start + count)
+        ])
+        products = list(Product.objects.order_by('-id')[:count])
+        # Each state of the summary, with one batch or several
+        ProductBatch.objects.bulk_create([
+            ProductBatch(product=product, batch_code=f'{product.pk}8{index}', quantity=quantity,
+                         expiration_date=today + timedelta(days=days))
+            for number, product in enumerate(products)
+            for index, (quantity, days) in enumerate([
+                [], [(40, 30)], [(40, 30), (5, 60)], [(0, 30)], [(40, -1)],
+            ][number % 5])
+        ])
+        Product.objects.filter(pk__in=[product.pk for product in products]).refresh_stock_summary()
+
+    def list_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        products = response.data['results'] if isinstance(response.data, dict) else response.data
+        return products, len(queries)
+
+    def test_query_count_does_not_grow_with_products(self):
+        for params in [{}, {'paginate': 'false'}]:
+            with self.subTest(**params):
+                self.add_products(3)
+                products, small = self.list_queries(**params)
+                self.assertEqual(len(products), Product.objects.count())
+                self.add_products(27)
+                products, large = self.list_queries(**params)
+                self.assertEqual(len(products), Product.objects.count())
+                self.assertEqual(small, large)
+                Product.objects.all().delete()
+
+    def test_listed_summary_matches_live_batches(self):
+        self.add_products(5)
+        listed = {product['id']: product for product in self.list_queries(paginate='false')[0]}
+        expected = Product.objects.all().compute_stock_summaries()
+        self.assertEqual(
+            {summary['availability_state'] for summary in expected.values()},
+            {'no_batch', 'in_stock', 'low_stock', 'depleted', 'no_active_batches'},
+        )
+        for product in Product.objects.catalog():
+            # The batch count is only inferred from the stored state; it must not leak into the summary
+            self.assertNotIn('batch_count', product.stock_summary)
+            for field in ('sellable_stock', 'nearest_expiry', 'availability_state', 'availability_message'):
+                value = listed[product.pk][field]
+                if field == 'nearest_expiry' and value is not None:
+                    value = date.fromisoformat(value)
+                self.assertEqual(value, expected[product.pk][field], (product.product_name, field))
+
+PAGINATION = {'PAGE_SIZE': 50, 'MAX_PAGE_SIZE': 4, 'PAGE_SIZES': {'products': 3, 'orders': 2, 'order_history': 2},
+              'ALLOW_UNPAGINATED': True}
+
+
+@override_settings(API_PAGINATION=PAGINATION, CATALOG_SNAPSHOT={'ENABLED': False, 'VERSION_CHECK_INTERVAL': 0})
+class PaginationTests(TestCase):
+    """Cursor pages, page sizes from API_PAGINATION and the ?paginate=false switch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([
+            Product(product_name=f'Paged {i}', brand_name=f'Paged brand {i}', category='Tablet', price='1.00')
+            for i in range(7)
+        ])
+        cls.customer = CustomUser.objects.create(username='paged-customer', userrole='Customer')
+        Order.objects.bulk_create([Order(customer=cls.customer, total_amount=1) for _ in range(5)])
+        # Equal order dates, so the pages are told apart by id alone
+        Order.objects.update(order_date=timezone.now() - timedelta(hours=1))
+
+    def walk(self, client, path, **params):
+        pages = []
+        response = client.get(path, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            if not response.data['next']:
+                return pages
+            response = client.get(response.data['next'])
+
+    def test_walks_product_pages_without_overlap(self):
+        client = APIClient()
+        first = client.get('/api/products/')
+        self.assertEqual(len(first.data['results']), 3)
+        # A product added while paging sorts before the cursor and does not shift the later pages
+        Product.objects.create(product_name='Paged 0a', brand_name='Paged brand 0a', category='Tablet', price='1.00')
+        pages = [[row['id'] for row in first.data['results']]]
+        pages += self.walk(client, first.data['next'])
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(len(set(ids)), 7)
+        self.assertEqual(ids, list(Product.objects.filter(product_name__in=[f'Paged {i}' for i in range(7)])
+                                   .order_by('product_name', 'id').values_list('pk', flat=True)))
+
+    def test_walks_order_pages_with_equal_dates(self):
+        pages = self.walk(APIClient(), '/api/orders/')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sorted(pk for page in pages for pk in page), sorted(Order.objects.values_list('pk', flat=True)))
+
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        pages = self.walk(client, '/api/orders/mine/')
+        self.assertEqual([pk for page in pages for pk in page],
+                         list(Order.objects.order_by('-order_date', '-id').values_list('pk', flat=True)))
+
+    def test_page_size_is_capped(self):
+        client = APIClient()
+        self.assertEqual(len(client.get('/api/products/', {'page_size': 2}).data['results']), 2)
+        self.assertEqual(len(client.get('/api/products/', {'page_size': 100}).data['results']), 4)
+
+    def test_unpaginated_switch(self):
+        client = APIClient()
+        response = client.get('/api/products/', {'paginate': 'false'})
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+        # The order history is always paged
+        client.force_authenticate(self.customer)
+        self.assertEqual(len(client.get('/api/orders/mine/', {'paginate': 'false'}).data['results']), 2)
+
+        with override_settings(API_PAGINATION={**PAGINATION, 'ALLOW_UNPAGINATED': False}):
+            response = client.get('/api/products/', {'paginate': 'false'})
+        self.assertEqual(len(response.data['results']), 3)
+
+class StockSummaryTests(TestCase):
+    """The summary stored on Product follows every batch save and delete."""
+
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.product = Product.objects.create(
+            product_name='Summary', brand_name='Summary brand', category='Tablet', price='5.00', low_stock_threshold=10
+        )
+
+    def add_batch(self, code, quantity, days=90, **fields):
+        batch = ProductBatch(product=self.product, batch_code=code, quantity=quantity,
+                             expiration_date=self.today + timedelta(days=days), **fields)
+        batch.save()
+        return batch
+
+    def summary(self):
+        return Product.objects.values(*Product.STOCK_SUMMARY_FIELDS).get(pk=self.product.pk)
+
+    def test_follows_batch_saves_and_deletes(self):
+        self.assertEqual(self.summary()['availability_state'], 'no_batch')
+        first = self.add_batch('7001', 50, days=60)
+        second = self.add_batch('7002', 30, days=30)
+        self.add_batch('7003', 40, days=-1)
+        summary = self.summary()
+        self.assertEqual((summary['sellable_stock'], summary['active_stock']), (80, 120))
+        self.assertEqual(summary['nearest_expiry'], second.expiration_date)
+        self.assertEqual(summary['availability_state'], 'in_stock')
+
+        second.quantity = 5
+        second.save()
+        self.assertEqual((self.summary()['sellable_stock'], self.summary()['availability_state']), (55, 'low_stock'))
+
+        second.delete()
+        summary = self.summary()
+        self.assertEqual((summary['sellable_stock'], summary['nearest_expiry']), (50, first.expiration_date))
+        self.assertEqual(summary['availability_state'], 'in_stock')
+
+        first.is_active = False
+        first.save()
+        self.assertEqual(self.summary()['availability_state'], 'no_active_batches')
+
+    def test_migration_matches_live_summary(self):
+        migration = importlib.import_module('api.migrations.0021_product_stock_summary')
+        self.add_batch('7101', 50)
+        self.add_batch('7102', 0, days=10)
+        expected = self.summary()
+        Product.objects.filter(pk=self.product.pk).update(
+            active_stock=0, sellable_stock=0, nearest_expiry=None,
+            availability_state='no_batch', availability_message='No Batch',
+        )
+        migration.populate_stock_summary(apps, None)
+        self.assertEqual(self.summary(), expected)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.focused = Product.objects.create(
+            product_name='Amoxicillin 500', brand_name='Amoxil', category='Capsule', price='12.00',
+            description='Amoxicillin capsules.',
+        )
+        cls.passing = Product.objects.create(
+            product_name='Allergy syrup', brand_name='Tussin', category='Liquid', price='8.00',
+            description='Soothes allergies. Not to be taken together with amoxicillin or other antibiotics '
+                        'without asking a pharmacist first, and keep out of reach of children.',
+        )
+        Product.objects.create(product_name='Cetirizine', brand_name='Zyrtec', category='Tablet', price='6.00')
+
+    def search(self, query):
+        return APIClient().get('/api/products/search/', {'q': query})
+
+    def names(self, query):
+        response = self.search(query)
+        self.assertEqual(response.status_code, 200)
+        return [product['product_name'] for product in response.data['results']]
+
+    def test_ranks_closer_matches_first(self):
+        if connection.vendor == 'sqlite':
+            self.assertTrue(_sqlite_fts_available(connection))
+        self.assertEqual(self.names('amoxicillin'), ['Amoxicillin 500', 'Allergy syrup'])
+
+    def test_search_does_not_look_up_the_index(self):
+        # Whether the FTS5 index exists is known since migrate ran
+        with CaptureQueriesContext(connection) as queries:
+            self.names('amoxicillin')
+        self.assertFalse([query for query in queries.captured_queries if 'sqlite_master' in query['sql']])
+
+    def test_prefixes_and_all_terms(self):
+        self.assertEqual(self.names('amox'), ['Amoxicillin 500', 'Allergy syrup'])
+        self.assertEqual(self.names('amoxicillin syrup'), ['Allergy syrup'])
+        self.assertEqual(self.names('ibuprofen'), [])
+
+    def test_empty_and_short_queries(self):
+        self.assertEqual(self.search('').status_code, 400)
+        self.assertEqual(self.search('   ').status_code, 400)
+        # Only operators, no words
+        self.assertEqual(self.names('+-*"'), [])
+        self.assertEqual(self.names('ce'), ['Cetirizine'])
+
+    def test_mysql_query_keeps_unindexed_terms_optional(self):
+        self.assertEqual(mysql_boolean_query(['amoxicillin', 'for', 'kids']), '+amoxicillin* for* +kids*')
+        self.assertEqual(mysql_boolean_query(['vitamin', 'c']), '+vitamin* c*')
+        self.assertEqual(mysql_boolean_query(['The']), 'The*')
+
+
+class ProductFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.products = {}
+        for name, category, price, requires_prescription, quantity in [
+            ('Filter tablet', 'Tablet', '5.00', False, 50),
+            ('Filter capsule', 'Capsule', '15.00', True, 5),
+            ('Filter syrup', 'Liquid', '25.00', False, None),
+        ]:
+            product = Product.objects.create(product_name=name, brand_name=name, category=category,
+                                             price=price, requires_prescription=requires_prescription)
+            if quantity is not None:
+                ProductBatch(product=product, batch_code=f'{product.pk}800', quantity=quantity,
+                             expiration_date=today + timedelta(days=1)).save()
+            cls.products[name] = product
+
+    def get(self, **params):
+        response = APIClient().get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def names(self, **params):
+        return sorted(product['product_name'] for product in self.get(**params)['results'])
+
+    @staticmethod
+    def facet(data, name):
+        return {str(option['value']): option['count'] for option in data['facets'][name]}
+
+    def test_filters(self):
+        self.assertEqual(self.names(category='Tablet,Liquid'), ['Filter syrup', 'Filter tablet'])
+        self.assertEqual(self.names(availability='low_stock'), ['Filter capsule'])
+        self.assertEqual(self.names(requires_prescription='false'), ['Filter syrup', 'Filter tablet'])
+        self.assertEqual(self.names(min_price='10', max_price='20'), ['Filter capsule'])
+        self.assertEqual(self.names(category='Tablet', availability='low_stock'), [])
+        response = APIClient().get('/api/products/', {'availability': 'sold_out', 'min_price': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'availability', 'min_price'})
+
+    def test_facets_ignore_their_own_filter(self):
+        data = self.get(category='Tablet')
+        self.assertEqual(self.facet(data, 'category')['Tablet'], 1)
+        self.assertEqual(self.facet(data, 'category')['Capsule'], 1)
+        self.assertEqual(self.facet(data, 'availability')['in_stock'], 1)
+        self.assertEqual(self.facet(data, 'availability')['low_stock'], 0)
+        self.assertEqual(self.facet(data, 'requires_prescription'), {'True': 0, 'False': 1})
+        stored = {
+            (facet.category, facet.availability_state, facet.requires_prescription): facet.product_count
+            for facet in ProductFacet.objects.filter(product_count__gt=0)
+        }
+        self.assertEqual(stored, ProductFacet.expected_counts())
+
+    def test_sweep_refreshes_availability_when_the_day_rolls_over(self):
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            # The batches expire today: the stored summary still counts them until the sweep
+            self.assertEqual(self.names(availability='in_stock'), ['Filter tablet'])
+            sweep_batches()
+            self.assertEqual(self.names(availability='in_stock,low_stock'), [])
+            self.assertEqual(self.names(availability='no_active_batches'), ['Filter capsule', 'Filter tablet'])
+            data = self.get(fields='product_name,availability_state')
+            self.assertEqual(
+                {product['availability_state'] for product in data['results']}, {'no_active_batches', 'no_batch'}
+            )
+            self.assertEqual(self.facet(data, 'availability')['no_active_batches'], 2)
+            self.assertEqual(self.facet(data, 'availability')['in_stock'], 0)
+
+
+@override_settings(CATALOG_SNAPSHOT={'ENABLED': False, 'VERSION_CHECK_INTERVAL': 0})
+class CatalogCachingTests(TestCase):
+    """Catalog GETs carry validators and answer 304 until the catalog changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(product_name='Cached', brand_name='Cached brand',
+                                             category='Tablet', price='3.00')
+        cls.batch = ProductBatch(product=cls.product, batch_code=f'{cls.product.pk}30', quantity=10,
+                                 expiration_date=timezone.now().date() + timedelta(days=90))
+        cls.batch.save()
+
+    def get(self, path='/api/products/', **headers):
+        return APIClient().get(path, headers=headers)
+
+    def test_matching_etag_gets_304(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        revalidated = self.get(**{'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(self.get(**{'If-None-Match': '"catalog-0-stale"'}).status_code, 200)
+
+    def assert_change_invalidates(self, change):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_change_invalidates_etag(self):
+        def change():
+            self.product.price = Decimal('3.50')
+            self.product.save()
+        self.assert_change_invalidates(change)
+
+    def test_batch_change_invalidates_etag(self):
+        def change():
+            self.batch.quantity = 4
+            self.batch.save()
+        self.assert_change_invalidates(change)
+
+    def test_each_representation_has_its_own_etag(self):
+        etags = {
+            self.get(path)['ETag']
+            for path in [
+                '/api/products/', '/api/products/?fields=id,product_name', '/api/products/?fields=id',
+                '/api/products/?category=Tablet', f'/api/products/{self.product.pk}/',
+            ]
+        }
+        self.assertEqual(len(etags), 5)
+        # The ETag of one representation does not validate another
+        etag = self.get('/api/products/?fields=id')['ETag']
+        self.assertEqual(self.get('/api/products/?fields=id,product_name', **{'If-None-Match': etag}).status_code, 200)
+
+@override_settings(CATALOG_SNAPSHOT={'ENABLED': False, 'VERSION_CHECK_INTERVAL': 0})
+class SparseFieldsTests(TestCase):
+    """?fields= and ?expand= leave out fields, their methods and the queries behind them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(product_name='Sparse', brand_name='Sparse brand',
+                                             category='Tablet', price='2.00')
+        cls.batch = ProductBatch(product=cls.product, batch_code=f'{cls.product.pk}20', quantity=50,
+                                 expiration_date=timezone.now().date() + timedelta(days=90))
+        cls.batch.save()
+        customer = CustomUser.objects.create(username='sparse-customer', userrole='Customer')
+        Order.objects.bulk_create([Order(customer=customer, total_amount=2)])
+        order = Order.objects.get(customer=customer)
+        # Created by the first catalog request otherwise, which would count against it
+        CatalogVersion.current()
+        OrderItem.objects.create(order=order, batch=cls.batch, quantity=1, price_at_time=2, subtotal=2)
+
+    def get(self, path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(path, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results'], [query['sql'] for query in queries.captured_queries]
+
+    def reads(self, sqls, table):
+        return any(f'"{table}"' in sql or f'`{table}`' in sql for sql in sqls)
+
+    def test_products(self):
+        full, full_sqls = self.get('/api/products/')
+        self.assertIn('active_batches', full[0])
+        self.assertTrue(self.reads(full_sqls, 'api_productbatch'))
+
+        with mock.patch.object(ProductSerializer, 'get_image_renditions') as renditions:
+            sparse, sparse_sqls = self.get('/api/products/', fields='id,product_name')
+        renditions.assert_not_called()
+        self.assertEqual(set(sparse[0]), {'id', 'product_name'})
+        self.assertFalse(self.reads(sparse_sqls, 'api_productbatch'))
+        self.assertEqual(len(sparse_sqls), len(full_sqls) - 1)
+
+        # The availability fields still need today's sellable batches
+        unexpanded, sqls = self.get('/api/products/', expand='')
+        self.assertNotIn('active_batches', unexpanded[0])
+        self.assertEqual(unexpanded[0]['sellable_stock'], 50)
+        self.assertTrue(self.reads(sqls, 'api_productbatch'))
+
+        expanded, sqls = self.get('/api/products/', fields='id', expand='active_batches')
+        self.assertEqual(set(expanded[0]), {'id', 'active_batches'})
+        self.assertEqual(len(sqls), len(full_sqls))
+
+    def test_batches(self):
+        full, full_sqls = self.get('/api/batches/')
+        self.assertEqual(full[0]['stock_status'], 'In Stock')
+        self.assertTrue(self.reads(full_sqls, 'api_product'))
+
+        with mock.patch.object(ProductBatchSerializer, 'get_stock_status') as stock_status:
+            sparse, sqls = self.get('/api/batches/', fields='id,batch_code,quantity')
+        stock_status.assert_not_called()
+        self.assertEqual(set(sparse[0]), {'id', 'batch_code', 'quantity'})
+        # No join to the product for the threshold
+        self.assertFalse(self.reads(sqls, 'api_product'))
+        self.assertEqual(len(sqls), len(full_sqls))
+
+    def test_orders(self):
+        full, full_sqls = self.get('/api/orders/')
+        self.assertEqual(len(full[0]['items']), 1)
+        self.assertTrue(self.reads(full_sqls, 'api_orderitem'))
+        self.assertTrue(self.reads(full_sqls, 'api_customuser'))
+
+        sparse, sqls = self.get('/api/orders/', fields='id,status')
+        self.assertEqual(set(sparse[0]), {'id', 'status'})
+        for table in ('api_orderitem', 'api_customuser', 'api_prescription'):
+            self.assertFalse(self.reads(sqls, table), table)
+        self.assertEqual(len(sqls), len(full_sqls) - 1)
+
+        # No items prefetch; the prescription annotation still reads the items
+        unexpanded, sqls = self.get('/api/orders/', expand='')
+        self.assertNotIn('items', unexpanded[0])
+        self.assertIn('requires_prescription', unexpanded[0])
+        self.assertEqual(len(sqls), len(full_sqls) - 1)
+
+    def test_unknown_names_are_rejected(self):
+        client = APIClient()
+        response = client.get('/api/products/', {'fields': 'id,bogus'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bogus', str(response.data['fields']))
+        self.assertEqual(client.get('/api/orders/', {'expand': 'customer'}).status_code, 400)
+        self.assertEqual(client.get('/api/batches/', {'fields': 'id,'}).status_code, 200)
+
+class ProductImageRenditionTests(TestCase):
+    """An uploaded product image is rendered to content-hashed WebP and JPEG files."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root.name,
+            # Rendered on commit, in this thread
+            PRODUCT_IMAGE_RENDITIONS={'SIZES': {'thumbnail': 16, 'card': 40}, 'ASYNC': False},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def image(self, color, size=(80, 60)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, color).save(buffer, 'PNG')
+        return SimpleUploadedFile('pill.png', buffer.getvalue(), content_type='image/png')
+
+    def test_renders_each_size_and_format(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(product_name='Pictured', brand_name='Pictured brand', category='Tablet',
+                                             price='1.00', image=self.image((200, 0, 0, 255)))
+        product.refresh_from_db()
+        self.assertEqual(set(product.image_renditions), {'thumbnail', 'card'})
+
+        for name, longest_edge in [('thumbnail', 16), ('card', 40)]:
+            for image_format, extension in [('webp', 'webp'), ('jpeg', 'jpg')]:
+                path = product.image_renditions[name][image_format]
+                self.assertTrue(default_storage.exists(path), path)
+                with default_storage.open(path) as rendered:
+                    content = rendered.read()
+                self.assertTrue(path.startswith('product_images/renditions/pill'))
+                self.assertTrue(path.endswith(f'.{name}.{hashlib.sha256(content).hexdigest()[:16]}.{extension}'))
+                picture = Image.open(io.BytesIO(content))
+                self.assertEqual((picture.format.lower(), max(picture.size)), (image_format, longest_edge))
+
+        response = APIClient().get(f'/api/products/{product.pk}/')
+        self.assertEqual(response.data['image_renditions']['card']['webp'],
+                         f"http://testserver/media/{product.image_renditions['card']['webp']}")
+
+        # A new image gets new names; until it is rendered there are none
+        previous = product.image_renditions
+        product.image = self.image((0, 0, 200, 255))
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_renditions, {})
+        for callback in callbacks:
+            callback()
+        renditions = Product.objects.get(pk=product.pk).image_renditions
+        self.assertNotEqual(renditions['card']['jpeg'], previous['card']['jpeg'])
+
+    def test_renditions_are_served_as_immutable(self):
+        path = f'{RENDITION_DIR}/pill.thumbnail.0123456789abcdef.webp'
+        default_storage.save(path, ContentFile(b'RIFF'))
+        response = serve_rendition(RequestFactory().get(f'/media/{path}'), path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+class ProductImportTests(TestCase):
+    """CSV/NDJSON product imports through /api/products/import/ and the import_products command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.existing = Product.objects.create(product_name='Imported', brand_name='Imported brand',
+                                              category='Tablet', price='1.00')
+        cls.staff = CustomUser.objects.create(username='import-staff', userrole='Pharmacy Staff')
+
+    def upload(self, rows, **data):
+        text = 'product_name,brand_name,category,price\n' + ''.join(f'{row}\n' for row in rows)
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        upload = SimpleUploadedFile('products.csv', text.encode(), content_type='text/csv')
+        return client.post('/api/products/import/', {'file': upload, **data})
+
+    def errors(self, response):
+        return {entry['row']: entry['errors'] for entry in response.data['errors']}
+
+    def test_creates_new_and_updates_existing_products(self):
+        response = self.upload(['Imported,Imported brand,Tablet,2.50', 'Brand new,Brand new brand,Liquid,3.00'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('rows', 'created', 'updated', 'failed', 'errors')},
+            {'rows': 2, 'created': 1, 'updated': 1, 'failed': 0, 'errors': []},
+        )
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.price, Decimal('2.50'))
+        self.assertEqual(Product.objects.get(product_name='Brand new').category, 'Liquid')
+
+    @override_settings(PRODUCT_IMPORT={'CHUNK_SIZE': 500, 'MAX_CHUNK_SIZE': 5000, 'MAX_REPORTED_ERRORS': 2})
+    def test_error_report_is_truncated(self):
+        response = self.upload(['Bad 1,Bad brand 1,Tablet,cheap', 'Good,Good brand,Tablet,1.00',
+                                'Bad 2,Bad brand 2,Tablet,cheap', 'Bad 3,Bad brand 3,Tablet,cheap'])
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 3))
+        # File line numbers: the header is line 1
+        self.assertEqual(list(self.errors(response)), [2, 4])
+        self.assertIn('price', self.errors(response)[2])
+        self.assertTrue(response.data['errors_truncated'])
+
+    def test_brand_of_another_product_is_rejected(self):
+        response = self.upload(['Imitation,Imported brand,Tablet,1.00'])
+        self.assertEqual(self.errors(response), {2: {'brand_name': ['A product with this brand already exists.']}})
+        self.assertFalse(Product.objects.filter(product_name='Imitation').exists())
+
+    def test_duplicates_are_rejected_wherever_the_chunks_end(self):
+        response = self.upload([
+            'New,Nb,Tablet,1.00',
+            'Third,Tb,Tablet,1.00',
+            # Chunk 2: repeats rows of chunk 1, in another case
+            'NEW,Other,Tablet,1.00',
+            'Fourth,NB,Tablet,1.00',
+            # Chunk 3: a repeat within the chunk
+            'Fifth,Fb,Tablet,1.00',
+            'fifth,Gb,Tablet,1.00',
+        ], chunk_size=2)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (3, 0, 3))
+        self.assertEqual(self.errors(response), {
+            4: {'product_name': ['Duplicate of row 2.']},
+            5: {'brand_name': ['Duplicate of row 2.']},
+            7: {'product_name': ['Duplicate of row 6.']},
+        })
+        self.assertEqual(Product.objects.get(product_name='New').brand_name, 'Nb')
+
+    def test_existing_products_are_kept_without_updates(self):
+        response = self.upload(['Imported,Imported brand,Tablet,9.99'], update_existing='false')
+        self.assertEqual(self.errors(response), {2: {'product_name': ['A product with this name already exists.']}})
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.price, Decimal('1.00'))
+
+    def test_command_writes_rejected_rows_to_the_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, report = f'{directory}/products.ndjson', f'{directory}/report.csv'
+            with open(path, 'w') as source:
+                source.write('{"product_name": "Streamed", "brand_name": "Streamed brand", "category": "Drops", '
+                             '"price": "4.00"}\nnot json\n')
+            out = io.StringIO()
+            call_command('import_products', path, '--report', report, stdout=out)
+            with open(report) as rejected:
+                lines = rejected.read().splitlines()
+        self.assertIn('2 rows: 1 created, 0 updated, 1 rejected.', out.getvalue())
+        self.assertEqual(lines[0], 'row,field,error')
+        self.assertTrue(lines[1].startswith('2,non_field_errors,Invalid JSON'))
+        self.assertTrue(Product.objects.filter(product_name='Streamed').exists())
+
+    def import_queries(self, count, prefix):
+        rows = [
+            (number, {'product_name': f'{prefix} {number}', 'brand_name': f'{prefix} brand {number}',
+                      'category': 'Tablet', 'price': '2.00'}, None)
+            for number in range(count)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            product_import = ProductImport(chunk_size=count).run(rows)
+        self.assertEqual(product_import.failed, 0)
+        return len(queries)
+
+    def test_query_count_per_chunk_does_not_grow_with_rows(self):
+        # Created, then updated by the same rows
+        self.assertEqual(self.import_queries(2, 'Few'), self.import_queries(20, 'Many'))
+        self.assertEqual(self.import_queries(2, 'Few'), self.import_queries(20, 'Many'))
+
+@override_settings(CATALOG_SNAPSHOT={'ENABLED': True, 'VERSION_CHECK_INTERVAL': 0, 'BUILD_IN_BACKGROUND': False})
+class CatalogSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(product_name='Snapshot', brand_name='Snapshot brand',
+                                             category='Tablet', price='4.00')
+        Product.objects.create(product_name='Snapshot 2', brand_name='Snapshot brand 2',
+                               category='Tablet', price='9.00')
+
+    def setUp(self):
+        catalog_snapshot._snapshots.clear()
+        catalog_snapshot._pending.clear()
+
+    def get_catalog(self):
+        response = APIClient().get('/api/products/', {'paginate': 'false'})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_builds_inline_and_serves_the_same_json(self):
+        live = self.get_catalog()
+        self.assertIsInstance(live, Response)
+        # The inline build left the request's connection usable
+        self.assertTrue(Product.objects.exists())
+        cached = self.get_catalog()
+        self.assertNotIsInstance(cached, Response)
+        self.assertEqual(json.loads(cached.content), json.loads(live.content))
+        stats = catalog_snapshot.snapshot_stats()['snapshots'][0]
+        self.assertEqual((stats['full_builds'], stats['hits'], stats['fallbacks']), (1, 1, 1))
+
+    def test_patches_changed_products_outside_the_lock(self):
+        self.get_catalog()
+        self.get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = '6.50'
+            self.product.save()
+
+        lock_free = []
+        render = catalog_snapshot.CatalogSnapshot.render
+
+        def probe():
+            acquired = catalog_snapshot._lock.acquire(timeout=1)
+            lock_free.append(acquired)
+            if acquired:
+                catalog_snapshot._lock.release()
+
+        def checked_render(snapshot, product_ids):
+            # Another thread can take the lock while the changed products are queried
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+            return render(snapshot, product_ids)
+
+        with mock.patch.object(catalog_snapshot.CatalogSnapshot, 'render', checked_render):
+            cached = self.get_catalog()
+        self.assertEqual(lock_free, [True])
+        prices = {product['product_name']: product['price'] for product in json.loads(cached.content)}
+        self.assertEqual(prices, {'Snapshot': '6.50', 'Snapshot 2': '9.00'})
+        stats = catalog_snapshot.snapshot_stats()['snapshots'][0]
+        self.assertEqual((stats['patches'], stats['patched_products']), (1, 1))
+
+
+def checkout(client, lines, **headers):
+    """Places an order for {product_id: quantity} the way the checkout page does."""
+    pickup_date = (timezone.localtime() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+    order_data = {
+        'order_items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in lines.items()],
+        'payment_method': 'Cash',
+        'delivery_method': 'PICKUP',
+        'pickup_date': pickup_date.strftime('%Y-%m-%dT%H:%M'),
+    }
+    with redirect_stdout(io.StringIO()):
+        return client.post('/api/orders/', {'order_data': json.dumps(order_data)}, headers=headers)
+
+
+class MyOrderListTests(TestCase):
+    """/api/orders/mine/ lists the signed-in customer's orders and nobody else's."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(product_name='Mine', brand_name='Mine brand', category='Tablet', price='5.00')
+        batch = ProductBatch(product=product, batch_code=f'{product.pk}40', quantity=50,
+                             expiration_date=timezone.now().date() + timedelta(days=60))
+        batch.save()
+        cls.customer = CustomUser.objects.create_user(username='mine-customer', password='x', userrole='Customer')
+        cls.other = CustomUser.objects.create_user(username='mine-other', password='x', userrole='Customer')
+        Order.objects.bulk_create([
+            Order(customer=customer, total_amount=5) for customer in [cls.customer, cls.other, cls.customer]
+        ])
+        # order_date is auto_now_add; backdate the later orders further, so newest first is not newest id first
+        for days, order in enumerate(Order.objects.order_by('pk'), start=1):
+            Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - timedelta(days=days))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, batch=batch, quantity=1, price_at_time=5, subtotal=5) for order in Order.objects.all()
+        ])
+        cls.own = list(Order.objects.filter(customer=cls.customer).order_by('-order_date').values_list('pk', flat=True))
+
+    def test_lists_only_own_orders_newest_first(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.get('/api/orders/mine/', {'expand': 'items'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order['id'] for order in response.data['results']], self.own)
+        self.assertEqual([len(order['items']) for order in response.data['results']], [1, 1])
+
+        self.assertNotIn('items', client.get('/api/orders/mine/').data['results'][0])
+
+    def test_anonymous_request_is_refused(self):
+        response = APIClient().get('/api/orders/mine/')
+        self.assertIn(response.status_code, (401, 403))
+        self.assertNotIn('results', response.data)
+
+
+class AllocationTests(TestCase):
+    """Checkout stock goes through conditional UPDATEs and is never oversold."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.product = Product.objects.create(product_name='Allocated', brand_name='Allocated brand',
+                                             category='Tablet', price='2.00')
+        cls.batches = []
+        for index, quantity in enumerate([10, 10]):
+            batch = ProductBatch(product=cls.product, batch_code=f'{cls.product.pk}70{index}', quantity=quantity,
+                                 expiration_date=today + timedelta(days=30 + index))
+            batch.save()
+            cls.batches.append(batch)
+        cls.customer = CustomUser.objects.create_user(username='allocation-customer', password='x', userrole='Customer')
+
+    def quantities(self):
+        return list(ProductBatch.objects.filter(product=self.product).order_by('id').values_list('quantity', flat=True))
+
+    def place(self, quantity):
+        with transaction.atomic():
+            return allocate({self.product.pk: quantity}, {self.product.pk: self.product})
+
+    def test_insufficient_stock_changes_nothing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            self.place(21)
+        self.assertEqual((raised.exception.requested, raised.exception.available), (21, 20))
+        self.assertEqual(self.quantities(), [10, 10])
+        self.assertFalse(take_stock(self.batches[0].pk, 11))
+        self.assertFalse(take_stock_bulk({self.batches[0].pk: 5, self.batches[1].pk: 11}))
+        self.assertEqual(self.quantities(), [10, 10])
+
+    def test_splits_across_batches_first_expiry_first(self):
+        allocations = self.place(12)
+        self.assertEqual([(allocation.batch.pk, allocation.quantity) for allocation in allocations],
+                         [(self.batches[0].pk, 10), (self.batches[1].pk, 2)])
+        self.assertEqual(self.quantities(), [0, 8])
+
+    def test_stale_read_falls_back_without_overselling(self):
+        stale = _first_batches([self.product.pk], timezone.now().date())
+        # Another checkout takes from the first batch after this one read it
+        self.assertTrue(take_stock(self.batches[0].pk, 8))
+        with mock.patch('api.allocation._first_batches', return_value=stale):
+            allocations = self.place(12)
+        self.assertEqual([allocation.quantity for allocation in allocations], [2, 10])
+        self.assertEqual(self.quantities(), [0, 0])
+        with self.assertRaises(InsufficientStock):
+            self.place(1)
+
+    def test_cancelling_returns_the_stock_once(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = checkout(client, {self.product.pk: 15})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.quantities(), [0, 5])
+        order_id = response.data['id']
+
+        response = client.put(f'/api/orders/{order_id}/status/', {'status': 'Cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), [10, 10])
+        returned = StockMovement.objects.filter(order_id=order_id, kind=StockMovement.CANCELLATION)
+        self.assertEqual(sorted(returned.values_list('quantity', flat=True)), [5, 10])
+
+        response = client.put(f'/api/orders/{order_id}/status/', {'status': 'Pending'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), [10, 10])
+
+
+    def test_cancelling_reactivates_a_swept_batch(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        order_id = checkout(client, {self.product.pk: 10}).data['id']
+        self.assertEqual(sweep_batches().depleted_batch_ids, [self.batches[0].pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            client.put(f'/api/orders/{order_id}/status/', {'status': 'Cancelled'}, format='json')
+        batch = ProductBatch.objects.get(pk=self.batches[0].pk)
+        self.assertEqual((batch.quantity, batch.is_active), (10, True))
+        # MySQL evaluates SET left to right; the CASE must see the old quantity
+        quote = connection.ops.quote_name
+        update = next(query['sql'] for query in queries.captured_queries
+                      if query['sql'].startswith(f'UPDATE {quote(ProductBatch._meta.db_table)}'))
+        self.assertLess(update.index(f"{quote('is_active')} = CASE"), update.index(f"{quote('quantity')} = "))
+
+    def test_returning_stock_to_a_batch_expiring_today_keeps_it_inactive(self):
+        ProductBatch.objects.filter(pk=self.batches[0].pk).update(
+            quantity=0, is_active=False, expiration_date=timezone.now().date()
+        )
+        return_stock(self.batches[0].pk, 4)
+        batch = ProductBatch.objects.get(pk=self.batches[0].pk)
+        self.assertEqual((batch.quantity, batch.is_active), (4, False))
+
+class CheckoutQueryTests(TestCase):
+    """Placing an order runs the same queries for 1 line as for 50."""
+
+    @classmethod
+    def setUpTestData(cls):
+        expiry = timezone.now().date() + timedelta(days=90)
+        Product.objects.bulk_create([
+            Product(product_name=f'Checkout {i:02d}', brand_name=f'Checkout brand {i:02d}', category='Tablet',
+                    price='1.00')
+            for i in range(50)
+        ])
+        cls.products = list(Product.objects.filter(product_name__startswith='Checkout ').order_by('pk'))
+        for product in cls.products:
+            ProductBatch(product=product, batch_code=f'{product.pk}77', quantity=20, expiration_date=expiry).save()
+        cls.customer = CustomUser.objects.create_user(username='checkout-customer', password='x', userrole='Customer')
+
+    def checkout_queries(self, line_count):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        with CaptureQueriesContext(connection) as queries:
+            response = checkout(client, {product.pk: 2 for product in self.products[:line_count]})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.data['id']).count(), line_count)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(50))
+
+class IdempotencyTests(TestCase):
+    """Checkout retries with the same Idempotency-Key get the first response."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(product_name='Idempotent', brand_name='Idempotent brand',
+                                             category='Tablet', price='4.00')
+        ProductBatch(product=cls.product, batch_code=f'{cls.product.pk}60', quantity=10,
+                     expiration_date=timezone.now().date() + timedelta(days=60)).save()
+        cls.customer = CustomUser.objects.create_user(username='idempotent-customer', password='x', userrole='Customer')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def place(self, quantity=2, key='retry-1'):
+        return checkout(self.client, {self.product.pk: quantity}, **{'Idempotency-Key': key})
+
+    def orders(self):
+        return Order.objects.filter(customer=self.customer).count()
+
+    def test_retry_replays_first_response(self):
+        first = self.place()
+        retry = self.place()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(self.orders(), 1)
+        self.assertEqual(ProductBatch.objects.get(product=self.product).quantity, 8)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.place(quantity=2)
+        response = self.place(quantity=3)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.orders(), 1)
+
+    def test_unanswered_claim_is_taken_over_after_its_lease(self):
+        self.place()
+        # As if the first request's worker had died before storing its response
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        self.assertEqual(self.place().status_code, 409)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        response = self.place()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.orders(), 2)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_server_error_is_not_stored(self):
+        self.client.raise_request_exception = False
+        with mock.patch('api.serializers.fill_order', side_effect=OperationalError('Lock wait timeout exceeded')):
+            self.assertEqual(self.place().status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.place()
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.orders(), 1)
+
+    def test_purge_removes_expired_keys(self):
+        self.place(key='old')
+        self.place(key='new')
+        IdempotencyKey.objects.filter(pk=IdempotencyKey.objects.order_by('pk').first().pk).update(
+            created_at=timezone.now() - timedelta(hours=25)
+        )
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+        # Retrying the purged key runs the request again
+        self.assertNotIn('Idempotent-Replayed', self.place(key='old'))
+        self.assertEqual(self.orders(), 3)
+
+@override_settings(ORDER_INTAKE={'MODE': 'async', 'MAX_DEPTH': 3, 'MAX_DEPTH_PER_CUSTOMER': 2, 'RETRY_AFTER_SECONDS': 15})
+class OrderIntakeTests(TestCase):
+    """Queued checkouts: load shedding, claim order and tokens, and filling or rejecting orders."""
+
+    @classmethod
+    def setUpTestData(cls):
+        expiry = timezone.now().date() + timedelta(days=60)
+        cls.first, cls.second = Product.objects.bulk_create([
+            Product(product_name=f'Queued {name}', brand_name=f'Queued brand {name}', category='Tablet', price='3.00')
+            for name in 'AB'
+        ])
+        for product in (cls.first, cls.second):
+            ProductBatch(product=product, batch_code=f'{product.pk}50', quantity=5, expiration_date=expiry).save()
+        cls.customer = CustomUser.objects.create_user(username='queue-customer', password='x', userrole='Customer')
+        cls.other = CustomUser.objects.create_user(username='queue-other', password='x', userrole='Customer')
+
+    def queue(self, lines, customer=None):
+        client = APIClient()
+        client.force_authenticate(customer or self.customer)
+        return checkout(client, lines)
+
+    def intake(self, response):
+        return OrderIntake.objects.get(order_id=response.data['id'])
+
+    def test_checkout_queues_order_without_taking_stock(self):
+        response = self.queue({self.first.pk: 2})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.data['status_url'])
+        self.assertEqual(response.data['status'], 'Queued')
+        self.assertEqual(self.intake(response).lines, {str(self.first.pk): 2})
+        self.assertEqual(ProductBatch.objects.get(product=self.first).quantity, 5)
+
+    def test_full_queue_answers_429(self):
+        self.assertEqual(self.queue({self.first.pk: 1}).status_code, 202)
+        self.assertEqual(self.queue({self.second.pk: 1}).status_code, 202)
+        response = self.queue({self.first.pk: 1})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '15')
+        self.assertIn('2 orders waiting', response.data['error'])
+
+        # The other customer has room of their own until the whole queue is full
+        self.assertEqual(self.queue({self.first.pk: 1}, customer=self.other).status_code, 202)
+        response = self.queue({self.first.pk: 1}, customer=self.other)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('busy', response.data['error'])
+        self.assertEqual(Order.objects.count(), 3)
+
+        # Finished intakes no longer count
+        intake, token = claim_next()
+        process_intake(intake, token)
+        self.assertEqual(self.queue({self.second.pk: 1}).status_code, 202)
+
+    def test_claims_oldest_intake_per_product(self):
+        first = self.intake(self.queue({self.first.pk: 1}))
+        blocked = self.intake(self.queue({self.first.pk: 1, self.second.pk: 1}))
+        later = self.intake(self.queue({self.second.pk: 1}, customer=self.other))
+
+        claimed, token = claim_next()
+        self.assertEqual(claimed, first)
+        self.assertEqual(len(token), 32)
+        self.assertEqual((claimed.status, claimed.claim_token, claimed.attempts), (OrderIntake.PROCESSING, token, 1))
+        # The second intake waits for the first; the third waits behind the second
+        self.assertEqual(claim_next(), (None, None))
+
+        process_intake(claimed, token)
+        self.assertEqual(claim_next()[0], blocked)
+        self.assertEqual(claim_next(), (None, None))
+        later.refresh_from_db()
+        self.assertEqual(later.status, OrderIntake.QUEUED)
+
+    def test_stale_claim_is_taken_over(self):
+        intake = self.intake(self.queue({self.first.pk: 2}))
+        _, stale_token = claim_next()
+        OrderIntake.objects.filter(pk=intake.pk).update(claimed_at=timezone.now() - timedelta(seconds=301))
+
+        claimed, token = claim_next()
+        self.assertEqual(claimed, intake)
+        self.assertNotEqual(token, stale_token)
+        self.assertEqual(claimed.attempts, 2)
+
+        # The worker that stalled can no longer fill or finish the order
+        self.assertIsNone(process_intake(claimed, stale_token))
+        self.assertFalse(_finish(claimed, stale_token, OrderIntake.REJECTED, 'Rejected', errors=['late']))
+        self.assertEqual(ProductBatch.objects.get(product=self.first).quantity, 5)
+
+        self.assertEqual(process_intake(claimed, token), OrderIntake.DONE)
+        self.assertEqual(ProductBatch.objects.get(product=self.first).quantity, 3)
+
+    def test_orders_are_filled_until_the_stock_runs_out(self):
+        filled = self.queue({self.first.pk: 4})
+        rejected = self.queue({self.first.pk: 4}, customer=self.other)
+
+        outcomes = []
+        for _ in range(2):
+            intake, token = claim_next()
+            outcomes.append(process_intake(intake, token))
+        self.assertEqual(outcomes, [OrderIntake.DONE, OrderIntake.REJECTED])
+        self.assertEqual(ProductBatch.objects.get(product=self.first).quantity, 1)
+
+        order = Order.objects.get(pk=filled.data['id'])
+        self.assertEqual((order.status, order.total_amount), ('Pending', Decimal('12.00')))
+        self.assertEqual(order.items.get().quantity, 4)
+
+        order = Order.objects.get(pk=rejected.data['id'])
+        self.assertEqual(order.status, 'Rejected')
+        self.assertFalse(order.items.exists())
+        intake = self.intake(rejected)
+        self.assertEqual(intake.status, OrderIntake.REJECTED)
+        self.assertTrue(intake.errors)
+
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.get(filled.data['status_url'])
+        self.assertEqual((response.data['status'], response.data['order']['status']), ('done', 'Pending'))
+        self.assertIsNone(response.data['queue_position'])
+        # Only the customer and staff can see an intake
+        self.assertEqual(client.get(rejected.data['status_url']).status_code, 404)
+
+class ConcurrentStockTests(TransactionTestCase):
+    """Buyers racing for the same batch never take more than it holds."""
+
+    def test_concurrent_takes_do_not_oversell(self):
+        product = Product.objects.create(product_name='Raced', brand_name='Raced brand', category='Tablet', price='1.00')
+        batch = ProductBatch(product=product, batch_code='7900', quantity=60,
+                             expiration_date=timezone.now().date() + timedelta(days=30))
+        batch.save()
+        taken = []
+
+        def buyer():
+            try:
+                while True:
+                    try:
+                        if not take_stock(batch.pk, 1):
+                            return
+                    except OperationalError:
+                        # SQLite reports a busy table instead of waiting for the lock
+                        time.sleep(0.001)
+                        continue
+                    taken.append(1)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buyer) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batch.refresh_from_db()
+        self.assertEqual((len(taken), batch.quantity), (60, 0))
+
+
+class LedgerTests(TestCase):
+    """A balance is the latest snapshot plus the movements after it, at any point in time."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now().replace(microsecond=0)
+        product = Product.objects.create(product_name='Ledgered', brand_name='Ledgered brand',
+                                         category='Tablet', price='3.00')
+        # Created without save() so the test writes the whole history itself
+        cls.batch = ProductBatch.objects.bulk_create([
+            ProductBatch(product=product, batch_code='7200', quantity=70,
+                         expiration_date=cls.now.date() + timedelta(days=90)),
+        ])[0]
+        cls.movements = StockMovement.objects.bulk_create([
+            StockMovement(batch_id=cls.batch.pk, product_id=product.pk, kind=kind, quantity=quantity,
+                          created_at=cls.now - timedelta(days=days))
+            for kind, quantity, days in [
+                (StockMovement.RECEIPT, 100, 3),
+                (StockMovement.SALE, -20, 2),
+                (StockMovement.SALE, -10, 1),
+            ]
+        ])
+        cls.staff = CustomUser.objects.create(username='ledger-staff', userrole='Pharmacy Staff')
+
+    def balance(self, **kwargs):
+        return ledger_balances([self.batch.pk], **kwargs)[self.batch.pk]
+
+    def add_movement(self, quantity, **fields):
+        return StockMovement.objects.create(batch_id=self.batch.pk, product_id=self.batch.product_id,
+                                            kind=StockMovement.CORRECTION, quantity=quantity, **fields)
+
+    def test_balance_at_a_point_in_time(self):
+        self.assertEqual(self.balance(), 70)
+        sale = self.now - timedelta(days=2)
+        self.assertEqual(self.balance(at=sale), 80)
+        self.assertEqual(self.balance(at=sale - timedelta(seconds=1)), 100)
+        self.assertEqual(self.balance(at=self.now - timedelta(days=4)), 0)
+        self.assertEqual(self.balance(up_to_movement=self.movements[1].pk), 80)
+
+    def test_snapshot_plus_later_movements(self):
+        self.assertEqual(take_snapshots(lag=timedelta(0)), (1, self.movements[-1].pk))
+        snapshot = StockSnapshot.objects.get(batch_id=self.batch.pk)
+        self.assertEqual((snapshot.quantity, snapshot.movement_id), (70, self.movements[-1].pk))
+        # Nothing moved since, so nothing to write
+        self.assertEqual(take_snapshots(lag=timedelta(0)), (0, self.movements[-1].pk))
+
+        self.add_movement(-5)
+        self.assertEqual(self.balance(), 65)
+        # The snapshot was taken after these moments, so they come from the movements alone
+        self.assertEqual(self.balance(at=self.now - timedelta(hours=36)), 80)
+        self.assertEqual(self.balance(at=self.now - timedelta(minutes=1)), 70)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.balance()
+        movement_sql = [query['sql'] for query in queries.captured_queries if StockMovement._meta.db_table in query['sql']]
+        self.assertEqual(len(movement_sql), 1)
+        self.assertIn(str(self.movements[-1].pk), movement_sql[0])
+
+    def test_snapshot_leaves_out_movements_newer_than_the_lag(self):
+        recent = self.add_movement(-5)
+        written, boundary = take_snapshots(lag=timedelta(minutes=5))
+        self.assertEqual((written, boundary), (1, self.movements[-1].pk))
+        self.assertLess(boundary, recent.pk)
+        self.assertEqual(self.balance(), 65)
+
+    def test_balance_endpoint_accepts_dates_and_times(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        url = f'/api/batches/{self.batch.pk}/balance/'
+        response = client.get(url, {'at': (self.now - timedelta(days=2)).isoformat()})
+        self.assertEqual(response.data['quantity'], 80)
+        # A date means the end of that day
+        day = timezone.localtime(self.now - timedelta(days=2)).date()
+        self.assertEqual(client.get(url, {'at': day.isoformat()}).data['quantity'], 80)
+        self.assertEqual(client.get(url).data['quantity'], 70)
+        self.assertEqual(client.get(url, {'at': 'yesterday'}).status_code, 400)
+        self.assertEqual(client.get(url, {'at': '2026-13-01'}).status_code, 400)
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+    def test_reconcile_detects_and_corrects_drift(self):
+        call_command('reconcile_stock', stdout=io.StringIO())
+        # A write that bypassed the ledger
+        ProductBatch.objects.filter(pk=self.batch.pk).update(quantity=60)
+        self.assertEqual(find_drift([self.batch.pk]), [(self.batch.pk, 60, 70)])
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stock', stdout=io.StringIO())
+
+        call_command('reconcile_stock', record_corrections=True, stdout=io.StringIO())
+        correction = StockMovement.objects.order_by('-id').first()
+        self.assertEqual((correction.kind, correction.quantity), (StockMovement.CORRECTION, -10))
+        self.assertEqual(find_drift([self.batch.pk]), [])
+        call_command('reconcile_stock', stdout=io.StringIO())
+
+
+@override_settings(CATALOG_SNAPSHOT={'ENABLED': False, 'VERSION_CHECK_INTERVAL': 0})
+class ExpiredBatchListTests(TestCase):
+    """/api/batches/expired/ lists expired batches that still hold units, swept or not."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.first, cls.second, fresh = Product.objects.bulk_create([
+            Product(product_name=f'Expired {name}', brand_name=f'Expired brand {name}', category='Tablet', price=price)
+            for name, price in [('A', '2.00'), ('B', '3.00'), ('C', '1.00')]
+        ])
+        cls.batches = {}
+        for product, code, quantity, days, active in [
+            (cls.first, 'swept', 10, -10, False),
+            (cls.first, 'unswept', 5, -3, True),
+            (cls.first, 'empty', 0, -5, False),
+            (cls.first, 'fresh', 20, 30, True),
+            (cls.second, 'other', 4, -1, True),
+            (fresh, 'fresh only', 7, 30, True),
+        ]:
+            batch = ProductBatch(product=product, batch_code=f'{product.pk}{len(cls.batches)}10', quantity=quantity,
+                                 expiration_date=today + timedelta(days=days))
+            batch.save()
+            # As the sweeper would, or would not yet, have left it
+            ProductBatch.objects.filter(pk=batch.pk).update(is_active=active)
+            cls.batches[code] = batch.pk
+
+    def get(self, **params):
+        response = APIClient().get('/api/batches/expired/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_lists_expired_batches_with_units(self):
+        data = self.get()
+        rows = data['results']
+        self.assertEqual([row['id'] for row in rows],
+                         [self.batches['swept'], self.batches['unswept'], self.batches['other']])
+        self.assertEqual([row['is_active'] for row in rows], [False, True, True])
+        self.assertEqual((rows[0]['days_expired'], rows[0]['value']), (10, '20.00'))
+        self.assertEqual(rows[0]['product']['id'], self.first.pk)
+        self.assertEqual(data['totals'], {'batches': 3, 'products': 2, 'units': 19, 'value': '42.00'})
+
+    def test_groups_by_product(self):
+        data = self.get(group='product')
+        rows = {row['id']: row for row in data['results']}
+        self.assertEqual(set(rows), {self.first.pk, self.second.pk})
+        self.assertEqual(
+            {key: rows[self.first.pk][key] for key in ('expired_batches', 'expired_units', 'expired_value')},
+            {'expired_batches': 2, 'expired_units': 15, 'expired_value': '30.00'},
+        )
+        self.assertEqual(rows[self.first.pk]['earliest_expiry'],
+                         (timezone.now().date() - timedelta(days=10)).isoformat())
+        self.assertEqual((rows[self.second.pk]['expired_units'], rows[self.second.pk]['expired_value']), (4, '12.00'))
+        self.assertEqual(data['totals'], {'batches': 3, 'products': 2, 'units': 19, 'value': '42.00'})
+
+    def test_unpaginated_list_and_bad_group(self):
+        self.assertEqual(len(self.get(paginate='false')), 3)
+        self.assertEqual(APIClient().get('/api/batches/expired/', {'group': 'batch'}).status_code, 400)
+
+class BatchBulkUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(product_name='Bulk edited', brand_name='Bulk brand',
+                                         category='Tablet', price='1.00')
+        expiry = timezone.now().date() + timedelta(days=60)
+        cls.batches = ProductBatch.objects.bulk_create([
+            ProductBatch(product=product, batch_code=f'73{index:02d}', quantity=10, expiration_date=expiry)
+            for index in range(4)
+        ])
+        cls.staff = CustomUser.objects.create(username='bulk-staff', userrole='Pharmacy Staff')
+
+    def patch(self, items):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        return client.patch('/api/batches/bulk/', items, format='json')
+
+    def codes(self):
+        return dict(ProductBatch.objects.filter(pk__in=[batch.pk for batch in self.batches]).values_list('pk', 'batch_code'))
+
+    def test_partial_success(self):
+        first, second = self.batches[:2]
+        response = self.patch([
+            {'id': first.pk, 'quantity': 25},
+            {'id': second.pk, 'quantity': -1},
+            {'id': 999999, 'quantity': 1},
+            'not an object',
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['updated'], response.data['failed']), (1, 3))
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['updated', 'error', 'error', 'error'])
+        self.assertIn('quantity', response.data['results'][1]['errors'])
+        self.assertEqual(response.data['results'][2]['errors'], {'id': ['Batch not found.']})
+        self.assertEqual(ProductBatch.objects.get(pk=first.pk).quantity, 25)
+        self.assertEqual(ProductBatch.objects.get(pk=second.pk).quantity, 10)
+        correction = StockMovement.objects.get(batch_id=first.pk)
+        self.assertEqual((correction.kind, correction.quantity), (StockMovement.CORRECTION, 15))
+
+    def test_all_rejected_is_a_bad_request(self):
+        response = self.patch([{'id': self.batches[0].pk, 'batch_code': 'abc'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['updated'], 0)
+
+    def test_duplicates_within_a_request(self):
+        first, second, third = self.batches[:3]
+        response = self.patch([
+            {'id': first.pk, 'quantity': 11},
+            {'id': first.pk, 'quantity': 12},
+            {'id': second.pk, 'batch_code': '7390'},
+            {'id': third.pk, 'batch_code': '7390'},
+        ])
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['updated', 'error', 'updated', 'error'])
+        self.assertEqual(results[1]['errors'], {'id': ['Duplicate of item 0.']})
+        self.assertEqual(results[3]['errors'], {'batch_code': ['Duplicate of item 2.']})
+        self.assertEqual(ProductBatch.objects.get(pk=first.pk).quantity, 11)
+        self.assertEqual(self.codes()[second.pk], '7390')
+        self.assertEqual(self.codes()[third.pk], '7302')
+
+    def test_codes_already_in_use(self):
+        first, second, third, fourth = self.batches
+        response = self.patch([
+            # Taken by a batch outside the request
+            {'id': first.pk, 'batch_code': fourth.batch_code},
+            # Unchanged codes are not collisions
+            {'id': second.pk, 'batch_code': second.batch_code, 'quantity': 9},
+            # Freed by another item of the same request; still in use when checked
+            {'id': third.pk, 'batch_code': first.batch_code},
+        ])
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['error', 'updated', 'error'])
+        self.assertEqual(results[0]['errors'], {'batch_code': ['A batch with this code already exists.']})
+        self.assertEqual(self.codes(), {batch.pk: batch.batch_code for batch in self.batches})
+
+
+class StockAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        cls.product = Product.objects.create(product_name='Alerted', brand_name='Alerted brand', category='Tablet',
+                                             price='1.00', low_stock_threshold=10)
+
+    def add_batch(self, code, quantity, days, **fields):
+        batch = ProductBatch(product=self.product, batch_code=code, quantity=quantity,
+                             expiration_date=self.today + timedelta(days=days), **fields)
+        batch.save()
+        return batch
+
+    def level_alerts(self):
+        return list(StockAlert.objects.filter(batch=None).order_by('id').values_list('kind', 'quantity', 'threshold'))
+
+    def test_alerts_when_stock_crosses_a_level(self):
+        batch = self.add_batch('7400', 50, 90)
+        for quantity in [30, 8, 5, 0, 12]:
+            batch.quantity = quantity
+            batch.save()
+        self.assertEqual(self.level_alerts(), [
+            (StockAlert.RESTOCKED, 50, 10),
+            (StockAlert.LOW_STOCK, 8, 10),
+            (StockAlert.OUT_OF_STOCK, 0, 10),
+            (StockAlert.RESTOCKED, 12, 10),
+        ])
+
+    def test_expiry_alerts_once_per_batch(self):
+        soon = self.add_batch('7410', 5, 10)
+        self.add_batch('7411', 5, 45)
+        self.add_batch('7412', 0, 10)
+        self.add_batch('7413', 5, 10, is_active=False)
+        self.add_batch('7414', 5, 0)
+        self.assertEqual(create_expiry_alerts(horizon_days=30), 1)
+        self.assertEqual(list(StockAlert.objects.filter(kind=StockAlert.EXPIRING).values_list('batch_id', flat=True)),
+                         [soon.pk])
+        self.assertEqual(create_expiry_alerts(horizon_days=30), 0)
+
+    def test_counts_only_the_alerts_it_inserted(self):
+        first = self.add_batch('7420', 5, 10)
+        self.add_batch('7421', 5, 12)
+        bulk_create = StockAlert.objects.bulk_create
+
+        def overlapping_run(alerts, **kwargs):
+            # Another run alerts the first batch between this run's read and its insert
+            bulk_create([StockAlert(kind=StockAlert.EXPIRING, product=self.product, batch=first, quantity=5)])
+            return bulk_create(alerts, **kwargs)
+
+        with mock.patch.object(StockAlert.objects, 'bulk_create', overlapping_run):
+            self.assertEqual(create_expiry_alerts(horizon_days=30), 1)
+        self.assertEqual(StockAlert.objects.filter(kind=StockAlert.EXPIRING).count(), 2)
+
+
+class GoodsReceivingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.expiry = (timezone.now().date() + timedelta(days=120)).isoformat()
+        cls.product = Product.objects.create(product_name='Received', brand_name='Received brand',
+                                             category='Tablet', price='1.00')
+        cls.other = Product.objects.create(product_name='Received too', brand_name='Received brand 2',
+                                           category='Tablet', price='1.00')
+        ProductBatch(product=cls.other, batch_code='7500', quantity=1, expiration_date=cls.expiry).save()
+        cls.staff = CustomUser.objects.create(username='receiving-staff', userrole='Pharmacy Staff')
+
+    def receive(self, lines, **data):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        return client.post('/api/receipts/', {'reference': 'DN-1', 'batches': lines, **data}, format='json')
+
+    def line(self, code, quantity=10, **fields):
+        return {'product': self.product.pk, 'batch_code': code, 'quantity': quantity,
+                'expiration_date': self.expiry, **fields}
+
+    def test_books_the_whole_delivery(self):
+        by_name = {'product_name': 'Received too', 'batch_code': '7502', 'quantity': 15, 'expiration_date': self.expiry}
+        response = self.receive([self.line('7501', 10), by_name])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['batch_count'], response.data['total_units']), (2, 25))
+        batches = ProductBatch.objects.filter(receipt_id=response.data['id'])
+        self.assertEqual(sorted(batches.values_list('batch_code', 'quantity')), [('7501', 10), ('7502', 15)])
+        receipts = StockMovement.objects.filter(batch__in=batches, kind=StockMovement.RECEIPT)
+        self.assertEqual(sorted(receipts.values_list('quantity', flat=True)), [10, 15])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).sellable_stock, 10)
+
+    def test_one_bad_line_rejects_the_delivery(self):
+        response = self.receive([
+            self.line('7511'),
+            self.line('7511'),
+            self.line('7500'),
+            self.line('7512', quantity=-3),
+            self.line('7513', product=999999),
+            'not a line',
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = {error['line']: error['errors'] for error in response.data['lines']}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5, 6])
+        self.assertEqual(errors[2], {'batch_code': ['Duplicate of line 1.']})
+        self.assertEqual(errors[3], {'batch_code': ['A batch with this code already exists.']})
+        self.assertIn('quantity', errors[4])
+        self.assertEqual(errors[5], {'product': ['Product not found.']})
+        self.assertFalse(GoodsReceipt.objects.exists())
+        self.assertFalse(ProductBatch.objects.filter(batch_code='7511').exists())
+
+    def test_code_taken_after_the_check_asks_for_a_retry(self):
+        accepted = [(1, {'product_id': self.product.pk, 'batch_code': '7500', 'quantity': 5,
+                         'expiration_date': timezone.now().date() + timedelta(days=120)})]
+        with mock.patch('api.receiving.validate_lines', return_value=accepted):
+            response = self.receive([self.line('7500')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['lines'], [{
+            'line': None,
+            'errors': {'batch_code': ['A batch code in this delivery was just taken; send it again.']},
+        }])
+        self.assertFalse(GoodsReceipt.objects.exists())
+        self.assertEqual(StockMovement.objects.filter(batch__batch_code='7500').count(), 1)
+
+
+class InventorySnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = timezone.now().date() - timedelta(days=5)
+        cls.product = Product.objects.create(product_name='Counted', brand_name='Counted brand',
+                                             category='Tablet', price='2.50', low_stock_threshold=10)
+        fresh, expired = ProductBatch.objects.bulk_create([
+            ProductBatch(product=cls.product, batch_code='7600', quantity=50, expiration_date=cls.day + timedelta(days=10)),
+            ProductBatch(product=cls.product, batch_code='7601', quantity=5, expiration_date=cls.day - timedelta(days=1)),
+        ])
+
+        def moment(days, hour=12):
+            return timezone.make_aware(datetime.combine(cls.day + timedelta(days=days), day_time(hour)))
+
+        StockMovement.objects.bulk_create([
+            StockMovement(batch_id=batch.pk, product_id=cls.product.pk, kind=kind, quantity=quantity, created_at=at)
+            for batch, kind, quantity, at in [
+                (expired, StockMovement.RECEIPT, 5, moment(-3)),
+                (fresh, StockMovement.RECEIPT, 100, moment(-1)),
+                (fresh, StockMovement.SALE, -30, moment(0)),
+                # Midnight starts the next day
+                (fresh, StockMovement.SALE, -20, moment(1, hour=0)),
+            ]
+        ])
+
+    def row(self, day):
+        return InventorySnapshot.objects.values('on_hand', 'sellable', 'expiring', 'value').get(date=day)
+
+    def test_writes_the_end_of_day_stock(self):
+        self.assertEqual(write_inventory_snapshot(self.day), 1)
+        self.assertEqual(self.row(self.day), {'on_hand': 75, 'sellable': 70, 'expiring': 70, 'value': Decimal('187.50')})
+
+    def test_rewriting_a_day_replaces_its_rows(self):
+        write_inventory_snapshot(self.day)
+        Product.objects.filter(pk=self.product.pk).update(product_name='Counted (renamed)')
+        self.assertEqual(write_inventory_snapshot(self.day), 1)
+        self.assertEqual(list(InventorySnapshot.objects.filter(date=self.day).values_list('product_name', flat=True)),
+                         ['Counted (renamed)'])
+
+    def test_backfill_and_as_of_reports(self):
+        start = self.day - timedelta(days=2)
+        call_command('snapshot_inventory', '--from', start.isoformat(), '--to', self.day.isoformat(),
+                     stdout=io.StringIO())
+        self.assertEqual(InventorySnapshot.objects.count(), 3)
+        # Before the expired batch expired, and before the fresh one arrived
+        self.assertEqual(self.row(start), {'on_hand': 5, 'sellable': 5, 'expiring': 5, 'value': Decimal('12.50')})
+        self.assertEqual(self.row(self.day - timedelta(days=1))['on_hand'], 105)
+
+        client = APIClient()
+        report = client.get('/api/reports/inventory/', {'as_of': self.day.isoformat()}).data
+        self.assertEqual(report['asOf'], self.day)
+        self.assertEqual((report['totalProducts'], report['lowStockItems'], report['expiringItems']), (1, 0, 1))
+        self.assertEqual(report['stockLevels'][0]['current'], 75)
+        missing = client.get('/api/reports/inventory/', {'as_of': (self.day + timedelta(days=1)).isoformat()})
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(client.get('/api/reports/inventory/', {'as_of': 'last week'}).status_code, 400)
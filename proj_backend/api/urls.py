@@ -23,11 +23,20 @@ urlpatterns = [
     # Product endpoints
     path('products/', views.ProductListCreate.as_view(), name='product_list_create'),
     path('products/<int:pk>/', views.ProductDetail.as_view(), name='product_detail'),
+    path('products/search/', views.ProductSearch.as_view(), name='product_search'),
+    path('products/import/', views.import_products, name='product_import'),
+    path('products/snapshot/', views.catalog_snapshot_stats, name='catalog_snapshot_stats'),
     path('categories/', get_category_choices, name='category-choices'),
 
     # Product Batch endpoints
     path('batches/', views.ProductBatchListCreate.as_view(), name='batch_list_create'),
+    path('receipts/', views.GoodsReceiptListCreate.as_view(), name='goods_receipts'),
+    path('receipts/<int:pk>/', views.GoodsReceiptDetail.as_view(), name='goods_receipt_detail'),
+    path('batches/expired/', views.ExpiredBatchList.as_view(), name='expired_batches'),
+    path('batches/bulk/', views.bulk_update_batches, name='batch_bulk_update'),
     path('batches/<int:pk>/', views.ProductBatchDetail.as_view(), name='batch_detail'),
+    path('batches/<int:pk>/movements/', views.StockMovementListCreate.as_view(), name='batch_movements'),
+    path('batches/<int:pk>/balance/', views.batch_balance, name='batch_balance'),
     path('product/<int:product_id>/batches/', views.product_batches, name='product_batches'),
     path('product/<int:product_id>/batches/create/', views.create_product_batch, name='create_product_batch'),
     path('product/<int:product_id>/batches/<int:batch_id>/update/', views.update_product_batch, name='update_product_batch'),
@@ -39,6 +48,8 @@ urlpatterns = [
     path('dashboard/recent-orders/', views.recent_orders, name='recent_orders'),
 
     # Prescription endpoints
+    path('alerts/', views.StockAlertList.as_view(), name='stock_alerts'),
+    path('alerts/read/', views.mark_alerts_read, name='mark_alerts_read'),
     path('prescriptions/', views.PrescriptionListCreate.as_view(), name='prescription_list_create'),
     path('prescriptions/<int:pk>/', views.PrescriptionDetail.as_view(), name='prescription_detail'),
     path('prescriptions/<int:pk>/verify/', views.verify_prescription, name='verify_prescription'),
@@ -47,8 +58,10 @@ urlpatterns = [
 
     # Order endpoints
     path('orders/', views.OrderListCreate.as_view(), name='order-list-create'),
+    path('orders/mine/', views.MyOrderList.as_view(), name='my-orders'),
     path('orders/<int:pk>/', views.OrderDetail.as_view(), name='order-detail'),
     path('orders/<int:order_id>/status/', views.update_order_status, name='update-order-status'),
+    path('orders/<int:pk>/intake/', views.order_intake_status, name='order-intake'),
 
     # Report endpoints
     path('reports/sales/', views.SalesReportView.as_view(), name='sales-report'),
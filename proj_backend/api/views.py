@@ -1,28 +1,52 @@
 from rest_framework import permissions, status, generics
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.http import Http404
-from django.db.models import Sum, Count, Q, F
+from django.db.models import Sum, Count, Q, F, Min, OuterRef, Prefetch, Subquery, DecimalField, ExpressionWrapper
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 import json
 import csv
+import io
 from django.http import HttpResponse
-from django.db.models.functions import TruncDate
+from django.db.models.functions import Coalesce, TruncDate
 import os
 from django.conf import settings
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from django.urls import reverse
 
-from .models import CustomUser, Product, ProductBatch, Order, OrderItem, Prescription, Report
+from .models import CustomUser, GoodsReceipt, InventorySnapshot, Product, ProductBatch, Order, OrderIntake, OrderItem, Prescription, Report, StockAlert, StockMovement
 from .serializers import (
     UserSerializer, CreateUser, ProductSerializer, ProductBatchSerializer,
-    PrescriptionSerializer, OrderSerializer, OrderItemSerializer, ReportSerializer
+    PrescriptionSerializer, OrderSerializer, ReportSerializer,
+    StockMovementSerializer, StockAdjustmentSerializer, ExpiredBatchSerializer, ExpiredProductSerializer,
+    StockAlertSerializer, GoodsReceiptSerializer, GoodsReceiptDetailSerializer, OrderSummarySerializer
+)
+from .permissions import IsPharmacyStaff
+from .caching import catalog_conditional
+from .idempotency import idempotent
+from .catalog_snapshot import snapshot_response, snapshot_stats
+from .filters import ProductFilter
+from .search import search_products
+from .allocation import release_order_stock, return_stock, take_stock
+from .order_intake import QueueFull, check_queue_depth, queue_order, queue_position, wants_queue
+from .ledger import quantity_at
+from .receiving import ReceivingError, receive_goods
+from .inventory_snapshot import inventory_report
+from .batch_bulk import apply_batch_updates, get_config as get_bulk_update_config
+from .product_import import FORMATS, ProductImport, detect_format, get_config as get_import_config, read_rows
+from .pagination import (
+    ProductPagination, ProductBatchPagination, OrderPagination,
+    UserPagination, PrescriptionPagination, ReportPagination, SearchPagination,
+    StockMovementPagination, StockAlertPagination, GoodsReceiptPagination, OrderHistoryPagination
 )
-from .permissions import IsOwnerReadOnly, IsPharmacyStaff
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -81,6 +105,7 @@ class UserList(generics.ListAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
+    pagination_class = UserPagination
 
 class UserDetail(generics.RetrieveAPIView):
     queryset = CustomUser.objects.all()
@@ -146,16 +171,109 @@ def user_detail(request, pk):
 # -----------------------------
 # Product Views
 # -----------------------------
+def product_queryset(request):
+    """Products for ProductSerializer, prefetching batches only if the response uses them."""
+    if ProductSerializer.wants_any(request, ProductSerializer.batch_fields):
+        return Product.objects.catalog()
+    return Product.objects.all()
+
+@method_decorator(catalog_conditional, name='get')
 class ProductListCreate(generics.ListCreateAPIView):
-    queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = ProductPagination
+
+    def get_product_filter(self):
+        if not hasattr(self, '_product_filter'):
+            self._product_filter = ProductFilter(self.request.query_params)
+        return self._product_filter
+
+    def get_queryset(self):
+        return self.get_product_filter().filter_queryset(product_queryset(self.request))
+
+    def list(self, request, *args, **kwargs):
+        cached = snapshot_response(request)
+        if cached is not None:
+            return cached
+        response = super().list(request, *args, **kwargs)
+        # Facets ride along with paginated pages; the legacy plain list has no room for them
+        if isinstance(response.data, dict):
+            response.data['facets'] = self.get_product_filter().facet_counts()
+        return response
 
+@method_decorator(catalog_conditional, name='get')
 class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        return product_queryset(self.request)
+
+@method_decorator(catalog_conditional, name='get')
+class ProductSearch(generics.ListAPIView):
+    serializer_class = ProductSerializer
+    permission_classes = [AllowAny]
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'A search query is required.'})
+        return search_products(product_queryset(self.request), query)
+
+@api_view(['POST'])
+@permission_classes([IsPharmacyStaff])
+def import_products(request):
+    """
+    Creates or updates products from an uploaded CSV or NDJSON `file`. Optional
+    fields: `format` (csv/ndjson, default from the file name), `chunk_size`
+    and `update_existing` (default true).
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({"error": "Upload a CSV or NDJSON file as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_format = request.data.get('format') or detect_format(upload.name)
+    if file_format not in FORMATS:
+        return Response({"error": f"Format must be one of: {', '.join(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        chunk_size = int(request.data.get('chunk_size') or get_import_config().get('CHUNK_SIZE', 500))
+    except ValueError:
+        chunk_size = 0
+    if not 1 <= chunk_size <= get_import_config().get('MAX_CHUNK_SIZE', 5000):
+        return Response({"error": "Invalid chunk_size."}, status=status.HTTP_400_BAD_REQUEST)
+    update_existing = str(request.data.get('update_existing', 'true')).lower() not in ('false', '0', 'no')
+
+    # The report keeps the first MAX_REPORTED_ERRORS errors; the totals count all of them
+    errors = []
+    max_errors = get_import_config().get('MAX_REPORTED_ERRORS', 1000)
+
+    def on_error(row_number, row_errors):
+        if len(errors) < max_errors:
+            errors.append({'row': row_number, 'errors': row_errors})
+
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    product_import = ProductImport(chunk_size=chunk_size, update_existing=update_existing, on_error=on_error)
+    try:
+        product_import.run(read_rows(stream, file_format))
+    except (UnicodeDecodeError, csv.Error) as e:
+        return Response({
+            "error": f"Could not read the file: {e}",
+            **product_import.summary(),
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        **product_import.summary(),
+        'errors': errors,
+        'errors_truncated': product_import.failed > len(errors),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsPharmacyStaff])
+def catalog_snapshot_stats(request):
+    return Response(snapshot_stats())
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_category_choices(request):
@@ -165,16 +283,234 @@ def get_category_choices(request):
 # -----------------------------
 # Product Batch Views
 # -----------------------------
-class ProductBatchListCreate(generics.ListCreateAPIView):
+def batch_queryset(request):
+    """Batches for ProductBatchSerializer; stock_status reads the product's threshold."""
     queryset = ProductBatch.objects.all()
+    if ProductBatchSerializer.wants_any(request, ['stock_status']):
+        queryset = queryset.select_related('product')
+    return queryset
+
+@method_decorator(catalog_conditional, name='get')
+class ProductBatchListCreate(generics.ListCreateAPIView):
     serializer_class = ProductBatchSerializer
     permission_classes = [AllowAny]
+    pagination_class = ProductBatchPagination
 
+    def get_queryset(self):
+        return batch_queryset(self.request)
+
+@method_decorator(catalog_conditional, name='get')
 class ProductBatchDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ProductBatch.objects.all()
     serializer_class = ProductBatchSerializer
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        return batch_queryset(self.request)
+
+def expired_stock(today=None):
+    """Batches past their expiration date that still hold units, active or not."""
+    today = today or timezone.now().date()
+    return ProductBatch.objects.filter(expiration_date__lt=today, quantity__gt=0)
+
+@method_decorator(catalog_conditional, name='get')
+class ExpiredBatchList(generics.ListAPIView):
+    """
+    Expired stock, earliest expiry first, with the product fields included.
+    ?group=product returns one row per product with its expired units and
+    value instead. Paginated responses carry the totals over all pages. The
+    sweeper deactivates expired batches, so inactive ones are listed as well.
+    """
+    permission_classes = [AllowAny]
+
+    def group_by_product(self):
+        group = self.request.query_params.get('group', '')
+        if group not in ('', 'product'):
+            raise ValidationError({'group': "Use group=product or leave it out."})
+        return group == 'product'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = ProductPagination() if self.group_by_product() else ProductBatchPagination()
+        return self._paginator
+
+    def get_serializer_class(self):
+        return ExpiredProductSerializer if self.group_by_product() else ExpiredBatchSerializer
+
+    def get_queryset(self):
+        today = timezone.now().date()
+        if self.group_by_product():
+            return Product.objects.filter(
+                batches__expiration_date__lt=today, batches__quantity__gt=0
+            ).annotate(
+                expired_batches=Count('batches'),
+                expired_units=Sum('batches__quantity'),
+                expired_value=Sum(F('batches__quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+                earliest_expiry=Min('batches__expiration_date'),
+            )
+        return expired_stock(today).select_related('product').annotate(
+            value=ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, dict):
+            totals = expired_stock().aggregate(
+                batches=Count('id'),
+                products=Count('product', distinct=True),
+                units=Sum('quantity'),
+                value=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            )
+            response.data['totals'] = {
+                **totals,
+                'units': totals['units'] or 0,
+                'value': f"{totals['value'] or 0:.2f}",
+            }
+        return response
+
+@api_view(['PATCH'])
+@permission_classes([IsPharmacyStaff])
+@idempotent
+def bulk_update_batches(request):
+    """
+    Updates many batches at once. The body is a list of partial updates, each
+    with the batch `id`; the response has one result per item, in order.
+    Valid items are saved even when others are rejected.
+    """
+    items = request.data
+    if not isinstance(items, list) or not items:
+        return Response({"error": "Send a list of batch updates."}, status=status.HTTP_400_BAD_REQUEST)
+    max_items = get_bulk_update_config().get('MAX_ITEMS', 5000)
+    if len(items) > max_items:
+        return Response({"error": f"At most {max_items} batches can be updated at once."}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = apply_batch_updates(items, user=request.user)
+    updated = sum(1 for result in results if result['status'] == 'updated')
+    return Response({
+        'updated': updated,
+        'failed': len(results) - updated,
+        'results': results,
+    }, status=status.HTTP_200_OK if updated else status.HTTP_400_BAD_REQUEST)
+
+@method_decorator(idempotent, name='post')
+class GoodsReceiptListCreate(generics.ListCreateAPIView):
+    """
+    GET: received deliveries, newest first.
+    POST: books a delivery. The header fields (reference, supplier,
+    received_on, notes) come with either a `batches` list in a JSON body or
+    a CSV/NDJSON `file` upload; each line has product (id) or product_name,
+    batch_code, quantity and expiration_date. Any invalid line rejects the
+    whole delivery and every error is reported by line.
+    """
+    serializer_class = GoodsReceiptSerializer
+    permission_classes = [IsPharmacyStaff]
+    pagination_class = GoodsReceiptPagination
+
+    def get_queryset(self):
+        return GoodsReceipt.objects.select_related('created_by')
+
+    def create(self, request, *args, **kwargs):
+        header = GoodsReceiptSerializer(data=request.data)
+        header.is_valid(raise_exception=True)
+
+        upload = request.FILES.get('file')
+        if upload is not None:
+            file_format = request.data.get('format') or detect_format(upload.name)
+            if file_format not in FORMATS:
+                return Response({"error": f"Format must be one of: {', '.join(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            lines = read_rows(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''), file_format)
+        else:
+            batches = request.data.get('batches')
+            if not isinstance(batches, list):
+                return Response({"error": "Send the delivery as a 'batches' list or a CSV/NDJSON 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+            lines = (
+                (line, item, None if isinstance(item, dict) else 'Each line must be an object.')
+                for line, item in enumerate(batches, start=1)
+            )
+
+        try:
+            receipt = receive_goods(header.validated_data, lines, user=request.user)
+        except ReceivingError as e:
+            return Response({"error": "The delivery was not received.", "lines": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({"error": f"Could not read the file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(GoodsReceiptSerializer(receipt).data, status=status.HTTP_201_CREATED)
+
+class GoodsReceiptDetail(generics.RetrieveAPIView):
+    serializer_class = GoodsReceiptDetailSerializer
+    permission_classes = [IsPharmacyStaff]
+
+    def get_queryset(self):
+        return GoodsReceipt.objects.select_related('created_by').prefetch_related(
+            Prefetch('batches', queryset=ProductBatch.objects.select_related('product'))
+        )
+
+@method_decorator(idempotent, name='post')
+class StockMovementListCreate(generics.ListCreateAPIView):
+    """
+    GET: the ledger of a batch, newest first.
+    POST: a write-off or count correction, see StockAdjustmentSerializer.
+    """
+    serializer_class = StockMovementSerializer
+    permission_classes = [IsPharmacyStaff]
+    pagination_class = StockMovementPagination
+
+    def get_queryset(self):
+        return StockMovement.objects.filter(batch_id=self.kwargs['pk'])
+
+    def create(self, request, *args, **kwargs):
+        try:
+            batch = ProductBatch.objects.get(pk=self.kwargs['pk'])
+        except ProductBatch.DoesNotExist:
+            return Response({"error": "Batch not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        adjustment = StockAdjustmentSerializer(data=request.data)
+        adjustment.is_valid(raise_exception=True)
+        kind, quantity, reason = (adjustment.validated_data[key] for key in ('kind', 'quantity', 'reason'))
+
+        with transaction.atomic():
+            if quantity < 0:
+                if not take_stock(batch.pk, -quantity):
+                    return Response(
+                        {"error": f"Batch {batch.batch_code} holds fewer than {-quantity} units"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            else:
+                return_stock(batch.pk, quantity)
+            movement = StockMovement.record(batch, kind, quantity, reason=reason, user=request.user)
+            Product.objects.filter(pk=batch.product_id).refresh_stock_summary()
+
+        return Response(StockMovementSerializer(movement).data, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsPharmacyStaff])
+def batch_balance(request, pk):
+    """The quantity of a batch according to the ledger, now or ?at= a past ISO date/time."""
+    try:
+        batch = ProductBatch.objects.get(pk=pk)
+    except ProductBatch.DoesNotExist:
+        return Response({"error": "Batch not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    at = timezone.now()
+    if request.query_params.get('at'):
+        try:
+            # A date means the end of that day; parse_datetime() would read it as midnight
+            day = parse_date(request.query_params['at'])
+            at = datetime.combine(day, time.max) if day is not None else parse_datetime(request.query_params['at'])
+        except ValueError:
+            at = None
+        if at is None:
+            return Response({"error": "Invalid 'at', use an ISO date/time"}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+
+    return Response({
+        'batch': batch.pk,
+        'at': at,
+        'quantity': quantity_at(batch.pk, at),
+        'current_quantity': batch.quantity,
+    })
+
 class ProductBatchesView(APIView):
     permission_classes = [AllowAny]
 
@@ -241,6 +577,7 @@ class ProductBatchesView(APIView):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent
 def create_product_batch(request, product_id):
     try:
         product = Product.objects.get(id=product_id)
@@ -383,12 +720,64 @@ def recent_orders(request):
         'total': order.total_amount
     } for order in orders])
 
+# -----------------------------
+# Stock Alert Views
+# -----------------------------
+class StockAlertList(generics.ListAPIView):
+    """
+    The staff alert feed, newest first. ?unread=true leaves out read alerts,
+    ?since=<id> returns only alerts newer than the given one, so pollers can
+    ask for just what they have not seen. Paginated responses include the
+    number of unread alerts.
+    """
+    serializer_class = StockAlertSerializer
+    permission_classes = [IsPharmacyStaff]
+    pagination_class = StockAlertPagination
+
+    def get_queryset(self):
+        alerts = StockAlert.objects.select_related('product', 'batch')
+        params = self.request.query_params
+        if params.get('unread', '').lower() in ('true', '1', 'yes'):
+            alerts = alerts.filter(read_at__isnull=True)
+        if params.get('kind'):
+            alerts = alerts.filter(kind=params['kind'])
+        if params.get('since'):
+            try:
+                alerts = alerts.filter(id__gt=int(params['since']))
+            except ValueError:
+                raise ValidationError({'since': 'Must be an alert id.'})
+        return alerts
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, dict):
+            response.data['unread_count'] = StockAlert.objects.filter(read_at__isnull=True).count()
+        return response
+
+@api_view(['POST'])
+@permission_classes([IsPharmacyStaff])
+def mark_alerts_read(request):
+    """Marks the alerts listed in `ids` as read, or every unread alert with `all: true`."""
+    alerts = StockAlert.objects.filter(read_at__isnull=True)
+    if request.data.get('all') is not True:
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            return Response({"error": "Send a list of alert ids as 'ids', or 'all': true."}, status=status.HTTP_400_BAD_REQUEST)
+        alerts = alerts.filter(pk__in=ids)
+
+    marked = alerts.update(read_at=timezone.now(), read_by=request.user)
+    return Response({
+        'marked': marked,
+        'unread_count': StockAlert.objects.filter(read_at__isnull=True).count(),
+    })
+
 # -----------------------------
 # Prescription Views
 # -----------------------------
 class PrescriptionListCreate(generics.ListCreateAPIView):
     serializer_class = PrescriptionSerializer
     permission_classes = [AllowAny]
+    pagination_class = PrescriptionPagination
 
     def get_queryset(self):
         return Prescription.objects.all()
@@ -443,12 +832,27 @@ def pending_prescriptions(request):
 # -----------------------------
 # Order Views
 # -----------------------------
+def order_queryset(request):
+    """Orders for OrderSerializer, loading only the relations the response uses."""
+    queryset = Order.objects.all()
+    if OrderSerializer.wants_any(request, ['customer_name']):
+        queryset = queryset.select_related('customer')
+    if OrderSerializer.wants_any(request, OrderSerializer.prescription_fields):
+        queryset = queryset.with_prescription_info()
+    if OrderSerializer.wants_any(request, OrderSerializer.item_fields):
+        queryset = queryset.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('batch__product'))
+        )
+    return queryset
+
+@method_decorator(idempotent, name='post')
 class OrderListCreate(generics.ListCreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]
+    pagination_class = OrderPagination
 
     def get_queryset(self):
-        return Order.objects.all().order_by('-order_date')
+        return order_queryset(self.request).order_by('-order_date')
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -460,6 +864,23 @@ class OrderListCreate(generics.ListCreateAPIView):
             # Log incoming request data
             print("Request Data:", request.data)
             print("Request Files:", request.FILES)
+
+            # Shed load before parsing anything when the intake queue is full
+            queued = wants_queue(request)
+            if queued:
+                if not request.user.is_authenticated:
+                    return Response(
+                        {"error": "User must be authenticated to create an order"},
+                        status=status.HTTP_401_UNAUTHORIZED
+                    )
+                try:
+                    check_queue_depth(request.user)
+                except QueueFull as e:
+                    return Response(
+                        {"error": str(e)},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={'Retry-After': str(e.retry_after)}
+                    )
             
             # Parse order data from form data
             order_data_str = request.data.get('order_data')
@@ -495,27 +916,96 @@ class OrderListCreate(generics.ListCreateAPIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            if queued:
+                # Stock is taken by a process_order_queue worker, see api.order_intake
+                order = queue_order(serializer.validated_data, request.user)
+                status_url = request.build_absolute_uri(reverse('order-intake', args=[order.pk]))
+                return Response(
+                    {'id': order.pk, 'status': order.status, 'status_url': status_url},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': status_url}
+                )
+
             self.perform_create(serializer)
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
-            
-        except Exception as e:
-            print("Unexpected Error:", str(e))
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+
+        except ValidationError as e:
+            # Raised while allocating stock, after the serializer validated
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        # Anything else is a server error (500), which is not stored for an
+        # Idempotency-Key, so the client can retry it
+
+def order_history_queryset(request):
+    """The requesting customer's orders for OrderSummarySerializer, with per-row subqueries only."""
+    queryset = Order.objects.filter(customer=request.user)
+    if OrderSummarySerializer.wants_any(request, ['prescription_status']):
+        queryset = queryset.with_prescription_info()
+    if OrderSummarySerializer.wants_any(request, ['total_quantity']):
+        units = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(units=Sum('quantity')).values('units')
+        queryset = queryset.annotate(total_quantity=Coalesce(Subquery(units), 0))
+    if OrderSummarySerializer.wants_any(request, ['items']):
+        queryset = queryset.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('batch__product'))
+        )
+    return queryset
+
+class MyOrderList(generics.ListAPIView):
+    """
+    GET: the signed-in customer's own orders, newest first, as summaries;
+    ?expand=items adds the items. Paged by cursor over the (customer,
+    order_date) index, so a page costs the same for 5 orders as for 5,000.
+    """
+    serializer_class = OrderSummarySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderHistoryPagination
+
+    def get_queryset(self):
+        return order_history_queryset(self.request)
+
+@api_view(['GET'])
+def order_intake_status(request, pk):
+    """
+    Progress of an order accepted by the intake queue: `status` is queued,
+    processing, done or rejected, with the reasons in `errors` and the order
+    once it is done. Only the customer and pharmacy staff can see it.
+    """
+    try:
+        intake = OrderIntake.objects.select_related('order').get(order_id=pk)
+    except OrderIntake.DoesNotExist:
+        return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+    user = request.user
+    if not user.is_authenticated or (
+        intake.order.customer_id != user.pk and user.userrole not in ['Admin', 'Pharmacy Staff']
+    ):
+        return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    data = {
+        'id': intake.order_id,
+        'status': intake.status,
+        'order_status': intake.order.status,
+        'errors': intake.errors,
+        'queue_position': queue_position(intake),
+        'queued_at': intake.created_at,
+        'finished_at': intake.finished_at,
+    }
+    if intake.status == OrderIntake.DONE:
+        data['order'] = OrderSerializer(intake.order, context={'request': request}).data
+    return Response(data)
 
 class OrderDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        return order_queryset(self.request)
+
     def get_object(self):
         return super().get_object()
 
 @api_view(['PUT'])
 @permission_classes([AllowAny])
+@idempotent
 def update_order_status(request, order_id):
     try:
         order = Order.objects.get(id=order_id)
@@ -527,6 +1017,13 @@ def update_order_status(request, order_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Queued orders get their status from the intake queue
+        if 'Queued' in (order.status, new_status) or 'Rejected' in (order.status, new_status):
+            return Response(
+                {"error": "Queued and rejected orders are managed by the order intake queue"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         # Validate status transition
         if order.status == 'Completed' and new_status != 'Completed':
             return Response(
@@ -540,9 +1037,18 @@ def update_order_status(request, order_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Update order status
-        order.status = new_status
-        order.save()
+        # Update order status; only if nobody changed it meanwhile, so a
+        # cancellation cannot put the stock back twice
+        with transaction.atomic():
+            updated = Order.objects.filter(pk=order.pk, status=order.status).update(status=new_status)
+            if not updated:
+                return Response(
+                    {"error": "The order status was changed by someone else, reload and try again"},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if new_status == 'Cancelled' and order.status != 'Cancelled':
+                release_order_stock(order, user=request.user)
+        order.refresh_from_db()
 
         return Response(OrderSerializer(order, context={'request': request}).data)
 
@@ -559,6 +1065,7 @@ class ReportViewSet(viewsets.ModelViewSet):
     queryset = Report.objects.all()
     serializer_class = ReportSerializer
     permission_classes = [AllowAny]
+    pagination_class = ReportPagination
 
     def get_queryset(self):
         return Report.objects.all()
@@ -566,6 +1073,24 @@ class ReportViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save()
 
+def day_bounds(start_date, end_date):
+    """
+    The datetimes [start, end) spanning the days start_date to end_date in the
+    current time zone, or None if a date is invalid. Filters on these compare
+    the column itself and can use its index; a __date lookup converts every
+    row's value first.
+    """
+    try:
+        start, end = parse_date(str(start_date)), parse_date(str(end_date))
+    except ValueError:
+        return None
+    if start is None or end is None:
+        return None
+    return (
+        timezone.make_aware(datetime.combine(start, time.min)),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+
 class SalesReportView(APIView):
     permission_classes = [AllowAny]
 
@@ -575,12 +1100,16 @@ class SalesReportView(APIView):
 
         if not start_date or not end_date:
             return Response({'error': 'Start date and end date are required'}, status=400)
+        bounds = day_bounds(start_date, end_date)
+        if bounds is None:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=400)
+        start, end = bounds
 
         # Get completed orders within date range
         orders = Order.objects.filter(
             status='Completed',
-            order_date__date__gte=start_date,
-            order_date__date__lte=end_date
+            order_date__gte=start,
+            order_date__lt=end
         )
 
         # Calculate total sales and orders
@@ -629,6 +1158,10 @@ class SalesReportView(APIView):
 
         if not start_date or not end_date:
             return Response({'error': 'Start date and end date are required'}, status=400)
+        bounds = day_bounds(start_date, end_date)
+        if bounds is None:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=400)
+        start, end = bounds
 
         # Create report record without generated_by for unauthenticated users
         report_data = {
@@ -653,8 +1186,8 @@ class SalesReportView(APIView):
         # Get daily sales data
         orders = Order.objects.filter(
             status='Completed',
-            order_date__date__gte=start_date,
-            order_date__date__lte=end_date
+            order_date__gte=start,
+            order_date__lt=end
         )
 
         daily_sales = orders.annotate(
@@ -684,10 +1217,34 @@ class SalesReportView(APIView):
 
         return response
 
+def parse_as_of(value):
+    """The day of an ?as_of= parameter, or None if it is not a YYYY-MM-DD date."""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
 class InventoryReportView(APIView):
+    """
+    Current stock by default. With as_of=YYYY-MM-DD the report describes the
+    end of that day and is read from its daily inventory snapshot.
+    """
     permission_classes = [AllowAny]
 
+    def snapshot_report(self, value):
+        day = parse_as_of(value)
+        if day is None:
+            return None, Response({'error': 'as_of must be a date in YYYY-MM-DD format'}, status=400)
+        data = inventory_report(day)
+        if data is None:
+            return None, Response({'error': f'No inventory snapshot for {day}'}, status=404)
+        return data, None
+
     def get(self, request):
+        if request.query_params.get('as_of'):
+            data, error = self.snapshot_report(request.query_params['as_of'])
+            return error or Response(data)
+
         # Get inventory statistics
         total_products = Product.objects.count()
         low_stock_items = ProductBatch.objects.filter(
@@ -736,11 +1293,21 @@ class InventoryReportView(APIView):
         return Response(data)
 
     def post(self, request):
+        report_day = timezone.now().date()
+        snapshot = None
+        if request.data.get('as_of'):
+            report_day = parse_as_of(request.data['as_of'])
+            if report_day is None:
+                return Response({'error': 'as_of must be a date in YYYY-MM-DD format'}, status=400)
+            snapshot = list(InventorySnapshot.objects.filter(date=report_day).order_by('product_name', 'product_id'))
+            if not snapshot:
+                return Response({'error': f'No inventory snapshot for {report_day}'}, status=404)
+
         # Create report record without generated_by for unauthenticated users
         report_data = {
             'report_type': 'inventory',
-            'start_date': timezone.now().date(),
-            'end_date': timezone.now().date(),
+            'start_date': report_day,
+            'end_date': report_day,
         }
         
         # Only add generated_by if user is authenticated
@@ -765,18 +1332,28 @@ class InventoryReportView(APIView):
             'Total Value'
         ])
 
-        # Get stock levels with product details
-        stock_levels = ProductBatch.objects.filter(
-            is_active=True
-        ).values(
-            'product__product_name',
-            'product__brand_name',
-            'product__category',
-            'product__price'
-        ).annotate(
-            current=Sum('quantity'),
-            threshold=F('product__low_stock_threshold')
-        )
+        if snapshot:
+            stock_levels = [{
+                'product__product_name': row.product_name,
+                'product__brand_name': row.brand_name,
+                'product__category': row.category,
+                'product__price': row.price,
+                'current': row.on_hand,
+                'threshold': row.low_stock_threshold,
+            } for row in snapshot]
+        else:
+            # Get stock levels with product details
+            stock_levels = ProductBatch.objects.filter(
+                is_active=True
+            ).values(
+                'product__product_name',
+                'product__brand_name',
+                'product__category',
+                'product__price'
+            ).annotate(
+                current=Sum('quantity'),
+                threshold=F('product__low_stock_threshold')
+            )
 
         for item in stock_levels:
             status = 'Low Stock' if item['current'] <= item['threshold'] else 'Adequate'
@@ -813,11 +1390,15 @@ class PrescriptionReportView(APIView):
 
         if not start_date or not end_date:
             return Response({'error': 'Start date and end date are required'}, status=400)
+        bounds = day_bounds(start_date, end_date)
+        if bounds is None:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=400)
+        start, end = bounds
 
         # Get prescription statistics
         prescriptions = Prescription.objects.filter(
-            uploaded_at__date__gte=start_date,
-            uploaded_at__date__lte=end_date
+            uploaded_at__gte=start,
+            uploaded_at__lt=end
         )
 
         total_prescriptions = prescriptions.count()
@@ -848,6 +1429,10 @@ class PrescriptionReportView(APIView):
 
         if not start_date or not end_date:
             return Response({'error': 'Start date and end date are required'}, status=400)
+        bounds = day_bounds(start_date, end_date)
+        if bounds is None:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=400)
+        start, end = bounds
 
         # Create report record without generated_by for unauthenticated users
         report_data = {
@@ -871,8 +1456,8 @@ class PrescriptionReportView(APIView):
 
         # Get daily prescription data
         prescriptions = Prescription.objects.filter(
-            uploaded_at__date__gte=start_date,
-            uploaded_at__date__lte=end_date
+            uploaded_at__gte=start,
+            uploaded_at__lt=end
         )
 
         daily_prescriptions = prescriptions.annotate(
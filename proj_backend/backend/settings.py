@@ -45,6 +45,15 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'if-modified-since',
+    'idempotency-key',
+]
+
+CORS_EXPOSE_HEADERS = [
+    'etag',
+    'last-modified',
+    'idempotent-replayed',
 ]
 
 AUTH_USER_MODEL = 'api.CustomUser' 
@@ -96,6 +105,103 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Keyset pagination for the list endpoints (see api/pagination.py)
+API_PAGINATION = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 500,
+    'PAGE_SIZES': {
+        'products': 50,
+        'batches': 100,
+        'orders': 25,
+        'order_history': 20,
+        'users': 50,
+        'prescriptions': 25,
+        'reports': 25,
+        'search': 20,
+        'movements': 100,
+        'alerts': 50,
+        'receipts': 25,
+    },
+    # Lets clients request the old unpaginated list with ?paginate=false
+    'ALLOW_UNPAGINATED': True,
+}
+
+PRODUCT_IMPORT = {
+    # Rows validated and written per transaction
+    'CHUNK_SIZE': 500,
+    'MAX_CHUNK_SIZE': 5000,
+    # Rejected rows listed in an import API response
+    'MAX_REPORTED_ERRORS': 1000,
+}
+
+# Pre-rendered copy of the anonymous ?paginate=false product list, see api/catalog_snapshot.py
+CATALOG_SNAPSHOT = {
+    'ENABLED': True,
+    # Seconds a process trusts its last read of the catalog version; changes
+    # made by other processes show up after at most this long
+    'VERSION_CHECK_INTERVAL': 1.0,
+    'BUILD_IN_BACKGROUND': True,
+}
+
+BATCH_BULK_UPDATE = {
+    # Items accepted by one PATCH /api/batches/bulk/ request
+    'MAX_ITEMS': 5000,
+    # Rows per UPDATE statement
+    'BATCH_SIZE': 500,
+}
+
+GOODS_RECEIVING = {
+    # Batches accepted in one delivery
+    'MAX_LINES': 5000,
+    # Rows per INSERT statement
+    'BATCH_SIZE': 500,
+}
+
+INVENTORY_SNAPSHOT = {
+    # Sellable units expiring within this many days count as expiring
+    'EXPIRY_WINDOW_DAYS': 30,
+}
+
+STOCK_ALERTS = {
+    # Batches expiring within this many days get an expiry alert
+    'EXPIRY_HORIZON_DAYS': 30,
+}
+
+ORDER_INTAKE = {
+    # 'sync' fills orders during checkout; 'async' queues every order and
+    # answers 202; 'prefer' queues those sent with "Prefer: respond-async".
+    # Queued orders are filled by the process_order_queue command.
+    'MODE': 'sync',
+    # Unfinished queued orders, in total and per customer, before checkout answers 429
+    'MAX_DEPTH': 500,
+    'MAX_DEPTH_PER_CUSTOMER': 5,
+    'RETRY_AFTER_SECONDS': 30,
+    'WORKERS': 4,
+    'POLL_INTERVAL': 0.5,
+    # Queued orders a worker looks at when picking the next one
+    'SCAN_SIZE': 200,
+    # An order a worker has held this long without finishing is taken over
+    'STALE_AFTER_SECONDS': 300,
+    'MAX_ATTEMPTS': 3,
+}
+
+IDEMPOTENCY = {
+    # Hours a stored response is replayed for an Idempotency-Key retry; older
+    # keys are removed by the purge_idempotency_keys command
+    'TTL_HOURS': 24,
+    # A retry that finds the first request still running after this many
+    # seconds takes the key over, e.g. when that worker crashed; keep it above
+    # the longest request
+    'LEASE_SECONDS': 60,
+}
+
+BATCH_SWEEPER = {
+    # Run the expiry sweep from a thread in each web process; leave off when
+    # the sweep_batches command is scheduled with cron instead
+    'SCHEDULE': False,
+    'INTERVAL_MINUTES': 60,
+}
+
 # Middleware
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -172,3 +278,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Media files (user-uploaded content)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Resized copies of product images (see api/renditions.py); sizes are the
+# longest edge in pixels
+PRODUCT_IMAGE_RENDITIONS = {
+    'SIZES': {
+        'thumbnail': 160,
+        'card': 400,
+        'detail': 1000,
+    },
+    'WORKERS': 2,
+    # Render in a background thread after the upload commits
+    'ASYNC': True,
+}